@@ -0,0 +1,124 @@
+# Copyright (c) 2020 Fredrick Levine
+# rick@xoab.us
+#
+# This file is part of Droplet Video Analyzer
+# https://github.com/rlevine/droplet_video_analyzer
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+###
+
+import argparse
+import time
+import numpy as np
+from scipy.spatial import cKDTree
+
+from utils.assignment import ASSIGNMENT_ENGINES
+from utils.assignment import assign
+
+"""
+
+Throughput and match quality of the tracker's assignment engines.
+
+    python -m benchmarks.assignment --droplets 2000 --frames 30
+
+Each synthetic frame has a set of history droplets, and a set of current droplets:
+most are the history droplets moved a few pixels, the rest are new. Candidate pairs
+are gated at the distance threshold, as in Tracker.update(), and each engine is
+timed on the same candidates. Reported per engine: time per frame, matches, how
+many of those are the true continuation of the history droplet, and total cost.
+
+"""
+
+
+def make_frame(random, droplet_count, frame_shape, distance_threshold):
+    """
+    Return candidate arrays (rows, columns, distances, costs, true columns) for
+    one synthetic frame.
+    """
+    history = random.uniform((0, 0), frame_shape, (droplet_count, 2))
+    moved = history + random.normal(0, distance_threshold / 8, history.shape)
+    new = random.uniform((0, 0), frame_shape, (droplet_count // 4, 2))
+    current = np.concatenate((moved, new))
+    order = random.permutation(len(current))
+    current = current[order]
+    true_columns = np.argsort(order)[:droplet_count]
+
+    pairs = cKDTree(history).sparse_distance_matrix(
+        cKDTree(current), distance_threshold, output_type="ndarray"
+    )
+    rows = pairs["i"].astype(np.int64)
+    columns = pairs["j"].astype(np.int64)
+    distances = pairs["v"]
+    # True continuations look alike; other pairs mostly don't.
+    similarity = np.where(
+        true_columns[rows] == columns,
+        random.uniform(0.0, 0.5, len(rows)),
+        random.uniform(0.2, 3.0, len(rows)),
+    )
+
+    return rows, columns, distances, distances * similarity, true_columns
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the tracker's assignment engines."
+    )
+    parser.add_argument("--droplets", type=int, default=2000, help="droplets per frame")
+    parser.add_argument("--frames", type=int, default=30, help="frames to time")
+    parser.add_argument("--distance-threshold", type=float, default=40)
+    parser.add_argument("--droplet-similarity", type=float, default=30)
+    argv = parser.parse_args(args)
+
+    random = np.random.default_rng(0)
+    frames = [
+        make_frame(random, argv.droplets, (1920, 1080), argv.distance_threshold)
+        for _ in range(argv.frames)
+    ]
+    pair_count = sum(len(frame[0]) for frame in frames)
+    print(
+        "{} frames, {} droplets per frame, {:.1f} candidate pairs per droplet".format(
+            argv.frames, argv.droplets, pair_count / (argv.frames * argv.droplets)
+        )
+    )
+
+    for engine in ASSIGNMENT_ENGINES:
+        seconds = 0.0
+        matches = correct = 0
+        total_cost = 0.0
+        for rows, columns, distances, costs, true_columns in frames:
+            start = time.perf_counter()
+            tried, accepted = assign(
+                engine, rows, columns, distances, costs, argv.droplet_similarity
+            )
+            seconds += time.perf_counter() - start
+
+            matched = tried[accepted]
+            matches += len(matched)
+            correct += int((true_columns[rows[matched]] == columns[matched]).sum())
+            total_cost += float(costs[matched].sum())
+
+        print(
+            "{:>8}: {:7.2f} ms/frame, {} matches, {} correct ({:.1f}%), total cost {:.0f}".format(
+                engine,
+                seconds / argv.frames * 1000,
+                matches,
+                correct,
+                100 * correct / (argv.frames * argv.droplets),
+                total_cost,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+# Copyright (c) 2020 Fredrick Levine
+# rick@xoab.us
+#
+# This file is part of Droplet Video Analyzer
+# https://github.com/rlevine/droplet_video_analyzer
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+###
+
+import argparse
+import time
+import numpy as np
+
+from droplet.DropletStore import DropletIndex
+from droplet.DropletStore import DropletStore
+from droplet.DropletStore import FrameDropletIndex
+from droplet.DropletStore import FrameIndex
+from droplet.IdAllocator import IdAllocator
+from tracker.GlobalAssociator import GlobalAssociator
+from tracker.TrackRecord import TrackRecord
+from tracker.Tracker import Tracker
+from utils.assignment import ASSIGNMENT_ENGINES
+
+"""
+
+Throughput and link quality of the per-frame tracker against the global
+associator, on a dense synthetic recording.
+
+    python -m benchmarks.association --droplets 1000 --frames 60
+
+Droplets appear at random, fly in straight lines for a few frames, with a little
+jitter, and disappear; some sightings are missed. Each engine tracks the whole
+recording from the same droplet store. Reported per engine: detections tracked
+per second, links made, and how many of those join two sightings of the same
+droplet.
+
+"""
+
+ANGLES = np.linspace(0, 2 * np.pi, 12, endpoint=False)
+
+
+class SyntheticMaster:
+    # Stand-in for VideoFilePreprocessor: the store, and the indices over it.
+    def __init__(self, droplet_store):
+        self.droplet_store = droplet_store
+        self.frames = FrameIndex(droplet_store)
+        self.index_by_droplet = DropletIndex(droplet_store)
+        self.index_by_frame = FrameDropletIndex(droplet_store)
+        self.droplet_counts_by_frame = np.diff(
+            droplet_store.frame_starts, append=len(droplet_store)
+        ).tolist()
+
+
+def build_recording(
+    frame_count, droplets_per_frame, frame_shape=(1920, 1080), miss_rate=0.05, seed=0
+):
+    """
+    Return a DropletStore of moving droplets, and the true droplet of each row.
+
+    :param frame_count: int number of frames
+    :param droplets_per_frame: int droplets in flight in each frame
+    :param frame_shape: (width, height) of the frame
+    :param miss_rate: float chance a sighting is missed
+    :param seed: int random seed
+    :return: (DropletStore, np array of true droplet numbers by row)
+    """
+    random = np.random.default_rng(seed)
+    store = DropletStore()
+    id_allocator = IdAllocator()
+
+    def launch(count):
+        return (
+            random.uniform((20, 20), np.subtract(frame_shape, 20), (count, 2)),
+            random.normal(0, 6, (count, 2)),
+            random.uniform(2, 8, count),
+            random.integers(3, 12, count),
+        )
+
+    positions, velocities, radii, lifetimes = launch(droplets_per_frame)
+    droplets = np.arange(droplets_per_frame)
+    next_droplet = droplets_per_frame
+    true_droplets = []
+
+    for frame_id in range(frame_count):
+        store.begin_frame(frame_id)
+        seen = random.uniform(size=len(droplets)) >= miss_rate
+        jitter = random.normal(0, 0.5, positions.shape)
+        for (x, y), radius, droplet in zip(
+            (positions + jitter)[seen], radii[seen], droplets[seen]
+        ):
+            contour = np.stack(
+                (x + radius * np.cos(ANGLES), y + radius * np.sin(ANGLES)), axis=1
+            )
+            row = store.add(id_allocator.allocate(), frame_id)
+            store.set_contour(row, contour.astype(np.int32).reshape(-1, 1, 2))
+            true_droplets.append(droplet)
+
+        # Move on; droplets at the end of their flight are replaced.
+        positions = positions + velocities
+        lifetimes = lifetimes - 1
+        ended = np.flatnonzero(lifetimes <= 0)
+        (
+            positions[ended],
+            velocities[ended],
+            radii[ended],
+            lifetimes[ended],
+        ) = launch(len(ended))
+        droplets[ended] = next_droplet + np.arange(len(ended))
+        next_droplet += len(ended)
+
+    return store, np.array(true_droplets)
+
+
+def link_quality(store, true_droplets):
+    # (links, links joining sightings of the same droplet)
+    edges = store.lineage_edges()
+    return len(edges), int(
+        (true_droplets[edges[:, 0]] == true_droplets[edges[:, 1]]).sum()
+    )
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the per-frame tracker against global association."
+    )
+    parser.add_argument("--droplets", type=int, default=1000, help="droplets per frame")
+    parser.add_argument("--frames", type=int, default=60, help="frames to track")
+    parser.add_argument("--distance-threshold", type=float, default=40)
+    parser.add_argument("--droplet-similarity", type=float, default=30)
+    parser.add_argument("--frame-history", type=int, default=2)
+    argv = parser.parse_args(args)
+
+    store, true_droplets = build_recording(argv.frames, argv.droplets)
+    master = SyntheticMaster(store)
+    print(
+        "{} frames, {} detections, {} droplets".format(
+            argv.frames, len(store), len(np.unique(true_droplets))
+        )
+    )
+
+    for engine in ASSIGNMENT_ENGINES + ("global",):
+        start = time.perf_counter()
+        if engine == "global":
+            track_record = TrackRecord()
+            GlobalAssociator(
+                frames_before_deregister=argv.frame_history,
+                distance_threshold=argv.distance_threshold,
+                confidence_threshold=argv.droplet_similarity,
+                droplet_master=master,
+            ).associate(track_record)
+            seconds = time.perf_counter() - start
+            # Apply the record, to count its links.
+            for frame_id in range(track_record.frame_count):
+                _, relocations = track_record.frame(frame_id)
+                for root, destination_row, droplet_id in relocations.tolist():
+                    store.relocate(root, destination_row, droplet_id)
+        else:
+            tracker = Tracker(
+                frames_before_deregister=argv.frame_history,
+                distance_threshold=argv.distance_threshold,
+                confidence_threshold=argv.droplet_similarity,
+                droplet_master=master,
+                assignment=engine,
+                VERBOSE=False,
+            )
+            for frame_id in range(argv.frames):
+                tracker.update(master.frames[frame_id].droplets, this_frame=frame_id)
+            seconds = time.perf_counter() - start
+
+        links, correct = link_quality(store, true_droplets)
+        store.undo_relocations(0)
+
+        print(
+            "{:>8}: {:8.0f} detections/s, {} links, {} correct ({:.1f}%)".format(
+                engine,
+                len(store) / seconds,
+                links,
+                correct,
+                100 * correct / max(links, 1),
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+# Copyright (c) 2020 Fredrick Levine
+# rick@xoab.us
+#
+# This file is part of Droplet Video Analyzer
+# https://github.com/rlevine/droplet_video_analyzer
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+###
+
+import argparse
+import time
+import tracemalloc
+import numpy as np
+
+from droplet.DropletStore import DropletStore
+from droplet.IdAllocator import IdAllocator
+from frame.Frame import Frame
+from frame.Label import Label
+from utils.Rectangle import Rectangle
+
+"""
+
+Memory and throughput benchmark for the per-droplet objects: Droplet views, Frames,
+Labels and their Rectangles.
+
+    python -m benchmarks.objects --droplets 2000 --frames 30
+
+A synthetic store of crowded frames is built first, and isn't counted. Then, for
+each frame, the benchmark makes the objects the second pass makes for it (a Frame,
+a Droplet view and a Label per droplet) and reads the fields the labeler reads.
+Reported memory is the peak traced allocation for one frame's objects, held at
+once, as they are while a frame is labeled.
+
+"""
+
+
+def build_store(frame_count, droplets_per_frame, frame_shape=(1920, 1080), seed=0):
+    """
+    Return a DropletStore of random, small, round droplets.
+
+    :param frame_count: int number of frames
+    :param droplets_per_frame: int droplets in each frame
+    :param frame_shape: (width, height) of the frame
+    :param seed: int random seed
+    :return: DropletStore
+    """
+    random = np.random.default_rng(seed)
+    angles = np.linspace(0, 2 * np.pi, 12, endpoint=False)
+    store = DropletStore()
+    id_allocator = IdAllocator()
+
+    for frame_id in range(frame_count):
+        store.begin_frame(frame_id)
+        centers = random.uniform(
+            (20, 20), np.subtract(frame_shape, 20), (droplets_per_frame, 2)
+        )
+        radii = random.uniform(2, 8, droplets_per_frame)
+        for (x, y), radius in zip(centers, radii):
+            contour = np.stack(
+                (x + radius * np.cos(angles), y + radius * np.sin(angles)), axis=1
+            )
+            row = store.add(id_allocator.allocate(), frame_id)
+            store.set_contour(row, contour.astype(np.int32).reshape(-1, 1, 2))
+
+    return store
+
+
+def frame_objects(store, frame_id):
+    """
+    Make the objects the second pass makes for one frame, and touch the fields
+    it reads.
+
+    :return: (Frame, list of Labels)
+    """
+    frame = Frame(frame_id, store)
+    labels = [Label(droplet) for droplet in frame.droplets.values()]
+    frame_boundary = Rectangle((0, 0), (1920, 1080))
+    for label in labels:
+        for corner in range(4):
+            label.text_bounding_box[corner].outside(frame_boundary)
+        label.center
+    return frame, labels
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark per-droplet object memory and throughput."
+    )
+    parser.add_argument("--droplets", type=int, default=2000, help="droplets per frame")
+    parser.add_argument("--frames", type=int, default=30, help="frames to time")
+    argv = parser.parse_args(args)
+
+    store = build_store(argv.frames, argv.droplets)
+
+    tracemalloc.start()
+    objects = frame_objects(store, 0)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objects
+
+    start = time.perf_counter()
+    for frame_id in range(argv.frames):
+        frame_objects(store, frame_id)
+    seconds = time.perf_counter() - start
+
+    droplet_count = argv.frames * argv.droplets
+    print(
+        "{} droplets per frame: {:.1f} KiB peak for one frame, {:.0f} bytes per droplet".format(
+            argv.droplets, peak_bytes / 1024, peak_bytes / argv.droplets
+        )
+    )
+    print(
+        "{} frames: {:.3f} s, {:.1f} frames/s, {:.2f} us per droplet".format(
+            argv.frames,
+            seconds,
+            argv.frames / seconds,
+            seconds / droplet_count * 1e6,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
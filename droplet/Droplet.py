@@ -18,121 +18,106 @@
 
 ###
 
-from collections import defaultdict
-from math import trunc
-import cv2
-
 """
 
 Found droplets, from our initial scan, are numbered consecutively for the entire
-video sequence, from class variable master_count. Each found contour receives a unique 
+video sequence, from the video file's IdAllocator. Each found contour receives a unique 
 ID, which will survive in the droplet data as self.initial_id, even if we subsequently 
 discover they're views of another droplet.
 
 If a droplet is tracked and found to be an image of an already-captured droplet, the 
-contour, centroid, pixel area and ID info, etc. are added to the data list for the 
-previously captured droplet.
-
-droplets = OrderedDict()
-droplets[id] = self._data[0]
+contour, centroid, pixel area and ID info, etc. of the new sighting become the most
+recent data for the previously captured droplet.
 
-droplet_data = {
-                'contour': contour,
-                'centroid': centroid,
-                'area': area,
-                'frame': frame
-                'id': id,
-                'initial_id': id
-                }
+All of the droplet data lives in a columnar DropletStore (see droplet/DropletStore.py),
+one row per detection. A Droplet is a thin view over one row of the store:
 
-The most recent droplet data is always in list self._data in the 0th position.
+droplet = Droplet(store, row)
 
-self._data.insert(0,droplet_data)
+droplet.contour, .centroid, .area, .frame, .id and .initial_id read the row's
+columns, and the setters write them.
 
-method self.relocate(), given a more recent droplet, will push a new
-droplet_data dict onto the list at [0].
+method self.relocate(), given a more recent droplet, makes the new droplet's row
+the most recent sighting of this droplet, and points this view at it.
 
-self.generations() returns the number of data versions for a given droplet.
+self.generations() returns the number of sightings for a given droplet.
 
-self.contour_history() returns a list of contours from the set of generations,
-from most recent to oldest.
+self.contour_history() iterates over the contours from the set of generations,
+from most recent to oldest, following the store's parent pointers.
 
 """
 
 
 class Droplet:
+    # Views are made by the thousand per frame; keep them small.
+    __slots__ = ("_store", "_row", "_root")
 
-    master_count = 1  # Class data counter for creating new ids.
-
-    # # Master class indices for droplet info.
-    #
-    # # Returns a droplet.
-    # index_by_droplet = {}
-    # # Returns a list of frame numbers.
-    # index_by_frame = defaultdict(list)
-    # # Returns a list of droplets with key (int) number of pixels.
-    # index_by_area = defaultdict(list)
-
-    def __init__(self, contour=None):
+    def __init__(self, store, row, root=None):
         """
-        Initialize droplet.
+        Initialize a view of one droplet detection.
 
-        :param contour: np contour array
+        :param store: DropletStore holding the detection
+        :param row: int row number in the store
+        :param root: int row the droplet was first seen in, if this is a view of
+                     a later sighting; defaults to row
 
         """
-        self.id = Droplet.master_count  # id for this droplet
-        self._data = []  # The data for this droplet; current is always in data[0]
+        self._store = store
+        self._row = row
+        self._root = row if root is None else root
 
-        # Initialize blank data.
-        droplet_data = {
-            "contour": None,
-            "centroid": None,
-            "area": None,
-            "frame": None,
-            "initial_id": self.id,
-            "id": self.id,
-        }
+    def __repr__(self):
+        return "Droplet({}, initial id {}, frame {})".format(
+            self.id, self.initial_id, self.frame
+        )
 
-        self._data.append(droplet_data)
+    @property
+    def row(self):
+        return self._row
 
-        Droplet.master_count += 1
+    @property
+    def id(self):
+        return int(self._store.column("id")[self._row])
+
+    @id.setter
+    def id(self, id):
+        self._store.column("id")[self._row] = id
 
     @property
     def contour(self):
-        return self._data[0]["contour"]
+        return self._store.contour(self._row)
 
     @contour.setter
     def contour(self, contour):
-        self._data[0]["contour"] = contour
-        self.centroid = contour
+        # Sets the centroid and bounding box as well.
+        self._store.set_contour(self._row, contour)
 
     @property
     def centroid(self):
-        return self._data[0]["centroid"]
-
-    @centroid.setter
-    def centroid(self, contour):
-        self._data[0]["centroid"] = self._calc_centroid(contour)
+        return (
+            self._store.column("x")[self._row],
+            self._store.column("y")[self._row],
+        )
 
     @property
     def area(self):
-        return self._data[0]["area"]
+        return int(self._store.column("area")[self._row])
 
     @area.setter
     def area(self, area):
-        self._data[0]["area"] = area
+        self._store.set_area(self._row, area)
 
     @property
     def frame(self):
-        return self._data[0]["frame"]
+        return int(self._store.column("frame")[self._row])
 
     @frame.setter
     def frame(self, frame):
-        self._data[0]["frame"] = frame
+        self._store.column("frame")[self._row] = frame
 
     @property
     def initial_id(self):
-        return self._data[0]["initial_id"]
+        return int(self._store.column("initial_id")[self._row])
 
     ###
 
@@ -143,18 +128,10 @@ class Droplet:
         :param droplet at new location:
         """
 
-        new_droplet_data = {
-            "contour": destination_droplet.contour,
-            "centroid": destination_droplet.centroid,
-            "area": destination_droplet.area,
-            "frame": destination_droplet.frame,
-            # initial_id is the one it was created with.
-            "initial_id": destination_droplet.initial_id,
-            # id is the id of the original droplet, of which it's a repeat sighting.
-            "id": self.id,
-        }
-
-        self._data.insert(0, new_droplet_data)
+        # The destination keeps its initial_id, the one it was created with, and
+        # takes on the id of this droplet, of which it's a repeat sighting.
+        self._store.relocate(self._root, destination_droplet.row, self.id)
+        self._row = destination_droplet.row
 
     ###
     def generations(self):
@@ -163,43 +140,13 @@ class Droplet:
 
         :return: integer generation count.
         """
-        return len(self._data)
+        return self._store.generations(self._root)
 
     def contour_history(self):
         """
-        Return contours from all locations of a droplet.
+        Iterate over contours from all locations of a droplet, most recent first.
 
-        :return: List of contour arrays.
+        :return: generator of contour arrays, views into the droplet store
         """
-        # contours = [self.contour[x]['contour'] for x in range(len(self._data))]
-        # return contours
-        return [list(self._data[x]["contour"]) for x in range(len(self._data))]
-
-    # def create_indices(self):
-    #     """
-    #     Create index entries for droplet.
-    #     """
-    #     Droplet.index_by_frame[self.frame].append(self.id)
-    #     Droplet.index_by_droplet[self.id] = self
-    #     Droplet.index_by_area[trunc(self.area)].append(self.id)
-
-    def _calc_centroid(self, contour):
-
-        # Get the center of the droplet by calculating its moments.
-        m = cv2.moments(contour)
-        if m["m00"] != 0:
-            centroid = tuple([m["m10"] / m["m00"], m["m01"] / m["m00"]])
-        else:
-            # m00 is 0 when there are too few points in the1
-            # contour (ie the contour is a single pixel or a line with no interior)
-            # so just take an average of the points we do have.
-            centroid = tuple([sum(x) / len(x) for x in zip(*contour)][0])
-
-            # print("m00 == 0! - {} point{}".format(len(contour), ess(len(contour))))  # debug
-            # print(
-            #     "non-moment center = {}, {}".format(
-            #         raw_centroids[i][0], raw_centroids[i][1]
-            #     )
-            # )  # debug
-
-        return centroid
+        for row in self._store.history_rows(self._root):
+            yield self._store.contour(row)
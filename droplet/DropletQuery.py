@@ -0,0 +1,204 @@
+# Copyright (c) 2020 Fredrick Levine
+# rick@xoab.us
+#
+# This file is part of Droplet Video Analyzer
+# https://github.com/rlevine/droplet_video_analyzer
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+###
+
+import numpy as np
+
+"""
+
+Indexed queries over the droplet detections in a DropletStore.
+
+Three indexes, all built once, as NumPy arrays:
+
+    area    - rows sorted by pixel area; an area range is two binary searches
+    frame   - the store's rows are already in frame order, so a frame range is a
+              contiguous run of rows, found from the store's frame offsets
+    grid    - rows sorted by (frame, grid cell), with the frame split into square
+              cells; a region in a range of frames is one binary search per row of
+              cells per frame, followed by an exact test of the candidates' centroids
+
+select() intersects whichever indexes a query uses, so nothing walks the droplets
+one at a time in Python.
+
+    query = DropletQuery(video_master.droplet_store, frame_shape=(1920, 1080))
+    rows = query.select(
+        min_area=41, frames=(2100, 2700), region=query.quadrant("lower-left")
+    )
+
+"""
+
+QUADRANTS = ("upper-left", "upper-right", "lower-left", "lower-right")
+
+
+class DropletQuery:
+    def __init__(self, store, frame_shape=None, cell_size=64):
+        """
+        Build the query indexes for a droplet store.
+
+        :param store: DropletStore, with its scan complete
+        :param frame_shape: (width, height) of the video frames
+        :param cell_size: int pixel size of the spatial grid cells
+        """
+        self._store = store
+        self.frame_shape = frame_shape
+
+        # Area index.
+        areas = store.column("area")
+        self._area_order = np.argsort(areas, kind="stable")
+        self._sorted_areas = areas[self._area_order]
+
+        # Spatial grid index.
+        self._cell_size = cell_size
+        if frame_shape is None:
+            frame_shape = (
+                int(store.column("x").max(initial=0)) + 1,
+                int(store.column("y").max(initial=0)) + 1,
+            )
+        self._grid_columns = frame_shape[0] // cell_size + 1
+        self._grid_rows = frame_shape[1] // cell_size + 1
+
+        grid_keys = self._grid_key(
+            store.column("frame"), self._cell(store.column("x"), store.column("y"))
+        )
+        self._grid_order = np.argsort(grid_keys, kind="stable")
+        self._sorted_grid_keys = grid_keys[self._grid_order]
+
+    def quadrant(self, name):
+        """
+        Return the region for a quadrant of the frame.
+
+        :param name: one of QUADRANTS; "lower" is the bottom of the frame
+        :return: (x0, y0, x1, y1) region
+        """
+        if name not in QUADRANTS:
+            raise ValueError(
+                "Unknown quadrant '{}', expected one of {}.".format(
+                    name, ", ".join(QUADRANTS)
+                )
+            )
+        width, height = self.frame_shape
+        vertical, horizontal = name.split("-")
+        x0, x1 = (0, width / 2) if horizontal == "left" else (width / 2, width)
+        y0, y1 = (0, height / 2) if vertical == "upper" else (height / 2, height)
+        return x0, y0, x1, y1
+
+    ###
+
+    def select(self, min_area=None, max_area=None, frames=None, region=None):
+        """
+        Return the rows of all detections that match every given condition.
+
+        :param min_area: int smallest pixel area, inclusive
+        :param max_area: int largest pixel area, inclusive
+        :param frames: (start, stop) frame numbers, stop exclusive
+        :param region: (x0, y0, x1, y1) centroid bounds, x1 and y1 exclusive
+        :return: np array of row numbers, in frame order
+        """
+        if frames is None:
+            frames = (0, self._store.frame_count)
+
+        if region is not None:
+            rows = self.rows_in_region(region, frames)
+        else:
+            rows = self.rows_in_frames(*frames)
+
+        if min_area is not None or max_area is not None:
+            rows = np.intersect1d(
+                rows, self.rows_by_area(min_area, max_area), assume_unique=True
+            )
+
+        return np.sort(rows)
+
+    def rows_by_area(self, min_area=None, max_area=None):
+        """
+        Return the rows with min_area <= area <= max_area.
+        """
+        low = 0 if min_area is None else np.searchsorted(self._sorted_areas, min_area)
+        high = (
+            len(self._sorted_areas)
+            if max_area is None
+            else np.searchsorted(self._sorted_areas, max_area, side="right")
+        )
+        return self._area_order[low:high]
+
+    def rows_in_frames(self, start, stop):
+        """
+        Return the rows for frames start up to, but not including, stop.
+        """
+        start = max(start, 0)
+        stop = min(stop, self._store.frame_count)
+        if start >= stop:
+            return np.zeros(0, dtype=np.int64)
+        return np.arange(
+            self._store.frame_rows(start).start, self._store.frame_rows(stop - 1).stop
+        )
+
+    def rows_in_region(self, region, frames):
+        """
+        Return the rows with centroids in region, in a range of frames.
+
+        :param region: (x0, y0, x1, y1), x1 and y1 exclusive
+        :param frames: (start, stop) frame numbers, stop exclusive
+        :return: np array of row numbers
+        """
+        x0, y0, x1, y1 = region
+        start, stop = max(frames[0], 0), min(frames[1], self._store.frame_count)
+        if start >= stop or x0 >= x1 or y0 >= y1:
+            return np.zeros(0, dtype=np.int64)
+
+        # Every (frame, row of cells) pair covering the region is one contiguous
+        # run of keys in the grid index.
+        first_column, first_row = self._cell_coordinates(x0, y0)
+        last_column, last_row = self._cell_coordinates(x1 - 1e-9, y1 - 1e-9)
+        frame_ids = np.arange(start, stop)[:, None]
+        cell_rows = np.arange(first_row, last_row + 1)[None, :]
+        row_starts = cell_rows * self._grid_columns
+        low_keys = self._grid_key(frame_ids, row_starts + first_column)
+        high_keys = self._grid_key(frame_ids, row_starts + last_column)
+
+        lows = np.searchsorted(self._sorted_grid_keys, low_keys.ravel())
+        highs = np.searchsorted(self._sorted_grid_keys, high_keys.ravel(), side="right")
+        lengths = highs - lows
+        if lengths.sum() == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        # Gather all the runs at once.
+        run_offsets = np.repeat(lows - np.cumsum(lengths) + lengths, lengths)
+        candidates = self._grid_order[np.arange(lengths.sum()) + run_offsets]
+
+        # Cells overhang the region; check the candidates exactly.
+        x = self._store.column("x")[candidates]
+        y = self._store.column("y")[candidates]
+        inside = (x >= x0) & (x < x1) & (y >= y0) & (y < y1)
+
+        return candidates[inside]
+
+    ###
+
+    def _cell_coordinates(self, x, y):
+        column = np.clip(x // self._cell_size, 0, self._grid_columns - 1)
+        row = np.clip(y // self._cell_size, 0, self._grid_rows - 1)
+        return column.astype(np.int64), row.astype(np.int64)
+
+    def _cell(self, x, y):
+        column, row = self._cell_coordinates(x, y)
+        return row * self._grid_columns + column
+
+    def _grid_key(self, frame_ids, cells):
+        return frame_ids * (self._grid_columns * self._grid_rows) + cells
@@ -0,0 +1,706 @@
+# Copyright (c) 2020 Fredrick Levine
+# rick@xoab.us
+#
+# This file is part of Droplet Video Analyzer
+# https://github.com/rlevine/droplet_video_analyzer
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+###
+
+from math import trunc
+import os
+import shutil
+import tempfile
+import cv2
+import numpy as np
+
+from droplet.Droplet import Droplet
+from frame.Frame import Frame
+from utils.hu_moments import log_hu_moments
+
+"""
+
+Columnar storage for every droplet detection in a video file.
+
+Each detection found in the initial scan is one row in a NumPy structured array:
+
+    id              assigned droplet id; starts out as initial_id, and is changed
+                    when the tracker decides the detection is a repeat sighting
+    initial_id      id the detection was created with in the scan
+    frame           0-based video frame number
+    x, y            centroid
+    area            pixel area from floodFill
+    bbox            contour bounding box, (x, y, w, h)
+    contour_start   offset of the contour's first point in the point arena
+    contour_length  number of contour points
+    latest          row of the most recent sighting of the droplet that started
+                    with this detection (its own row, until it's relocated)
+    parent          row of the previous sighting of the same droplet, or -1
+    child           row of the next sighting of the same droplet, or -1
+    generation      1 for a droplet's first sighting, 2 for its second, ...
+    log_hu          the contour's log-transformed Hu moments, for shape matching
+                    (see utils/hu_moments.py)
+    hu_nonzero      False for contours with no nonzero Hu moments
+
+Contour points for all detections live in one contiguous int32 arena, addressed by
+contour_start and contour_length (CSR-style), rather than as one small NumPy array
+per contour.
+
+The parent and child columns make the store an append-only lineage graph. Relocating
+a droplet links the new sighting to the previous one, in constant time, and a
+droplet's trajectory is a walk along the parent pointers from its latest row.
+lineage_edges() returns the whole graph as an edge list.
+
+Each relocation also logs what it overwrote, so relocations can be undone, newest
+first (undo_relocations()), when the tracker steps back to an earlier frame.
+
+Rows are appended in scan order, so initial ids are ascending and all of a frame's
+detections are contiguous. That gives us id lookups with a binary search and frame
+lookups with an offset table, instead of Python dicts holding a list per key.
+
+Droplet and Frame are thin views over a store: they hold a row number or a frame
+number, and read everything else from the columns.
+
+Given a spill directory, the store keeps its rows, contour points and relocation log
+in memory-mapped files there instead of in RAM (streaming mode, for multi-hour
+recordings). Only the pages being worked on, the tracker's window of recent frames,
+stay resident; older detections are written out to disk and paged back in only if
+something asks for them.
+
+"""
+
+DETECTION_DTYPE = np.dtype(
+    [
+        ("id", np.int64),
+        ("initial_id", np.int64),
+        ("frame", np.int64),
+        ("x", np.float64),
+        ("y", np.float64),
+        ("area", np.int64),
+        ("bbox", np.int32, (4,)),
+        ("contour_start", np.int64),
+        ("contour_length", np.int64),
+        ("latest", np.int64),
+        ("parent", np.int64),
+        ("child", np.int64),
+        ("generation", np.int64),
+        ("log_hu", np.float64, (7,)),
+        ("hu_nonzero", np.bool_),
+    ]
+)
+
+
+# Frames between flushes of a spilled store's dirty pages to disk.
+SPILL_FLUSH_FRAMES = 900
+
+# Bytes of a saved store read at a time.
+READ_CHUNK_BYTES = 1 << 24
+
+
+class DropletStore:
+    def __init__(self, capacity=1024, point_capacity=65536, spill_dir=None):
+        """
+        Initialize an empty droplet store.
+
+        :param capacity: int initial number of detection rows
+        :param point_capacity: int initial number of contour points
+        :param spill_dir: str directory for memory-mapped column files; None keeps
+                          everything in RAM
+        """
+        # Each spilled store gets its own directory, removed by close().
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+            spill_dir = tempfile.mkdtemp(prefix="droplets_", dir=spill_dir)
+        self._spill_dir = spill_dir
+
+        self._rows = self._allocate("rows", (capacity,), DETECTION_DTYPE)
+        self._count = 0
+
+        # Contour point arena, (x, y) int32 pairs.
+        self._points = self._allocate("points", (point_capacity, 2), np.int32)
+        self._point_count = 0
+
+        # First row of each frame, indexed by frame number.
+        self._frame_starts = np.zeros(1024, dtype=np.int64)
+        self._frame_count = 0
+
+        # Every relocation, in the order the tracker made them:
+        # (root, destination_row, droplet_id).
+        self._relocation_log = self._allocate("relocations", (1024, 3), np.int64)
+        self._relocation_count = 0
+        # What each relocation overwrote, so it can be undone: the destination
+        # row's parent, generation and id, and the previous sighting's child.
+        self._undo_log = self._allocate("undo", (1024, 4), np.int64)
+
+        # Sort order for area lookups, built on demand.
+        self._area_order = None
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def frame_count(self):
+        return self._frame_count
+
+    @property
+    def frame_starts(self):
+        """
+        First row of each frame, indexed by frame number.
+        """
+        return self._frame_starts[: self._frame_count]
+
+    def column(self, name):
+        """
+        Return a view of one column for all filled rows.
+
+        :param name: str field name from DETECTION_DTYPE
+        :return: np array view
+        """
+        return self._rows[name][: self._count]
+
+    ###
+
+    def begin_frame(self, frame_id):
+        """
+        Start a new frame. Detections added after this belong to frame_id.
+
+        :param frame_id: int 0-based frame number; frames must arrive in order
+        """
+        if frame_id != self._frame_count:
+            raise ValueError(
+                "Frames must be added in order: expected frame {}, got {}.".format(
+                    self._frame_count, frame_id
+                )
+            )
+        if self._frame_count == len(self._frame_starts):
+            self._frame_starts = self._grown(
+                self._frame_starts, len(self._frame_starts) * 2
+            )
+        self._frame_starts[self._frame_count] = self._count
+        self._frame_count += 1
+
+        if self._spill_dir and self._frame_count % SPILL_FLUSH_FRAMES == 0:
+            # Write finished frames out, so their pages can leave memory.
+            self.flush()
+
+    def add(self, droplet_id, frame_id):
+        """
+        Add a blank detection row.
+
+        :param droplet_id: int new droplet id, used as both id and initial_id
+        :param frame_id: int frame number
+        :return: int row number
+        """
+        if self._count == len(self._rows):
+            self._rows = self._grown(self._rows, len(self._rows) * 2)
+
+        row = self._count
+        self._rows[row] = 0
+        self._rows["id"][row] = droplet_id
+        self._rows["initial_id"][row] = droplet_id
+        self._rows["frame"][row] = frame_id
+        self._rows["latest"][row] = row
+        self._rows["parent"][row] = -1
+        self._rows["child"][row] = -1
+        self._rows["generation"][row] = 1
+        self._count += 1
+        self._area_order = None
+
+        return row
+
+    def set_contour(self, row, contour):
+        """
+        Copy a contour into the point arena, and fill in the centroid, bounding
+        box and Hu moment columns for it.
+
+        :param row: int row number
+        :param contour: np contour array, (N, 1, 2)
+        """
+        points = np.asarray(contour, dtype=np.int32).reshape(-1, 2)
+        length = len(points)
+
+        needed = self._point_count + length
+        if needed > len(self._points):
+            self._points = self._grown(
+                self._points, max(needed, len(self._points) * 2)
+            )
+
+        start = self._point_count
+        self._points[start:needed] = points
+        self._point_count = needed
+
+        self._rows["contour_start"][row] = start
+        self._rows["contour_length"][row] = length
+        moments = cv2.moments(contour)
+        self._rows["x"][row], self._rows["y"][row] = calc_centroid(contour, moments)
+        self._rows["bbox"][row] = cv2.boundingRect(contour)
+        (
+            self._rows["log_hu"][row],
+            self._rows["hu_nonzero"][row],
+        ) = log_hu_moments(moments)
+
+    def set_area(self, row, area):
+        self._rows["area"][row] = area
+        self._area_order = None
+
+    ###
+
+    def contour(self, row):
+        """
+        Return the contour for a row, as an (N, 1, 2) view into the point arena.
+        """
+        start = self._rows["contour_start"][row]
+        return self._points[start : start + self._rows["contour_length"][row]].reshape(
+            -1, 1, 2
+        )
+
+    def row_for_id(self, droplet_id):
+        """
+        Return the row a droplet id was created with.
+
+        :param droplet_id: int initial droplet id
+        :return: int row number
+        """
+        initial_ids = self.column("initial_id")
+        row = np.searchsorted(initial_ids, droplet_id)
+        if row == self._count or initial_ids[row] != droplet_id:
+            raise KeyError(droplet_id)
+        return int(row)
+
+    def has_id(self, droplet_id):
+        try:
+            self.row_for_id(droplet_id)
+        except KeyError:
+            return False
+        return True
+
+    def latest_row(self, droplet_id):
+        """
+        Return the row of the most recent sighting of a droplet.
+        """
+        return int(self._rows["latest"][self.row_for_id(droplet_id)])
+
+    def frame_rows(self, frame_id):
+        """
+        Return the range of rows for a frame.
+
+        :param frame_id: int frame number
+        :return: range
+        """
+        if not 0 <= frame_id < self._frame_count:
+            return range(0)
+        start = self._frame_starts[frame_id]
+        if frame_id + 1 < self._frame_count:
+            stop = self._frame_starts[frame_id + 1]
+        else:
+            stop = self._count
+        return range(int(start), int(stop))
+
+    def frame_ids(self, frame_id):
+        """
+        Return the initial droplet ids of a frame's detections.
+        """
+        rows = self.frame_rows(frame_id)
+        return self._rows["initial_id"][rows.start : rows.stop]
+
+    def area_ids(self, area):
+        """
+        Return the initial ids of all detections whose truncated area is area.
+        """
+        if self._area_order is None:
+            self._area_order = np.argsort(self.column("area"), kind="stable")
+        sorted_areas = self.column("area")[self._area_order]
+        low, high = np.searchsorted(sorted_areas, [trunc(area), trunc(area) + 1])
+        return self.column("initial_id")[self._area_order[low:high]]
+
+    ###
+
+    def relocate(self, root, destination_row, droplet_id):
+        """
+        Record destination_row as the newest sighting of the droplet first seen
+        in row root.
+
+        :param root: int row the droplet was first seen in
+        :param destination_row: int row of the new sighting
+        :param droplet_id: int id assigned to the new sighting
+        """
+        # A detection is a sighting of one droplet, once. Linking a row that's
+        # already in a chain, the droplet's own latest row included, would
+        # turn the chain into a loop.
+        if (
+            destination_row == root
+            or self._rows["parent"][destination_row] >= 0
+            or self._rows["child"][destination_row] >= 0
+        ):
+            raise ValueError(
+                "Row {} is already a sighting of a droplet.".format(destination_row)
+            )
+
+        previous_row = self._rows["latest"][root]
+
+        if self._relocation_count == len(self._relocation_log):
+            self._relocation_log = self._grown(
+                self._relocation_log, len(self._relocation_log) * 2
+            )
+            self._undo_log = self._grown(self._undo_log, len(self._undo_log) * 2)
+        self._undo_log[self._relocation_count] = (
+            self._rows["parent"][destination_row],
+            self._rows["generation"][destination_row],
+            self._rows["id"][destination_row],
+            self._rows["child"][previous_row],
+        )
+
+        self._rows["parent"][destination_row] = previous_row
+        self._rows["child"][previous_row] = destination_row
+        self._rows["generation"][destination_row] = (
+            self._rows["generation"][previous_row] + 1
+        )
+
+        self._rows["id"][destination_row] = droplet_id
+        self._rows["latest"][root] = destination_row
+
+        self._relocation_log[self._relocation_count] = (
+            root,
+            destination_row,
+            droplet_id,
+        )
+        self._relocation_count += 1
+
+    def undo_relocations(self, relocation_count):
+        """
+        Undo relocations, newest first, until only relocation_count are left, as
+        when the tracker steps back to an earlier frame. Costs one step per
+        relocation undone.
+
+        :param relocation_count: int number of relocations to keep
+        """
+        rows = self._rows
+        while self._relocation_count > relocation_count:
+            self._relocation_count -= 1
+            root, destination_row, _ = self._relocation_log[self._relocation_count]
+            parent, generation, droplet_id, child = self._undo_log[
+                self._relocation_count
+            ]
+
+            previous_row = rows["parent"][destination_row]
+            rows["latest"][root] = previous_row
+            rows["child"][previous_row] = child
+            rows["parent"][destination_row] = parent
+            rows["generation"][destination_row] = generation
+            rows["id"][destination_row] = droplet_id
+
+    @property
+    def relocation_count(self):
+        return self._relocation_count
+
+    def relocations(self, start=0):
+        """
+        Return the relocations made since the start'th one, oldest first.
+
+        :param start: int number of relocations to skip
+        :return: np (N, 3) array of (root, destination_row, droplet_id) rows
+        """
+        return np.array(self._relocation_log[start : self._relocation_count])
+
+    def generations(self, root):
+        """
+        Return the number of sightings of the droplet first seen in row root.
+        """
+        return int(self._rows["generation"][self._rows["latest"][root]])
+
+    def history_rows(self, root):
+        """
+        Iterate over the rows of all sightings of the droplet first seen in row
+        root, most recent first.
+        """
+        row = int(self._rows["latest"][root])
+        while row >= 0:
+            yield row
+            row = int(self._rows["parent"][row])
+
+    def lineage_edges(self, start=0, stop=None):
+        """
+        Return every link between successive sightings of a droplet, or the links
+        to the child rows in a range, to go through a long file in pieces.
+
+        :param start: int first child row
+        :param stop: int row after the last child row; None for all the rows
+        :return: np (N, 2) array of (parent row, child row), in the order the
+                 child rows were scanned
+        """
+        parents = self.column("parent")[start:stop]
+        children = np.flatnonzero(parents >= 0)
+        return np.column_stack((parents[children], children + start))
+
+    ###
+
+    def to_arrays(self):
+        """
+        Return the scanned contents of the store as plain arrays, for saving.
+
+        Relocation history isn't included; a store is saved straight after a scan,
+        before any tracking.
+
+        :return: dict of str name: np array
+        """
+        return {
+            "rows": self._rows[: self._count],
+            "points": self._points[: self._point_count],
+            "frame_starts": self._frame_starts[: self._frame_count],
+        }
+
+    @classmethod
+    def from_npy_files(cls, rows_file, points_file, frame_starts, spill_dir=None):
+        """
+        Build a store from .npy files of the rows and points returned by
+        to_arrays(), as the scan cache saves them.
+
+        The rows and points are read straight into the store's arrays, a chunk
+        at a time, so a spilled store never has the whole scan in RAM.
+
+        :param rows_file: binary file object, at the start of the rows' .npy
+        :param points_file: binary file object, at the start of the points' .npy
+        :param frame_starts: np int64 first row of each frame
+        :param spill_dir: str directory for memory-mapped column files, or None
+        :return: DropletStore
+        """
+        row_count = _read_npy_header(rows_file, DETECTION_DTYPE, ())
+        point_count = _read_npy_header(points_file, np.dtype(np.int32), (2,))
+
+        store = cls(
+            capacity=max(row_count, 1),
+            point_capacity=max(point_count, 1),
+            spill_dir=spill_dir,
+        )
+        try:
+            _read_npy_data(rows_file, store._rows, row_count)
+            _read_npy_data(points_file, store._points, point_count)
+        except BaseException:
+            store.close()
+            raise
+        store._count = row_count
+        store._point_count = point_count
+        store._frame_starts = store._grown(
+            np.asarray(frame_starts, dtype=np.int64), max(len(frame_starts), 1)
+        )
+        store._frame_count = len(frame_starts)
+
+        return store
+
+    def scratch(self, name, shape, dtype):
+        """
+        Return a zeroed array to keep alongside the store, as big as its columns:
+        memory-mapped in a spilled store's directory, and removed with it by
+        close(), or in RAM.
+
+        :param name: str name for the array's file
+        :param shape: int or tuple of ints
+        :param dtype: np dtype
+        :return: np array
+        """
+        if not np.prod(shape):
+            # There's nothing to map.
+            return np.zeros(shape, dtype=dtype)
+        return self._allocate("scratch_" + name, shape, dtype)
+
+    def flush(self):
+        """
+        Write a spilled store's changes out to its files.
+        """
+        for array in (self._rows, self._points, self._relocation_log, self._undo_log):
+            if isinstance(array, np.memmap):
+                array.flush()
+
+    def close(self):
+        """
+        Remove a spilled store's files. The store can't be used afterwards.
+        """
+        if self._spill_dir:
+            self._rows = self._points = self._relocation_log = self._undo_log = None
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+            self._spill_dir = None
+
+    ###
+
+    def _allocate(self, name, shape, dtype):
+        if self._spill_dir is None:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(
+            os.path.join(self._spill_dir, name + ".bin"),
+            dtype=dtype,
+            mode="w+",
+            shape=shape,
+        )
+
+    def _grown(self, array, size):
+        shape = (size,) + array.shape[1:]
+
+        if isinstance(array, np.memmap):
+            # Extend the file in place, and map it again; the new tail reads
+            # as zeros, and nothing already written has to be copied.
+            array.flush()
+            with open(array.filename, "r+b") as spill_file:
+                spill_file.truncate(int(np.prod(shape)) * array.dtype.itemsize)
+            return np.memmap(array.filename, dtype=array.dtype, mode="r+", shape=shape)
+
+        grown = np.zeros(shape, dtype=array.dtype)
+        grown[: len(array)] = array
+        return grown
+
+
+def _read_npy_header(npy_file, dtype, item_shape):
+    # Check a .npy file's header against the array it's to be read into, and
+    # return its length, leaving the file at the start of its data.
+    version = np.lib.format.read_magic(npy_file)
+    if version == (1, 0):
+        header = np.lib.format.read_array_header_1_0(npy_file)
+    elif version == (2, 0):
+        header = np.lib.format.read_array_header_2_0(npy_file)
+    else:
+        raise ValueError("Unknown .npy file version {}.".format(version))
+    shape, fortran_order, file_dtype = header
+    if file_dtype != dtype or fortran_order or tuple(shape[1:]) != item_shape:
+        raise ValueError("Saved droplet arrays don't match the droplet store's.")
+    return shape[0]
+
+
+def _read_npy_data(npy_file, array, count):
+    # Read the data of a .npy file with count items into the start of an array,
+    # a chunk at a time. A spilled array's file is written to, not the map, so
+    # the pages don't stay in the process's memory.
+    size = count * array[:1].nbytes
+    if isinstance(array, np.memmap):
+        with open(array.filename, "r+b") as spill_file:
+            for start in range(0, size, READ_CHUNK_BYTES):
+                length = min(READ_CHUNK_BYTES, size - start)
+                chunk = npy_file.read(length)
+                if len(chunk) != length:
+                    raise ValueError("Saved droplet arrays are cut short.")
+                spill_file.write(chunk)
+        return
+
+    data = array[:count].reshape(-1).view(np.uint8)
+    for start in range(0, size, READ_CHUNK_BYTES):
+        chunk = data[start : start + READ_CHUNK_BYTES]
+        if npy_file.readinto(chunk) != len(chunk):
+            raise ValueError("Saved droplet arrays are cut short.")
+
+
+class DropletIndex:
+    """
+    Read-only mapping of droplet id to a Droplet view of its latest sighting.
+    Stands in for the old index_by_droplet dict.
+    """
+
+    def __init__(self, store):
+        self._store = store
+
+    def __getitem__(self, droplet_id):
+        root = self._store.row_for_id(droplet_id)
+        latest = int(self._store.column("latest")[root])
+        return Droplet(self._store, latest, root=root)
+
+    def __contains__(self, droplet_id):
+        return self._store.has_id(droplet_id)
+
+    def __iter__(self):
+        return iter(self._store.column("initial_id").tolist())
+
+    def __len__(self):
+        return len(self._store)
+
+
+class FrameIndex:
+    """
+    Read-only mapping of frame number to a Frame view. Frames are made on demand,
+    rather than kept in an OrderedDict for the whole file.
+    """
+
+    def __init__(self, store):
+        self._store = store
+
+    def __getitem__(self, frame_id):
+        if frame_id not in self:
+            raise KeyError(frame_id)
+        return Frame(frame_id, store=self._store)
+
+    def __contains__(self, frame_id):
+        return 0 <= frame_id < self._store.frame_count
+
+    def __iter__(self):
+        return iter(range(self._store.frame_count))
+
+    def __len__(self):
+        return self._store.frame_count
+
+
+class FrameDropletIndex:
+    """
+    Read-only mapping of frame number to an array of the initial ids of the
+    droplets found in it. Frames without droplets, or frames that don't exist,
+    return an empty array, the way the old defaultdict(list) did.
+    """
+
+    def __init__(self, store):
+        self._store = store
+
+    def __getitem__(self, frame_id):
+        return self._store.frame_ids(frame_id)
+
+    def __contains__(self, frame_id):
+        return 0 <= frame_id < self._store.frame_count
+
+    def __iter__(self):
+        return iter(range(self._store.frame_count))
+
+    def __len__(self):
+        return self._store.frame_count
+
+
+class AreaDropletIndex:
+    """
+    Read-only mapping of truncated pixel area to an array of the initial ids of
+    the droplets with that area.
+    """
+
+    def __init__(self, store):
+        self._store = store
+
+    def __getitem__(self, area):
+        return self._store.area_ids(area)
+
+    def __contains__(self, area):
+        return len(self._store.area_ids(area)) > 0
+
+    def __iter__(self):
+        return iter(np.unique(self._store.column("area")).tolist())
+
+    def __len__(self):
+        return len(np.unique(self._store.column("area")))
+
+
+def calc_centroid(contour, moments=None):
+
+    # Get the center of the droplet by calculating its moments, unless we already
+    # have them.
+    m = cv2.moments(contour) if moments is None else moments
+    if m["m00"] != 0:
+        centroid = tuple([m["m10"] / m["m00"], m["m01"] / m["m00"]])
+    else:
+        # m00 is 0 when there are too few points in the1
+        # contour (ie the contour is a single pixel or a line with no interior)
+        # so just take an average of the points we do have.
+        centroid = tuple([sum(x) / len(x) for x in zip(*contour)][0])
+
+    return centroid
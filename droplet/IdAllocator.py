@@ -0,0 +1,58 @@
+# Copyright (c) 2020 Fredrick Levine
+# rick@xoab.us
+#
+# This file is part of Droplet Video Analyzer
+# https://github.com/rlevine/droplet_video_analyzer
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+###
+
+import threading
+
+
+class IdAllocator:
+    """
+    Hands out consecutive droplet ids for one analysis.
+
+    Droplet ids used to come from a class-level counter on Droplet, which meant two
+    analyses in the same process shared, and reset, each other's numbering. Each
+    VideoFilePreprocessor now owns an allocator, and passes it to Frame.add_droplet.
+    """
+
+    def __init__(self, start=1):
+        """
+        Initialize id allocator.
+
+        :param start: int first id to hand out
+        """
+        self._lock = threading.Lock()
+        self._next_id = start
+
+    @property
+    def next_id(self):
+        """
+        The id the next call to allocate() will return.
+        """
+        return self._next_id
+
+    def allocate(self):
+        """
+        Return a new droplet id.
+
+        :return: int droplet id
+        """
+        with self._lock:
+            droplet_id = self._next_id
+            self._next_id += 1
+        return droplet_id
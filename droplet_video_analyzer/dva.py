@@ -23,6 +23,7 @@
 import cv2
 import time
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 from utils.cl_args import get_test_args
 from utils.cl_args import get_options
@@ -32,13 +33,18 @@ from droplet_video_analyzer.parts import (
     get_filename_from_path,
     unpack_input_files,
     resolve_directory,
+    load_latest_track_record,
+    load_previous_track_record,
 )
 from droplet_video_analyzer.Dispatcher import Dispatcher
+from tracker.CorrectionIndex import CorrectionIndex
 from utils.corrections import get_correction_file_data
 from utils.Logger import Transcript
 from utils.video import calculate_fps
 from utils.Csv import CsvFile
+from utils.Csv import write_lineage_file
 from utils.common import ess
+from utils.common import printc
 from utils.ffmpeg_processing import add_audio
 from video.processors import VideoFrameProcessor
 from video.processors import VideoFilePreprocessor
@@ -53,22 +59,18 @@ warnings.filterwarnings(
 )
 
 
-def main():
+def analyze_video_file(video_filename, output_dir, argv):
+    """
+    Scan, track and annotate one video file.
 
-    # If running from an IDE, set TEST to True to use test command line arguments
-    # defined in utils.cl_args.get_test_args()
-    # Or, from the command line, using the ---test flag will read the same values,
-    # ignoring the rest of the command line flags.
+    Everything one analysis touches, droplet ids included, hangs off its own
+    VideoFilePreprocessor and VideoFrameProcessor, so several files can be analyzed
+    at once in one process.
 
-    TEST = False
-    # TEST = True  # Comment this in to use test args in utils/cl_args.py.
-
-    TEST_ARGS = get_test_args(TEST)
-
-    # Retrieve argparse namespace and convert to dict.
-    argv = vars(get_options(TEST_ARGS=TEST_ARGS))
-
-    # Housekeeping and config set-up
+    :param video_filename: str absolute path to the video file
+    :param output_dir: str directory for output files
+    :param argv: dict of command line options
+    """
 
     DEBUG = argv["DEBUG"]
     VERBOSE = argv["VERBOSE"]
@@ -81,68 +83,111 @@ def main():
     HIDE_DROPLET_HISTORY = argv["HIDE_DROPLET_HISTORY"]
     LOG = argv["LOG"]
     CSV = argv["CSV"]
+    RENDER_ONLY = argv["RENDER_ONLY"]
+    LINEAGE = argv["LINEAGE"]
     video_threshold = argv["threshold"]
-
-    # Print the command line string, if we're testing.
-    if VERBOSE and TEST_ARGS:
-        print("\n{}{}\n".format(get_filename_from_path(__file__), TEST_ARGS))
-
-    input_directory = resolve_directory(dir=argv['input_directory'])
-    output_directory = resolve_directory(dir=argv['output_directory'])
-
-    video_files = unpack_input_files(
-        argv['video_files'],
-        input_directory=input_directory,
-        output_directory=output_directory,
-    )
+    border_width = argv["border"]
+    droplet_similarity = argv["droplet_similarity"]
+    distance_threshold = argv["distance_threshold"]
+    frame_history = argv["frame_history"]
+    assignment = argv["assignment"]
+    motion_model = argv["motion_model"]
+    prediction_radius = argv["prediction_radius"]
+    max_frame_droplets = argv["max_frame_droplets"]
+    pathological_frame_policy = argv["pathological_frame_policy"]
 
     #
-    # Main loop.
-    # Process each video file.
+    # File set-up.
     #
 
-    for video_filename in video_files:
+    video_file_input_path = video_filename
 
-        #
-        # File set-up.
-        #
-
-        video_file_input_path = video_filename
+    # Set up all the output file names we'll need.
+    output_files = set_up_output_filenames(
+        video_file_input_path,
+        argv_output_dir=output_dir,
+    )
 
-        # Set up all the output file names we'll need.
-        output_files = set_up_output_filenames(
-            video_file_input_path,
-            argv_output_dir=video_files[video_filename]['output_dir'],
+    # Start saving a log file if requested.
+    if LOG:
+        transcript = Transcript(output_files["log_file_output_path"])
+
+    # Rendering a finished analysis again? The scan and tracker settings, and
+    # any corrections, come from its track record, not the command line.
+    if RENDER_ONLY:
+        track_record = load_latest_track_record(output_files)
+        video_threshold = track_record.params["threshold"]
+        border_width = track_record.params["border"]
+        droplet_similarity = track_record.params["droplet_similarity"]
+        distance_threshold = track_record.params["distance_threshold"]
+        frame_history = track_record.params["frame_history"]
+        # Records from before assignment engines were greedy.
+        assignment = track_record.params.get("assignment", "greedy")
+        motion_model = track_record.params.get("motion_model", "none")
+        prediction_radius = track_record.params.get("prediction_radius", 10)
+        max_frame_droplets = track_record.params["max_frame_droplets"]
+        pathological_frame_policy = track_record.params["pathological_frame_policy"]
+    else:
+        track_record = None
+
+    # Check to see if a manual correction file for the source video data
+    # file exists, load any data, and create a new file if there isn't one.
+    if RENDER_ONLY:
+        droplet_corrections = track_record.corrections or None
+        correction_count = len(track_record.corrections) or None
+    elif CORRECTIONS:
+        droplet_corrections, correction_count = get_correction_file_data(
+            correction_file_path=output_files["correction_file_path"],
+            output_file_path=output_files["video_file_output_path"],
+            video_threshold=video_threshold,
+            frame_history=frame_history,
+            droplet_similarity=droplet_similarity,
+            distance_threshold=distance_threshold,
         )
+    else:
+        droplet_corrections = None
+        correction_count = None
+
+    # Do a scan of the video file for droplets, and create the
+    # master droplet catalog for the file.
+
+    video_master = VideoFilePreprocessor(
+        video_file_input_path,
+        video_threshold,
+        border_width,
+        cache_dir=output_files["scan_cache_dir"] if argv["SCAN_CACHE"] else None,
+        spill_dir=output_files["spill_dir"] if argv["STREAMING"] else None,
+        VERBOSE=VERBOSE,
+    )
 
-        # Start saving a log file if requested.
-        if LOG:
-            transcript = Transcript(output_files["log_file_output_path"])
-
-        # Check to see if a manual correction file for the source video data
-        # file exists, load any data, and create a new file if there isn't one.
-        if CORRECTIONS:
-            droplet_corrections, correction_count = get_correction_file_data(
-                correction_file_path=output_files["correction_file_path"],
-                output_file_path=output_files["video_file_output_path"],
-                video_threshold=video_threshold,
-                frame_history=argv["frame_history"],
-                droplet_similarity=argv["droplet_similarity"],
-                distance_threshold=argv["distance_threshold"],
+    # The droplet store's files, in streaming mode, are removed however the
+    # analysis ends.
+    try:
+        if RENDER_ONLY:
+            try:
+                track_record.validate(video_master)
+            except ValueError as error:
+                sys.exit("\nOops. {}\n".format(error))
+
+        # Check the corrections against the scan, and index them by frame.
+        if droplet_corrections:
+            droplet_corrections = CorrectionIndex(
+                droplet_corrections, video_master.droplet_store
             )
-        else:
-            droplet_corrections = None
-            correction_count = None
-
-        # Do a scan of the video file for droplets, and create the
-        # master droplet catalog for the file.
+            for new_droplet_id, _, reason in droplet_corrections.problems:
+                printc(
+                    "\nOops! Ignoring the correction for droplet {}: {}.".format(
+                        new_droplet_id, reason
+                    ),
+                    "red",
+                )
 
-        video_master = VideoFilePreprocessor(
-            video_file_input_path,
-            video_threshold,
-            argv["border"],
-            VERBOSE=VERBOSE,
-        )
+        # With corrections, the last analysis's track record, so only the segments
+        # with edited corrections need tracking again.
+        if CORRECTIONS and not RENDER_ONLY:
+            previous_track_record = load_previous_track_record(output_files)
+        else:
+            previous_track_record = None
 
         #
         # Start CSV data file, if requested.
@@ -165,12 +210,7 @@ def main():
         # We'll also grab the droplet count for the frame with the highest count to
         # scale our frame graph.
 
-        frame_droplet_counts = sorted(
-            [
-                (frame_id, video_master.frames[frame_id].droplet_count)
-                for frame_id in video_master.frames
-            ]
-        )
+        frame_droplet_counts = list(enumerate(video_master.droplet_counts_by_frame))
 
         top_10_frames = [
             x[0]
@@ -191,14 +231,22 @@ def main():
             video_file_output_path=output_files['video_file_output_path'],
             output_frames=argv['output_frames'],
             image_threshold=video_threshold,
-            similarity_threshold=argv["droplet_similarity"],
-            distance_threshold=argv["distance_threshold"],
-            history_frames_to_consider=argv["frame_history"],
-            border_width=argv["border"],
+            similarity_threshold=droplet_similarity,
+            distance_threshold=distance_threshold,
+            history_frames_to_consider=frame_history,
+            assignment=assignment,
+            motion_model=motion_model,
+            prediction_radius=prediction_radius,
+            border_width=border_width,
             video_master=video_master,
             corrections=droplet_corrections,
             hide_droplet_history_in_video=HIDE_DROPLET_HISTORY,
             csv_file=csv_file,
+            max_frame_droplets=max_frame_droplets,
+            pathological_frame_policy=pathological_frame_policy,
+            track_record=track_record,
+            tracking_jobs=argv["tracking_jobs"],
+            previous_track_record=previous_track_record,
             CAPTURE_VIDEO=CAPTURE_VIDEO,
             VERBOSE=VERBOSE,
             DEBUG=DEBUG,
@@ -326,15 +374,15 @@ def main():
             )
             print(
                 """
-    \n\n2nd pass: {} frames,\nprocessed at {:2.1f} frames per second.""".format(
+        \n\n2nd pass: {} frames,\nprocessed at {:2.1f} frames per second.""".format(
                     frame_processor.counting_frame_number, fps
                 )
             )
             print(
                 """
-{} droplet{} found in initial scan of video file
-{} unique droplet{} after duplicate discovery
-            """.format(
+    {} droplet{} found in initial scan of video file
+    {} unique droplet{} after duplicate discovery
+                """.format(
                     sum(video_master.droplet_counts_by_frame),
                     ess(sum(video_master.droplet_counts_by_frame)),
                     frame_processor.video_total_droplet_count,
@@ -345,8 +393,8 @@ def main():
         if (correction_count is not None and correction_count > 0) and VERBOSE:
             print(
                 """
-{} correction{} made by hand
-            """.format(
+    {} correction{} made by hand
+                """.format(
                     correction_count,
                     ess(correction_count),
                 )
@@ -354,8 +402,8 @@ def main():
             if frame_processor.video_total_droplet_count > 0:
                 print(
                     """
-(error rate {:.2f}%, {:.2f}% correct)
-                """.format(
+    (error rate {:.2f}%, {:.2f}% correct)
+                    """.format(
                         (correction_count / frame_processor.video_total_droplet_count)
                         * 100,
                         100
@@ -369,6 +417,10 @@ def main():
                     )
                 )
 
+        frame_guard_summary = frame_processor.frame_guard.summary()
+        if frame_guard_summary and VERBOSE:
+            printc("\n" + frame_guard_summary, "yellow")
+
         # Clean-up.
 
         if LOG:
@@ -377,6 +429,49 @@ def main():
         if CSV:
             # .csv data file requested?
             csv_file.write()
+            # Per-frame droplet counts and timings, including degraded frames.
+            frame_processor.frame_guard.write(
+                output_files["frame_report_file_output_path"]
+            )
+
+        if LINEAGE:
+            write_lineage_file(
+                video_master.droplet_store, output_files["lineage_file_output_path"]
+            )
+            if VERBOSE:
+                print(
+                    "Created lineage file {}.".format(
+                        output_files["lineage_file_output_path"]
+                    )
+                )
+
+        # Save the tracker's decisions, if it saw the whole file, so the file can
+        # be rendered again with --render-only.
+        if not RENDER_ONLY and frame_processor.track_record.is_complete(
+            len(video_master.frames)
+        ):
+            frame_processor.track_record.save(
+                output_files["track_record_file_output_path"]
+            )
+            if VERBOSE:
+                print(
+                    "Created track record {}.".format(
+                        output_files["track_record_file_output_path"]
+                    )
+                )
+
+        # And what it compared and decided along the way, for dva inspect.
+        diagnostics = frame_processor.tracker_diagnostics
+        if diagnostics is not None and diagnostics.frame_count == len(
+            video_master.frames
+        ):
+            diagnostics.save(output_files["diagnostics_file_output_path"])
+            if VERBOSE:
+                print(
+                    "Created tracker diagnostics file {}.".format(
+                        output_files["diagnostics_file_output_path"]
+                    )
+                )
 
         if CAPTURE_VIDEO:
             video_output.release()
@@ -393,6 +488,119 @@ def main():
                     VERBOSE=VERBOSE,
                     DEBUG=DEBUG,
                 )
+    finally:
+        video_master.droplet_store.close()
+
+
+def main():
+
+    # "dva query ..." searches an analyzed file instead of analyzing one.
+    if sys.argv[1:2] == ["query"]:
+        from droplet_video_analyzer.query import main as query_main
+
+        return query_main(sys.argv[2:])
+
+    # "dva inspect ..." prints what the tracker did in an analyzed file's frames.
+    if sys.argv[1:2] == ["inspect"]:
+        from droplet_video_analyzer.inspection import main as inspect_main
+
+        return inspect_main(sys.argv[2:])
+
+    # "dva sweep ..." tracks a file with many tracker settings and compares them.
+    if sys.argv[1:2] == ["sweep"]:
+        from droplet_video_analyzer.sweep import main as sweep_main
+
+        return sweep_main(sys.argv[2:])
+
+    # If running from an IDE, set TEST to True to use test command line arguments
+    # defined in utils.cl_args.get_test_args()
+    # Or, from the command line, using the ---test flag will read the same values,
+    # ignoring the rest of the command line flags.
+
+    TEST = False
+    # TEST = True  # Comment this in to use test args in utils/cl_args.py.
+
+    TEST_ARGS = get_test_args(TEST)
+
+    # Retrieve argparse namespace and convert to dict.
+    argv = vars(get_options(TEST_ARGS=TEST_ARGS))
+
+    # Housekeeping and config set-up
+
+    VERBOSE = argv["VERBOSE"]
+    HIDE_VIDEO = argv["HIDE_VIDEO"]
+    LOG = argv["LOG"]
+
+    # Print the command line string, if we're testing.
+    if VERBOSE and TEST_ARGS:
+        print("\n{}{}\n".format(get_filename_from_path(__file__), TEST_ARGS))
+
+    input_directory = resolve_directory(dir=argv['input_directory'])
+    output_directory = resolve_directory(dir=argv['output_directory'])
+
+    video_files = unpack_input_files(
+        argv['video_files'],
+        input_directory=input_directory,
+        output_directory=output_directory,
+    )
+
+    #
+    # Main loop.
+    # Process each video file.
+    #
+
+    # Files can be analyzed side by side on a thread pool, as long as nothing
+    # needs the one video window, or the one redirected stdout for a log file.
+    jobs = argv["jobs"]
+    if jobs > 1 and (not HIDE_VIDEO or LOG):
+        if VERBOSE:
+            printc(
+                "\n--jobs doesn't work with --show-video or --capture-log; "
+                "analyzing one file at a time.",
+                "yellow",
+            )
+        jobs = 1
+
+    # Tracking ahead on a process pool needs the scan cache for the workers to
+    # load the scan from, and their own copies of it in RAM.
+    if argv["tracking_jobs"] > 1 and (not argv["SCAN_CACHE"] or argv["STREAMING"]):
+        if VERBOSE:
+            printc(
+                "\n--tracking-jobs doesn't work with --no-scan-cache or --streaming; "
+                "tracking frames as they're rendered.",
+                "yellow",
+            )
+        argv["tracking_jobs"] = 1
+
+    # Global association solves the whole file at once, with no motion model.
+    if argv["assignment"] == "global" and argv["motion_model"] != "none":
+        if VERBOSE:
+            printc(
+                "\n--motion-model doesn't work with --assignment global; "
+                "matching droplets where they were last seen.",
+                "yellow",
+            )
+        argv["motion_model"] = "none"
+
+    if jobs > 1 and len(video_files) > 1:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            analyses = [
+                executor.submit(
+                    analyze_video_file,
+                    video_filename,
+                    video_files[video_filename]['output_dir'],
+                    argv,
+                )
+                for video_filename in video_files
+            ]
+            # Re-raises anything that went wrong in a worker.
+            for analysis in analyses:
+                analysis.result()
+    else:
+        for video_filename in video_files:
+            analyze_video_file(
+                video_filename, video_files[video_filename]['output_dir'], argv
+            )
 
     # # Printing droplet distance data:for use in determining distance threshold.
     # for (orig_droplet, new_droplet) in list(
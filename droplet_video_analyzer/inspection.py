@@ -0,0 +1,309 @@
+# Copyright (c) 2020 Fredrick Levine
+# rick@xoab.us
+#
+# This file is part of Droplet Video Analyzer
+# https://github.com/rlevine/droplet_video_analyzer
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+###
+
+import os
+import sys
+from glob import glob
+
+import numpy as np
+from prettytable import PrettyTable
+from scipy.spatial import distance
+
+from utils.cl_args import get_inspect_options
+from droplet_video_analyzer.parts import set_up_output_filenames
+from frame.Frame import timecode2frames
+from tracker.TrackerDiagnostics import TrackerDiagnostics
+from utils.assignment import nearest_pairs
+from utils.common import ess
+from utils.common import printc, start_color, stop_color
+from video.FrameDispenser import FrameDispenser
+
+"""
+
+dva inspect: print what the tracker compared and decided in an analyzed video
+file's frames.
+
+    ./dva inspect sample_files/Fleece_04.mp4 --from 00:01:10 --to 00:01:11
+
+The tracker doesn't print its distance and similarity tables as it goes; in
+verbose mode, it records them (tracker/TrackerDiagnostics.py), and the analysis
+saves them next to the track record. This prints them from the file's most
+recent diagnostics, for each frame, as:
+
+    - the distance table, history droplets by current droplets, with the
+      closest pair highlighted
+    - the similarity table, for pairs within range, with the most similar pair
+      highlighted
+    - each history droplet's nearest current droplet, with distance and
+      similarity
+    - each pair the assignment engine tried, in order, with its confidence
+    - the droplet connections made, corrections included
+
+"""
+
+
+def main(args):
+    argv = vars(get_inspect_options(args))
+
+    video_file_path = os.path.abspath(os.path.expanduser(argv["video_file"]))
+    if not os.path.isfile(video_file_path):
+        sys.exit("\nOops. Cannot find video file {}\n".format(video_file_path))
+
+    output_files = set_up_output_filenames(
+        video_file_path, argv_output_dir=argv["output_directory"]
+    )
+    diagnostics = load_latest_diagnostics(output_files)
+
+    frame_rate = FrameDispenser(video_file_path).frame_rate
+    try:
+        start = (
+            0
+            if argv["from_timecode"] is None
+            else timecode2frames(argv["from_timecode"], frame_rate)
+        )
+        stop = (
+            diagnostics.frame_count
+            if argv["to_timecode"] is None
+            else timecode2frames(argv["to_timecode"], frame_rate)
+        )
+    except ValueError as error:
+        sys.exit("\nOops. {}\n".format(error))
+
+    for frame_id in range(max(start, 0), min(stop, diagnostics.frame_count)):
+        frame = diagnostics.frame(frame_id)
+        compared = len(frame["history"]) and len(frame["current"])
+        if argv["ALL_FRAMES"] or compared or len(frame["connections"]):
+            print_frame(frame_id, frame)
+
+
+def load_latest_diagnostics(output_files):
+    """
+    Load the most recent tracker diagnostics for a video file.
+
+    :param output_files: dict from set_up_output_filenames()
+    :return: TrackerDiagnostics
+    """
+    diagnostics_files = sorted(
+        glob(output_files["diagnostics_file_glob"]), key=os.path.getmtime
+    )
+    if not diagnostics_files:
+        sys.exit(
+            "\nOops. No tracker diagnostics to inspect; analyze the file without --quiet first.\n{}\n".format(
+                output_files["diagnostics_file_glob"]
+            )
+        )
+
+    try:
+        return TrackerDiagnostics.load(diagnostics_files[-1])
+    except ValueError as error:
+        sys.exit("\nOops. {}\n".format(error))
+
+
+def print_frame(frame_id, frame):
+    """
+    Print the tracker's tables and decisions for one frame.
+
+    :param frame_id: int frame number
+    :param frame: dict of diagnostics tables, from TrackerDiagnostics.frame()
+    """
+    history, current, pairs = frame["history"], frame["current"], frame["pairs"]
+
+    printc(
+        "----- Frame {}: {} history droplet{}, {} in frame ---------------".format(
+            frame_id + 1, len(history), ess(len(history)), len(current)
+        ),
+        "purple",
+    )
+
+    if len(history) and len(current):
+        history_ids = history["id"].tolist()
+        current_ids = current["id"].tolist()
+        rows, columns = pairs["row"], pairs["column"]
+        pair_distances, shape_similarity = pairs["distance"], pairs["similarity"]
+
+        distances = distance.cdist(
+            np.column_stack((history["x"], history["y"])),
+            np.column_stack((current["x"], current["y"])),
+            "euclidean",
+        )
+        mshape_similarity = np.full(distances.shape, np.nan)
+        mshape_similarity[rows, columns] = shape_similarity
+
+        # The closest pair overall.
+        distance_highlight_row = distances.min(axis=1).argmin()
+        # (+1 because we're adding droplet numbers to the left side of the table.)
+        distance_highlight_column = distances[distance_highlight_row].argmin() + 1
+
+        printc("\nDistance", "bright red")
+        print(
+            print_distance_array(
+                distances,
+                history_ids,
+                current_ids,
+                highlight_column=distance_highlight_column,
+                highlight_row=distance_highlight_row,
+                color="red",
+            )
+        )
+
+        # Pairs out of range print as "--".
+        if len(shape_similarity):
+            best_pair = shape_similarity.argmin()
+            shape_highlight_row = rows[best_pair]
+            shape_highlight_column = columns[best_pair] + 1
+        else:
+            shape_highlight_row = shape_highlight_column = None
+
+        printc("Similarity", "bright blue")
+        print(
+            print_distance_array(
+                mshape_similarity,
+                history_ids,
+                current_ids,
+                highlight_column=shape_highlight_column,
+                highlight_row=shape_highlight_row,
+                color="bright blue",
+            )
+        )
+
+        # Each history droplet's nearest current droplet, if there's one in
+        # range, nearest pairs first.
+        nearest = nearest_pairs(rows, columns, pair_distances)
+        new_string = " ".join(
+            ["{: >7}".format(current_ids[x]) for x in columns[nearest]]
+        )
+        old_string = " ".join(["{: >7}".format(history_ids[x]) for x in rows[nearest]])
+        distance_string = " ".join(
+            ["{: >7.2f}".format(pair_distances[x]) for x in nearest]
+        )
+        similarity_string = " ".join(
+            ["{: >7.2f}".format(shape_similarity[x]) for x in nearest]
+        )
+        print("       new {}".format(new_string))
+        print("       old {}".format(old_string))
+        print("  distance {}".format(distance_string))
+        print("similarity {}\n".format(similarity_string))
+
+        # The pairs the assignment engine tried, in order.
+        confidences = pair_distances * shape_similarity
+        tried = np.flatnonzero(pairs["tried"] >= 0)
+        for pair in tried[np.argsort(pairs["tried"][tried])].tolist():
+            match = bool(pairs["accepted"][pair])
+            printc(
+                "Confidence: {} {:.2f} - Droplets {} and {} are {:.2f} pixels apart, similarity = {:.2f}".format(
+                    "+" if match else "-",
+                    confidences[pair],
+                    history_ids[rows[pair]],
+                    current_ids[columns[pair]],
+                    pair_distances[pair],
+                    shape_similarity[pair],
+                ),
+                "green" if match else "red",
+            )
+
+        print()
+
+    for new_id, original_id, original_frame in frame["connections"].tolist():
+        print(
+            "New droplet {} is the same as droplet {} from frame {}.".format(
+                new_id, original_id, original_frame
+            )
+        )
+        print()
+
+
+def print_distance_array(
+    data_array,
+    prior_frame_droplet_ids,
+    new_frame_droplet_ids,
+    highlight_column=None,
+    highlight_row=None,
+    color="red",
+):
+    """
+    Pretty-printer for numpy distance/shape arrays
+
+    :param data_array: np (M, N) array of values, NaN for values not computed
+    :param prior_frame_droplet_ids: history droplet ids, by row
+    :param new_frame_droplet_ids: current droplet ids, by column
+    :param highlight_column: Column to highlight from sort
+    :param highlight_row: And row to highlight.
+    :param color: Highlight color.
+
+    :return: Unicode string ready for printing to ANSI console.
+
+    """
+    # Float formatting and alignment appear to be broken in
+    # PrettyTable, and padding width shows no difference between 0 and 1. Hmpf.
+    table = PrettyTable(
+        border=False,
+        left_padding_width=0,
+        right_padding_width=0,
+        padding_width=0,
+        float_format=".2",
+        align="r",
+    )
+
+    # Add initial blank field to header for left-side droplet numbers
+    column_headers = [""] + list(
+        new_frame_droplet_ids
+    )  # Convert numpy array to plain list.
+    # Left side numbers, from prior frame.
+    row_leads = list(prior_frame_droplet_ids)  # Ditto.
+    rows, columns = data_array.shape
+
+    # row_holder is a list of row lists.
+    row_holder = []
+    # Column header highlight - this column contains the smallest value.
+    if highlight_column is not None:
+        column_headers[highlight_column] = (
+            start_color(color) + str(column_headers[highlight_column]) + stop_color()
+        )
+
+    for row in range(rows):
+        # Have to do our own float formatting. row_leads are the prior
+        # frame droplet numbers.
+        # NaN is a value that wasn't computed.
+        row_list = [row_leads[row]] + [
+            "   --" if np.isnan(x) else "{: 4.2f}".format(x)
+            for x in list(data_array[row])
+        ]
+        if highlight_column:
+            # Highlight the column with the smallest value, hitting each row
+            # as it goes by.
+            row_list[highlight_column] = (
+                start_color(color) + str(row_list[highlight_column]) + stop_color()
+            )
+        if highlight_row:
+            # List comprehension to light up all value_1_values in the highlighted row.
+            if row == highlight_row:
+                row_list = [
+                    start_color(color) + str(row_list[x]) + stop_color()
+                    for x in range(len(row_list))
+                ]
+        # And add the row to our holder.
+        row_holder.append(row_list)
+
+    # Assemble the parts.
+    table.field_names = column_headers
+    for row in row_holder:
+        table.add_row(row)
+
+    return "\n" + table.get_string() + "\n"
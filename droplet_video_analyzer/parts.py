@@ -24,7 +24,12 @@ import sys
 import datetime
 from glob import glob
 
+from frame.Overlay import Overlay
 from utils.frame_label import add_ui_prompt
+from tracker.TrackRecord import TrackRecord
+
+# The UI prompt, drawn once and copied on to each displayed frame.
+_ui_prompt_overlay = Overlay()
 
 
 def unpack_input_files(file_candidates, input_directory=None, output_directory=None):
@@ -141,6 +146,9 @@ def set_up_output_filenames(video_file_input_path, argv_output_dir=None):
         if not os.path.exists(output_dir):
             try:
                 os.mkdir(output_dir)
+            except FileExistsError:
+                # Another file analyzed alongside this one (--jobs) got there first.
+                pass
             except Exception as error:
                 sys.exit(
                     "\n\nOops. Cannot create specified output directory!\n{}\n{}\n".format(
@@ -154,6 +162,8 @@ def set_up_output_filenames(video_file_input_path, argv_output_dir=None):
             if not os.path.exists(output_dir):
                 try:
                     os.mkdir(output_dir)
+                except FileExistsError:
+                    pass
                 except Exception as error:
                     sys.exit(
                         "Unable to create directory 'output' in source directory\n{}\n{}".format(
@@ -178,6 +188,16 @@ def set_up_output_filenames(video_file_input_path, argv_output_dir=None):
     )
     log_output_filename = video_filename_root + "_log_" + date_string + ".html"
     csv_output_filename = video_filename_root + "_data_" + date_string + ".csv"
+    frame_report_output_filename = (
+        video_filename_root + "_frames_" + date_string + ".csv"
+    )
+    lineage_output_filename = video_filename_root + "_lineage_" + date_string + ".csv"
+    track_record_output_filename = (
+        video_filename_root + "_tracks_" + date_string + ".npz"
+    )
+    diagnostics_output_filename = (
+        video_filename_root + "_diagnostics_" + date_string + ".npz"
+    )
     # Image capture files are intended as temporary one-off files, and aren't
     # date-stamped. They won't be overwritten, as the creation code will
     # keep sequentially numbering them across multiple runs.
@@ -191,9 +211,33 @@ def set_up_output_filenames(video_file_input_path, argv_output_dir=None):
     )
     output_files["log_file_output_path"] = os.path.join(output_dir, log_output_filename)
     output_files["csv_file_output_path"] = os.path.join(output_dir, csv_output_filename)
+    output_files["frame_report_file_output_path"] = os.path.join(
+        output_dir, frame_report_output_filename
+    )
+    output_files["lineage_file_output_path"] = os.path.join(
+        output_dir, lineage_output_filename
+    )
+    output_files["track_record_file_output_path"] = os.path.join(
+        output_dir, track_record_output_filename
+    )
+    # Track records from earlier runs, for --render-only.
+    output_files["track_record_file_glob"] = os.path.join(
+        output_dir, video_filename_root + "_tracks_*.npz"
+    )
+    output_files["diagnostics_file_output_path"] = os.path.join(
+        output_dir, diagnostics_output_filename
+    )
+    # Tracker diagnostics from earlier runs, for dva inspect.
+    output_files["diagnostics_file_glob"] = os.path.join(
+        output_dir, video_filename_root + "_diagnostics_*.npz"
+    )
     output_files["image_capture_file_output_path"] = os.path.join(
         output_dir, image_capture_filename
     )
+    # Scan cache files are shared across runs, and aren't date-stamped.
+    output_files["scan_cache_dir"] = os.path.join(output_dir, "scan_cache")
+    # Streaming mode droplet store files, removed when the analysis finishes.
+    output_files["spill_dir"] = os.path.join(output_dir, "spill")
 
     correction_filename = video_filename_root + ".corrections"
     output_files["correction_file_path"] = os.path.join(
@@ -217,6 +261,49 @@ def set_up_output_filenames(video_file_input_path, argv_output_dir=None):
     return output_files
 
 
+def load_latest_track_record(output_files):
+    """
+    Load the most recent track record for a video file, for --render-only.
+
+    :param output_files: dict from set_up_output_filenames()
+    :return: TrackRecord
+    """
+    track_record_files = sorted(
+        glob(output_files["track_record_file_glob"]), key=os.path.getmtime
+    )
+    if not track_record_files:
+        sys.exit(
+            "\nOops. No track record to render; analyze the file without --render-only first.\n{}\n".format(
+                output_files["track_record_file_glob"]
+            )
+        )
+
+    try:
+        return TrackRecord.load(track_record_files[-1])
+    except ValueError as error:
+        sys.exit("\nOops. {}\n".format(error))
+
+
+def load_previous_track_record(output_files):
+    """
+    Load the most recent track record for a video file, if there's a usable one,
+    so only what edited corrections change needs tracking again.
+
+    :param output_files: dict from set_up_output_filenames()
+    :return: TrackRecord, or None
+    """
+    track_record_files = sorted(
+        glob(output_files["track_record_file_glob"]), key=os.path.getmtime
+    )
+    if not track_record_files:
+        return None
+
+    try:
+        return TrackRecord.load(track_record_files[-1])
+    except ValueError:
+        return None
+
+
 def manage_display_and_keyboard(
     display_frame,
     INTERACTIVE=False,
@@ -241,7 +328,10 @@ def manage_display_and_keyboard(
     # Add interactive prompt to the displayed video. This will not be on
     # the frame saved to the video file.
     interactive_display_frame = add_ui_prompt(
-        display_frame, INTERACTIVE=INTERACTIVE, BACK_DISABLED=params['back_disabled']
+        display_frame,
+        INTERACTIVE=INTERACTIVE,
+        BACK_DISABLED=params['back_disabled'],
+        overlay=_ui_prompt_overlay,
     )
 
     # opencv video display
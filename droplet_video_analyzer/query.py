@@ -0,0 +1,192 @@
+# Copyright (c) 2020 Fredrick Levine
+# rick@xoab.us
+#
+# This file is part of Droplet Video Analyzer
+# https://github.com/rlevine/droplet_video_analyzer
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+###
+
+import csv
+import os
+import sys
+from glob import glob
+
+from utils.cl_args import get_query_options
+from droplet_video_analyzer.parts import set_up_output_filenames
+from droplet.DropletQuery import DropletQuery
+from frame.Frame import frames2timecode
+from frame.Frame import timecode2frames
+from tracker.TrackRecord import TrackRecord
+from utils.common import ess
+from utils.common import printc
+from video.FrameDispenser import FrameDispenser
+from video.processors import VideoFilePreprocessor
+
+"""
+
+dva query: find droplets in a video file by size, time and position.
+
+    ./dva query sample_files/Fleece_04.mp4 --min-area 41 --quadrant lower-left \
+        --from 00:01:10 --to 00:01:30
+
+The droplets come from the file's scan cache (the file is scanned first if there
+isn't one), and droplet ids from its most recent track record, if there is one,
+so ids match the .csv data file. Without a track record, every detection has its
+own initial id.
+
+"""
+
+QUERY_COLUMNS = ["frame", "timecode", "droplet_id", "initial_id", "area", "x", "y"]
+
+
+def main(args):
+    argv = vars(get_query_options(args))
+    VERBOSE = argv["VERBOSE"]
+
+    video_file_path = os.path.abspath(os.path.expanduser(argv["video_file"]))
+    if not os.path.isfile(video_file_path):
+        sys.exit("\nOops. Cannot find video file {}\n".format(video_file_path))
+
+    output_files = set_up_output_filenames(
+        video_file_path, argv_output_dir=argv["output_directory"]
+    )
+
+    video_master = VideoFilePreprocessor(
+        video_file_path,
+        argv["threshold"],
+        argv["border"],
+        cache_dir=output_files["scan_cache_dir"],
+        VERBOSE=VERBOSE,
+    )
+    apply_latest_track_record(video_master, output_files, argv, VERBOSE)
+
+    dispenser = FrameDispenser(video_file_path)
+    frame_rate = dispenser.frame_rate
+    query = DropletQuery(video_master.droplet_store, frame_shape=dispenser.shape)
+
+    try:
+        start = (
+            0
+            if argv["from_timecode"] is None
+            else timecode2frames(argv["from_timecode"], frame_rate)
+        )
+        stop = (
+            len(video_master.frames)
+            if argv["to_timecode"] is None
+            else timecode2frames(argv["to_timecode"], frame_rate)
+        )
+        if argv["quadrant"]:
+            region = query.quadrant(argv["quadrant"])
+        elif argv["region"]:
+            region = tuple(float(x) for x in argv["region"].split(","))
+            if len(region) != 4:
+                raise ValueError("A region is four numbers, x0,y0,x1,y1.")
+        else:
+            region = None
+    except ValueError as error:
+        sys.exit("\nOops. {}\n".format(error))
+
+    rows = query.select(
+        min_area=argv["min_area"],
+        max_area=argv["max_area"],
+        frames=(start, stop),
+        region=region,
+    )
+
+    if VERBOSE:
+        printc(
+            "{} droplet{} found.".format(len(rows), ess(len(rows))),
+            "yellow",
+        )
+
+    if argv["csv_file"]:
+        with open(argv["csv_file"], "w", newline="") as results_file:
+            write_results(results_file, video_master.droplet_store, rows, frame_rate)
+        if VERBOSE:
+            print("Created query results file {}.".format(argv["csv_file"]))
+    else:
+        write_results(sys.stdout, video_master.droplet_store, rows, frame_rate)
+
+
+def apply_latest_track_record(video_master, output_files, argv, VERBOSE=False):
+    """
+    Replay the relocations from the most recent track record for the file, if it
+    was made with the same scan, so droplets carry their tracked ids.
+
+    :param video_master: VideoFilePreprocessor
+    :param output_files: dict from set_up_output_filenames()
+    :param argv: dict of query options
+    :param VERBOSE: verbose flag
+    """
+    track_record_files = sorted(
+        glob(output_files["track_record_file_glob"]), key=os.path.getmtime
+    )
+    if not track_record_files:
+        return
+
+    try:
+        track_record = TrackRecord.load(track_record_files[-1])
+        track_record.validate(video_master)
+    except ValueError:
+        return
+    if (track_record.params["threshold"], track_record.params["border"]) != (
+        argv["threshold"],
+        argv["border"],
+    ):
+        return
+
+    store = video_master.droplet_store
+    for frame_id in range(track_record.frame_count):
+        _, relocations = track_record.frame(frame_id)
+        for root, destination_row, droplet_id in relocations.tolist():
+            store.relocate(root, destination_row, droplet_id)
+
+    if VERBOSE:
+        print("Droplet ids from track record {}.\n".format(track_record_files[-1]))
+
+
+def write_results(results_file, store, rows, frame_rate=30):
+    """
+    Write query results as .csv rows, one per detection.
+
+    :param results_file: open text file
+    :param store: DropletStore
+    :param rows: np array of row numbers
+    :param frame_rate: frames per second, for time codes
+    """
+    csv_writer = csv.writer(results_file, dialect="excel")
+    csv_writer.writerow(QUERY_COLUMNS)
+
+    frames = store.column("frame")[rows].tolist()
+    droplet_ids = store.column("id")[rows].tolist()
+    initial_ids = store.column("initial_id")[rows].tolist()
+    areas = store.column("area")[rows].tolist()
+    xs = store.column("x")[rows].tolist()
+    ys = store.column("y")[rows].tolist()
+
+    for frame_id, droplet_id, initial_id, area, x, y in zip(
+        frames, droplet_ids, initial_ids, areas, xs, ys
+    ):
+        csv_writer.writerow(
+            [
+                frame_id + 1,
+                frames2timecode(frame_id, rate=frame_rate),
+                droplet_id,
+                initial_id,
+                area,
+                "{:.2f}".format(x),
+                "{:.2f}".format(y),
+            ]
+        )
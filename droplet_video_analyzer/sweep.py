@@ -0,0 +1,397 @@
+# Copyright (c) 2020 Fredrick Levine
+# rick@xoab.us
+#
+# This file is part of Droplet Video Analyzer
+# https://github.com/rlevine/droplet_video_analyzer
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+###
+
+import csv
+import itertools
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from prettytable import PrettyTable
+
+from utils.cl_args import get_sweep_options
+from droplet_video_analyzer.parts import set_up_output_filenames
+from frame.FrameGuard import FrameGuard
+from tracker.Tracker import Tracker
+from utils.common import ess
+from utils.common import printc
+from utils.corrections import load_correction_file
+from video.processors import VideoFilePreprocessor
+
+"""
+
+dva sweep: track a video file with every combination of tracker settings, and
+compare the results.
+
+    ./dva sweep sample_files/Fleece_04.mp4 --droplet-similarity 10,20,30 \
+        --distance-threshold 30,40,50 --frame-history 1,2,5
+
+The file is scanned once (or its scan is loaded from the scan cache), and each
+combination is tracked straight from the droplet store, with no video decoding,
+drawing or file output, so a combination takes a small fraction of a full run.
+Combinations are tracked in parallel, each worker process loading the scan cache
+once and undoing its relocations between combinations.
+
+For each combination, the sweep reports:
+
+    unique_droplets     droplets counted, as in the running total on the video
+    total_area          pixel area of those droplets, at their first sighting
+    matches             detections matched to an earlier sighting
+    mean_match_distance mean centroid distance between successive sightings
+    mean_sightings      detections per unique droplet
+    longest_track       most sightings of any one droplet
+
+Corrections from the file's .corrections file, if there is one, aren't applied;
+each combination is scored by how many of them it already agrees with instead.
+
+"""
+
+SWEEP_COLUMNS = [
+    "droplet_similarity",
+    "distance_threshold",
+    "frame_history",
+    "unique_droplets",
+    "total_area",
+    "matches",
+    "mean_match_distance",
+    "mean_sightings",
+    "longest_track",
+]
+
+CORRECTION_COLUMNS = ["corrections_agreed", "corrections_disagreed"]
+
+# The scan and fixed settings, loaded once per worker process by load_sweep_scan().
+_sweep = {}
+
+
+def main(args):
+    argv = vars(get_sweep_options(args))
+    VERBOSE = argv["VERBOSE"]
+
+    video_file_path = os.path.abspath(os.path.expanduser(argv["video_file"]))
+    if not os.path.isfile(video_file_path):
+        sys.exit("\nOops. Cannot find video file {}\n".format(video_file_path))
+
+    try:
+        combinations = list(
+            itertools.product(
+                parse_values(argv["droplet_similarity"], float),
+                parse_values(argv["distance_threshold"], int),
+                parse_values(argv["frame_history"], int),
+            )
+        )
+    except ValueError as error:
+        sys.exit("\nOops. {}\n".format(error))
+
+    output_files = set_up_output_filenames(
+        video_file_path, argv_output_dir=argv["output_directory"]
+    )
+
+    corrections = {}
+    if os.path.exists(output_files["correction_file_path"]):
+        corrections, correction_count = load_correction_file(
+            output_files["correction_file_path"]
+        )
+        if VERBOSE:
+            print(
+                "Scoring against {} correction{} from {}.\n".format(
+                    correction_count,
+                    ess(correction_count),
+                    output_files["correction_file_path"],
+                )
+            )
+
+    # Scan the file here, if it isn't in the cache yet, so the workers can all
+    # load it from the cache.
+    scan_settings = dict(
+        video_file_path=video_file_path,
+        threshold=argv["threshold"],
+        border=argv["border"],
+        cache_dir=output_files["scan_cache_dir"],
+        corrections=corrections,
+        tracker_settings={
+            "assignment": argv["assignment"],
+            "motion_model": argv["motion_model"],
+            "prediction_radius": argv["prediction_radius"],
+        },
+        max_frame_droplets=argv["max_frame_droplets"],
+        pathological_frame_policy=argv["pathological_frame_policy"],
+    )
+    load_sweep_scan(VERBOSE=VERBOSE, **scan_settings)
+
+    jobs = max(1, min(argv["jobs"], len(combinations)))
+    if VERBOSE:
+        printc(
+            "Tracking {} combination{} of tracker settings, {} at a time.".format(
+                len(combinations), ess(len(combinations)), jobs
+            ),
+            "yellow",
+        )
+
+    start_time = time.perf_counter()
+    if jobs > 1:
+        with ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=_load_sweep_scan_from_settings,
+            initargs=(scan_settings,),
+        ) as executor:
+            results = list(executor.map(track_combination, combinations))
+    else:
+        results = [track_combination(combination) for combination in combinations]
+
+    if VERBOSE:
+        print("Done in {:.1f} seconds.\n".format(time.perf_counter() - start_time))
+
+    columns = SWEEP_COLUMNS + (CORRECTION_COLUMNS if corrections else [])
+    print_results(results, columns)
+
+    if corrections and VERBOSE:
+        best = max(results, key=lambda x: x["corrections_agreed"])
+        printc(
+            "\nClosest to corrections: --droplet-similarity {:g} --distance-threshold {} --frame-history {} ({} of {} agreed)".format(
+                best["droplet_similarity"],
+                best["distance_threshold"],
+                best["frame_history"],
+                best["corrections_agreed"],
+                best["corrections_agreed"] + best["corrections_disagreed"],
+            ),
+            "yellow",
+        )
+
+    if argv["csv_file"]:
+        with open(argv["csv_file"], "w", newline="") as results_file:
+            write_results(results_file, results, columns)
+        if VERBOSE:
+            print("\nCreated sweep results file {}.".format(argv["csv_file"]))
+
+
+def parse_values(text, kind):
+    """
+    Parse a comma-separated list of settings.
+
+    :param text: str, like "10,20,30"
+    :param kind: int or float
+    :return: list of values, in order, without repeats
+    :raises ValueError: for anything that isn't a number
+    """
+    values = []
+    for value in text.split(","):
+        try:
+            value = kind(value.strip())
+        except ValueError:
+            raise ValueError(
+                "Can't use '{}' as a tracker setting in '{}'.".format(value, text)
+            )
+        if value not in values:
+            values.append(value)
+    return values
+
+
+def load_sweep_scan(
+    video_file_path,
+    threshold,
+    border,
+    cache_dir,
+    corrections,
+    tracker_settings,
+    max_frame_droplets,
+    pathological_frame_policy,
+    VERBOSE=False,
+):
+    """
+    Load the scan and fixed settings that track_combination() uses. Runs once in
+    the main process and once in each worker process.
+
+    :param video_file_path: str absolute path to video file
+    :param threshold: int image brightness threshold
+    :param border: int pixel width of border to ignore
+    :param cache_dir: str scan cache directory
+    :param corrections: dict of droplet corrections to score against
+    :param tracker_settings: dict of Tracker keyword arguments that aren't swept
+    :param max_frame_droplets: int raw droplet count for pathological frames
+    :param pathological_frame_policy: str FrameGuard policy
+    :param VERBOSE: verbose flag
+    """
+    video_master = VideoFilePreprocessor(
+        video_file_path, threshold, border, cache_dir=cache_dir, VERBOSE=VERBOSE
+    )
+    store = video_master.droplet_store
+
+    # Frames the tracker skips, and rows left out of the totals, are the same for
+    # every combination.
+    frame_guard = FrameGuard(max_frame_droplets, pathological_frame_policy)
+    skipped_frames = set()
+    counted_rows = np.ones(len(store), dtype=np.bool_)
+    for frame_id, droplet_count in enumerate(video_master.droplet_counts_by_frame):
+        action = frame_guard.check(droplet_count)
+        if action in ("skip-tracking", "mark-anomalous"):
+            skipped_frames.add(frame_id)
+        if action == "mark-anomalous":
+            rows = store.frame_rows(frame_id)
+            counted_rows[rows.start : rows.stop] = False
+
+    _sweep.update(
+        video_master=video_master,
+        corrections=corrections,
+        tracker_settings=tracker_settings,
+        skipped_frames=skipped_frames,
+        counted_rows=counted_rows,
+    )
+
+
+def _load_sweep_scan_from_settings(scan_settings):
+    load_sweep_scan(**scan_settings)
+
+
+def track_combination(combination):
+    """
+    Track the whole file with one combination of settings, and return what the
+    tracker made of it. The droplet store is put back the way it was afterward.
+
+    :param combination: (droplet similarity, distance threshold, frame history)
+    :return: dict of results, by column name
+    """
+    droplet_similarity, distance_threshold, frame_history = combination
+    video_master = _sweep["video_master"]
+    store = video_master.droplet_store
+
+    tracker = Tracker(
+        frames_before_deregister=frame_history,
+        confidence_threshold=droplet_similarity,
+        distance_threshold=distance_threshold,
+        droplet_master=video_master,
+        VERBOSE=False,
+        **_sweep["tracker_settings"]
+    )
+
+    start_time = time.perf_counter()
+    for frame_id in range(store.frame_count):
+        if frame_id in _sweep["skipped_frames"]:
+            tracker.skip_frame(this_frame=frame_id)
+        else:
+            tracker.update(
+                new_droplet_dict=video_master.frames[frame_id].droplets,
+                this_frame=frame_id,
+            )
+
+    results = sweep_statistics(store, _sweep["counted_rows"], _sweep["corrections"])
+    results.update(
+        droplet_similarity=droplet_similarity,
+        distance_threshold=distance_threshold,
+        frame_history=frame_history,
+        seconds=time.perf_counter() - start_time,
+    )
+
+    store.undo_relocations(0)
+
+    return results
+
+
+def sweep_statistics(store, counted_rows, corrections=None):
+    """
+    Summarize a tracked droplet store.
+
+    :param store: DropletStore, after tracking
+    :param counted_rows: np bool array, False for rows left out of the totals
+    :param corrections: dict of droplet corrections to score against, new id:
+                        original id, or None for droplets that should stay
+                        unconnected
+    :return: dict of results, by column name
+    """
+    ids = store.column("id")
+    initial_ids = store.column("initial_id")
+
+    # A detection that kept its own id wasn't matched to anything earlier: it's
+    # the first sighting of a droplet.
+    first_sightings = (ids == initial_ids) & counted_rows
+    unique_droplets = int(np.count_nonzero(first_sightings))
+
+    edges = store.lineage_edges()
+    if len(edges):
+        match_distances = np.hypot(
+            store.column("x")[edges[:, 1]] - store.column("x")[edges[:, 0]],
+            store.column("y")[edges[:, 1]] - store.column("y")[edges[:, 0]],
+        )
+        mean_match_distance = float(match_distances.mean())
+    else:
+        mean_match_distance = 0.0
+
+    results = {
+        "unique_droplets": unique_droplets,
+        "total_area": int(store.column("area")[first_sightings].sum()),
+        "matches": store.relocation_count,
+        "mean_match_distance": mean_match_distance,
+        "mean_sightings": (
+            np.count_nonzero(counted_rows) / unique_droplets if unique_droplets else 0.0
+        ),
+        "longest_track": int(store.column("generation").max()) if len(store) else 0,
+    }
+
+    if corrections:
+        agreed = disagreed = 0
+        for new_id, original_id in corrections.items():
+            if not store.has_id(new_id):
+                continue
+            expected_id = new_id if original_id is None else original_id
+            if ids[store.row_for_id(new_id)] == expected_id:
+                agreed += 1
+            else:
+                disagreed += 1
+        results.update(corrections_agreed=agreed, corrections_disagreed=disagreed)
+
+    return results
+
+
+def print_results(results, columns):
+    """
+    Print sweep results as a console table, one row per combination.
+
+    :param results: list of dicts from track_combination()
+    :param columns: list of column names to print
+    """
+    table = PrettyTable(columns + ["seconds"], align="r")
+    for result in results:
+        table.add_row(
+            [format_value(result[column]) for column in columns]
+            + ["{:.2f}".format(result["seconds"])]
+        )
+    print(table)
+
+
+def write_results(results_file, results, columns):
+    """
+    Write sweep results as .csv rows, one per combination.
+
+    :param results_file: open text file
+    :param results: list of dicts from track_combination()
+    :param columns: list of column names to write
+    """
+    csv_writer = csv.writer(results_file, dialect="excel")
+    csv_writer.writerow(columns)
+    for result in results:
+        csv_writer.writerow([format_value(result[column]) for column in columns])
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return "{:.2f}".format(value).rstrip("0").rstrip(".")
+    return value
@@ -24,44 +24,54 @@ from droplet.Droplet import Droplet
 
 
 class Frame:
-    def __init__(self, id):
+    __slots__ = ("id", "_store", "_timecode")
+
+    def __init__(self, id, store=None):
         """
         Initialize video frame.
 
-        :return: int sequence number of frame
+        A Frame is a view over the rows of a DropletStore that belong to it. The
+        frame has to have been started in the store, with store.begin_frame().
+
+        :param id: int sequence number of frame
+        :param store: DropletStore for the video file
         """
         self.id = id
-        self.timecode = frames2timecode(self.id)
+        # Formatted on first use; most frames never need it.
+        self._timecode = None
 
-        self._droplets = OrderedDict()
+        self._store = store
 
     @property
-    def droplets(self):
-        return self._droplets
+    def timecode(self):
+        if self._timecode is None:
+            self._timecode = frames2timecode(self.id)
+        return self._timecode
 
     @property
-    def droplet_count(self):
-        return len(self._droplets)
-
-    def add_droplet(self):
+    def droplets(self):
         """
-        Add new droplet to the video frame.
-
-        :param droplet_id:
+        OrderedDict of Droplet views for this frame, keyed by initial droplet id.
         """
-        d = Droplet()
-        self._droplets[d.id] = d
+        return OrderedDict(
+            (int(self._store.column("initial_id")[row]), Droplet(self._store, row))
+            for row in self._store.frame_rows(self.id)
+        )
 
-        return d
+    @property
+    def droplet_count(self):
+        return len(self._store.frame_rows(self.id))
 
-    def remove_droplet(self, droplet_id):
+    def add_droplet(self, id_allocator):
         """
-        Remove a droplet from the video frame.
+        Add new droplet to the video frame.
 
-        :param droplet_id:
+        :param id_allocator: IdAllocator for the video file's droplet ids
+        :return: Droplet view of the new, blank droplet
         """
+        row = self._store.add(id_allocator.allocate(), self.id)
 
-        self._droplets.remove(droplet_id)
+        return Droplet(self._store, row)
 
 
 ###
@@ -91,5 +101,31 @@ def frames2timecode(frame_count, rate=30, drop=False):
     return "{:02d}:{:02d}:{:02d}:{:02d}".format(hours, minutes, seconds, frames)
 
 
+def timecode2frames(timecode, rate=30):
+    """
+    Converts a colon-separated time code to a frame count, the reverse of
+    frames2timecode(). Accepts HH:MM:SS:FF, HH:MM:SS, MM:SS, or a bare frame count.
+
+    :param timecode: str time code
+    :param rate: frames per second, default is 30
+    :return: int frame count
+    """
+    fields = [int(field) for field in str(timecode).split(":")]
+    if len(fields) == 1:
+        return fields[0]
+    if len(fields) > 4:
+        raise ValueError("Can't read time code '{}'.".format(timecode))
+
+    if len(fields) == 4:
+        frames = fields.pop()
+    else:
+        frames = 0
+    seconds = 0
+    for field in fields:
+        seconds = seconds * 60 + field
+
+    return seconds * rate + frames
+
+
 def find_droplets(frame):
     pass
@@ -0,0 +1,211 @@
+# Copyright (c) 2020 Fredrick Levine
+# rick@xoab.us
+#
+# This file is part of Droplet Video Analyzer
+# https://github.com/rlevine/droplet_video_analyzer
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+###
+
+import csv
+import time
+import numpy as np
+
+"""
+
+A laser flash or a lens hit can turn a frame into thousands of "droplets". Everything
+downstream of the scan was written for frames with a handful of droplets: the tracker
+builds MxN distance and shape matrices, and the labeler builds an overlap matrix for
+every pair of labels. One bad frame can stall a file for minutes.
+
+FrameGuard sits in front of the second pass. Any frame with more raw droplets than
+max_droplets is handled with a degradation policy, in increasing order of severity:
+
+    cluster-labels  - track the frame normally, but draw one label per cluster of
+                      droplets instead of laying out a label for each droplet
+    skip-tracking   - don't send the frame's droplets through the tracker (history
+                      still ages), count every droplet as new, and cluster the labels
+    mark-anomalous  - skip tracking and labeling, leave the frame's droplets out of
+                      the running totals, and mark the frame as anomalous
+
+Every frame gets a record with its droplet counts and timings, whether or not it
+was degraded, so the events show up in the frame report written next to the .csv
+data file. Records are kept in per-frame arrays, so they stay small for long files.
+
+"""
+
+POLICIES = ("cluster-labels", "skip-tracking", "mark-anomalous")
+
+# Per-frame record columns. Missing values are -1 for counts, NaN for times, and
+# -1 for the action (no policy applied).
+RECORD_DTYPE = np.dtype(
+    [
+        ("recorded", np.bool_),
+        ("raw_droplets", np.int64),
+        ("tracked_droplets", np.int64),
+        ("scan_seconds", np.float64),
+        ("process_seconds", np.float64),
+        ("action", np.int8),
+    ]
+)
+
+
+class FrameGuard:
+    def __init__(self, max_droplets=None, policy="skip-tracking", VERBOSE=False):
+        """
+        Initialize the pathological frame guard.
+
+        :param max_droplets: int raw droplet count above which a frame is degraded;
+                             None or 0 turns the guard off
+        :param policy: one of POLICIES
+        :param VERBOSE: verbose flag
+        """
+        if policy not in POLICIES:
+            raise ValueError(
+                "Unknown pathological frame policy '{}', expected one of {}.".format(
+                    policy, ", ".join(POLICIES)
+                )
+            )
+
+        self.max_droplets = max_droplets
+        self.policy = policy
+
+        # Per-frame records, indexed by index frame number.
+        self._frame_records = np.zeros(0, dtype=RECORD_DTYPE)
+        self._start_time = None
+
+        self._VERBOSE = VERBOSE
+
+    @property
+    def degraded_frames(self):
+        """
+        Index frame numbers of all frames that had a policy applied.
+        """
+        records = self._frame_records
+        return np.flatnonzero(records["recorded"] & (records["action"] >= 0)).tolist()
+
+    def check(self, droplet_count):
+        """
+        Return the policy to apply to a frame with droplet_count raw droplets,
+        or None if the frame can be processed normally.
+
+        :param droplet_count: int raw droplets found in the frame
+        :return: str policy or None
+        """
+        if self.max_droplets and droplet_count > self.max_droplets:
+            return self.policy
+        return None
+
+    def start(self, index_frame_number, droplet_count, scan_seconds=None):
+        """
+        Start the record for a frame, and return the action to take.
+
+        :param index_frame_number: int 0-based frame number
+        :param droplet_count: int raw droplets found in the frame
+        :param scan_seconds: float seconds spent on the frame in the initial scan
+        :return: str policy or None
+        """
+        action = self.check(droplet_count)
+
+        if index_frame_number >= len(self._frame_records):
+            grown = np.zeros(
+                max(index_frame_number + 1, len(self._frame_records) * 2, 1024),
+                dtype=RECORD_DTYPE,
+            )
+            grown[: len(self._frame_records)] = self._frame_records
+            self._frame_records = grown
+
+        self._frame_records[index_frame_number] = (
+            True,
+            droplet_count,
+            -1,
+            np.nan if scan_seconds is None else scan_seconds,
+            np.nan,
+            -1 if action is None else POLICIES.index(action),
+        )
+        self._start_time = time.perf_counter()
+
+        return action
+
+    def stop(self, index_frame_number, tracked_droplet_count):
+        """
+        Close the record for a frame.
+
+        :param index_frame_number: int 0-based frame number
+        :param tracked_droplet_count: int droplets left after tracking
+        """
+        record = self._frame_records[index_frame_number]
+        record["tracked_droplets"] = tracked_droplet_count
+        record["process_seconds"] = time.perf_counter() - self._start_time
+
+    def summary(self):
+        """
+        Friendly summary string of degraded frames, or None if there weren't any.
+        """
+        degraded_frames = self.degraded_frames
+        if not degraded_frames:
+            return None
+
+        process_seconds = np.nan_to_num(self._frame_records["process_seconds"])
+        slowest = max(degraded_frames, key=lambda x: process_seconds[x])
+
+        return "{} pathological frame{} over {} droplets ({}): {}\n(slowest: frame {}, {} droplets, {:.2f} seconds)".format(
+            len(degraded_frames),
+            "" if len(degraded_frames) == 1 else "s",
+            self.max_droplets,
+            self.policy,
+            " ".join([str(x + 1) for x in degraded_frames]),
+            slowest + 1,
+            self._frame_records[slowest]["raw_droplets"],
+            process_seconds[slowest],
+        )
+
+    def write(self, file_path):
+        """
+        Write the per-frame report as a .csv file.
+
+        :param file_path: str absolute file path
+        """
+        report_file = open(file_path, "w", newline="")
+        csv_writer = csv.writer(report_file, dialect="excel")
+        csv_writer.writerow(
+            [
+                'frame',
+                'raw_droplets',
+                'tracked_droplets',
+                'scan_seconds',
+                'process_seconds',
+                'degraded',
+            ]
+        )
+        for frame_id in np.flatnonzero(self._frame_records["recorded"]).tolist():
+            record = self._frame_records[frame_id]
+            csv_writer.writerow(
+                [
+                    frame_id + 1,
+                    record["raw_droplets"],
+                    "" if record["tracked_droplets"] < 0 else record["tracked_droplets"],
+                    ""
+                    if np.isnan(record["scan_seconds"])
+                    else "{:.4f}".format(record["scan_seconds"]),
+                    ""
+                    if np.isnan(record["process_seconds"])
+                    else "{:.4f}".format(record["process_seconds"]),
+                    "" if record["action"] < 0 else POLICIES[record["action"]],
+                ]
+            )
+        report_file.close()
+
+        if self._VERBOSE:
+            print("Created frame report {}.".format(file_path))
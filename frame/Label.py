@@ -18,7 +18,6 @@
 
 ###
 
-from collections import defaultdict, OrderedDict
 import cv2
 from sys import exit
 
@@ -26,7 +25,47 @@ from config.common import bright_red, dark_gray, bright_green, amber, dark_green
 from utils.Rectangle import Rectangle
 
 
+"""
+
+A Label is made for every droplet in every frame, so it uses __slots__, and leaves
+anything that isn't needed for every label (its center, its contour bounding box
+Rectangle) to be computed when it's first asked for.
+
+"""
+
+
+def _text_size(text_string, font_scale):
+    # (width, height, baseline) of a line of label text.
+    (width, height), baseline = cv2.getTextSize(
+        text_string, cv2.FONT_HERSHEY_PLAIN, font_scale, 1
+    )
+    # Fudges: opencv reports height as one pixel less than it is, and baseline
+    # seems consistently 1 px big.
+    return width, height + 1, baseline - 1
+
+
 class Label:
+    __slots__ = (
+        "id",
+        "initial_id",
+        "area",
+        "contour",
+        "frame_number",
+        "contour_box_margin",
+        "stand_off",
+        "leading",
+        "text_bounding_box",
+        "corner_status",
+        "corner_used",
+        "_center",
+        "_contour_bounding_box",
+        "_contour_bounding_box_corners",
+        "_text_data",
+        "_corner_points",
+        "_text_box_width",
+        "_text_box_height",
+    )
+
     def __init__(self, droplet, stand_off=2, contour_box_margin=5, leading=2):
         """
         Initialize label.
@@ -51,33 +90,33 @@ class Label:
         # This is potentially slightly different from the centroid of the underlying
         # droplet, as the droplet centroid skews slightly based on the shape of the
         # droplet. (And this level of precision probably won't ever matter. But it's
-        # easy to do. :)
-        self.center = None
+        # easy to do. :) Computed on first use.
+        self._center = None
 
         # The four text Rectangles, 0-3, which can be used for labeling.
         # These can be compared directly to rectangles on other droplets
         # to gauge collisions between label areas.
-        self.text_bounding_box = OrderedDict()
+        self.text_bounding_box = [None, None, None, None]
 
-        # The status of each of the four possible text locations.
+        # The status of each of the four possible text locations, by corner.
         # None if unknown, False if not available, True if available.
-        self.corner_status = OrderedDict()
-        for corner in [0, 1, 2, 3]:
-            self.corner_status[corner] = None
+        self.corner_status = [None, None, None, None]
 
         # Corner label area used to draw label, None or one of 0-3.
         self.corner_used = None
 
         # Private
 
-        # The corners of the bounding box outline we display.
+        # The corners of the bounding box outline we display, and the Rectangle,
+        # made on first use.
         self._contour_bounding_box_corners = None
+        self._contour_bounding_box = None
 
         # Calculated text metrics for each line of text in a label
-        self._text_data = defaultdict(dict)
+        self._text_data = {"width": {}, "height": {}, "baseline": {}}
 
         # The corner points nearest the contour of the four text areas.
-        self._corner_points = {}
+        self._corner_points = None
 
         # Dimensions of label text box.
         self._text_box_width = None
@@ -87,16 +126,27 @@ class Label:
 
         self._calculate_bounding_box()
         self._calc_points()
-        self._calc_center()
 
-        def _repr_(self):
+    def __repr__(self):
 
-            if self.initial_id != self.id:
-                initial_id_string = " (Was droplet {}.)".format(self.initial_id)
-            else:
-                initial_id_string = ""
+        if self.initial_id != self.id:
+            initial_id_string = " (Was droplet {}.)".format(self.initial_id)
+        else:
+            initial_id_string = ""
 
-            return "Label for droplet {}.{}".format(str(self.id), initial_id_string)
+        return "Label for droplet {}.{}".format(str(self.id), initial_id_string)
+
+    @property
+    def contour_bounding_box(self):
+        if self._contour_bounding_box is None:
+            self._contour_bounding_box = Rectangle(*self._contour_bounding_box_corners)
+        return self._contour_bounding_box
+
+    @property
+    def center(self):
+        if self._center is None:
+            self._calc_center()
+        return self._center
 
     ###
     def draw_contour_bounding_box(self, video_frame, color=bright_red, thickness=1):
@@ -126,57 +176,33 @@ class Label:
         # (This is evolving - I added a Rectangle class to help understand overlaps
         # between labels, and I'll back into using it here.)
 
-        # initial id
-        text_string = str(self.initial_id)
-        (
+        for line, text_string, font_scale in (
+            ("initial_id", str(self.initial_id), 1),
+            ("id", str(self.id), 2),
+            ("area", "{}px".format(self.area), 1),  # area in pixels as "Npx"
+        ):
             (
-                self._text_data["width"]["initial_id"],
-                self._text_data["height"]["initial_id"],
-            ),
-            self._text_data["baseline"]["initial_id"],
-        ) = cv2.getTextSize(text_string, cv2.FONT_HERSHEY_PLAIN, 1, 1)
-        self._text_data["height"][
-            "initial_id"
-        ] += 1  # fudge, as opencv reports height as one pixel less than it is
-        self._text_data["baseline"][
-            "initial_id"
-        ] -= 1  # fudge, baseline seems consistently 1 px big
-
-        # id
-        text_string = str(self.id)
-        (
-            (self._text_data["width"]["id"], self._text_data["height"]["id"]),
-            self._text_data["baseline"]["id"],
-        ) = cv2.getTextSize(text_string, cv2.FONT_HERSHEY_PLAIN, 2, 1)
-        self._text_data["height"]["id"] += 1
-        self._text_data["baseline"][
-            "id"
-        ] -= 1  # fudge, baseline seems consistently 1 px big
-
-        # area in pixels as "Npx"
-        text_string = "{}px".format(self.area)
-        (
-            (self._text_data["width"]["area"], self._text_data["height"]["area"]),
-            self._text_data["baseline"]["area"],
-        ) = cv2.getTextSize(text_string, cv2.FONT_HERSHEY_PLAIN, 1, 1)
-        self._text_data["height"]["area"] += 1
-        self._text_data["baseline"][
-            "area"
-        ] -= 1  # fudge, baseline seems consistently 1 px big
-
-        [self._text_box_width] = max(
-            [self._text_data["width"][x]] for x in self._text_data["width"]
-        )
-        self._text_box_height = (
-            self._text_data["height"]["id"]
+                self._text_data["width"][line],
+                self._text_data["height"][line],
+                self._text_data["baseline"][line],
+            ) = _text_size(text_string, font_scale)
+
+        widths = self._text_data["width"]
+        heights = self._text_data["height"]
+        text_box_width = max(widths.values())
+        text_box_height = (
+            heights["id"]
             + self.leading
             + self._text_data["baseline"]["area"]
             + self.leading
-            + self._text_data["height"]["area"]
+            + heights["area"]
         )
 
         if self.initial_id != self.id:
-            self._text_box_height += self._text_data["height"]["initial_id"] + 1
+            text_box_height += heights["initial_id"] + 1
+
+        self._text_box_width = text_box_width
+        self._text_box_height = text_box_height
 
         # Bounding box corner points.
 
@@ -184,58 +210,36 @@ class Label:
         # distance, and from which the label bounding boxes can be drawn.
 
         ((x1, y1), (x2, y2)) = self._contour_bounding_box_corners
+        stand_off = self.stand_off
+        left, top = x1 - stand_off, y1 - stand_off
+        right, bottom = x2 + stand_off, y2 + stand_off
 
         # 0th point is upper left, and then clockwise from there through 1, 2, and 3
-        self._corner_points[0] = (x1 - self.stand_off, y1 - self.stand_off)
-        self._corner_points[1] = (x2 + self.stand_off, y1 - self.stand_off)
-        self._corner_points[2] = (x2 + self.stand_off, y2 + self.stand_off)
-        self._corner_points[3] = (x1 - self.stand_off, y2 + self.stand_off)
-
-        # And the actual label text area bounding boxes.
-
-        self.text_bounding_box[0] = Rectangle(
-            (
-                self._corner_points[0][0] - self._text_box_width,
-                self._corner_points[0][1] - self._text_box_height,
-            ),
-            self._corner_points[0],
-        )
-
-        self.text_bounding_box[1] = Rectangle(
-            (
-                self._corner_points[1][0],
-                self._corner_points[1][1] - self._text_box_height,
-            ),
-            (
-                self._corner_points[1][0] + self._text_box_width,
-                self._corner_points[1][1],
-            ),
+        self._corner_points = (
+            (left, top),
+            (right, top),
+            (right, bottom),
+            (left, bottom),
         )
 
-        self.text_bounding_box[2] = Rectangle(
-            self._corner_points[2],
-            (
-                self._corner_points[2][0] + self._text_box_width,
-                self._corner_points[2][1] + self._text_box_height,
-            ),
-        )
+        # And the actual label text area bounding boxes.
 
-        self.text_bounding_box[3] = Rectangle(
-            (
-                self._corner_points[3][0] - self._text_box_width,
-                self._corner_points[3][1],
+        self.text_bounding_box = [
+            Rectangle((left - text_box_width, top - text_box_height), (left, top)),
+            Rectangle((right, top - text_box_height), (right + text_box_width, top)),
+            Rectangle(
+                (right, bottom), (right + text_box_width, bottom + text_box_height)
             ),
-            (
-                self._corner_points[3][0],
-                self._corner_points[3][1] + self._text_box_height,
+            Rectangle(
+                (left - text_box_width, bottom), (left, bottom + text_box_height)
             ),
-        )
+        ]
 
         # print(self.text_bounding_box)
         # print()
 
     def _calc_center(self):
-        self.center = Rectangle(
+        self._center = Rectangle(
             self.text_bounding_box[0].upper_left, self.text_bounding_box[2].lower_right
         ).center
 
@@ -260,7 +264,7 @@ class Label:
         :param thickness: line thickness in pixels
 
         """
-        for corner in self.text_bounding_box:
+        for corner in range(4):
             self.text_bounding_box[corner].draw(
                 video_frame, color=dark_gray, thickness=1
             )
@@ -19,6 +19,8 @@
 ###
 
 from collections import OrderedDict
+from collections import defaultdict
+from functools import reduce
 from itertools import combinations
 from itertools import product
 from itertools import islice
@@ -29,6 +31,8 @@ import numpy as np
 import cv2
 
 from config.common import bright_red
+from config.common import bright_green
+from config.common import amber
 from frame.Label import Label
 from utils.common import printc
 from utils.common import andbytes
@@ -57,6 +61,10 @@ class Labeler:
         )
         self.video_frame_boundary = Rectangle((0, 0), frame_shape)
 
+        # Grid cell size, in pixels, used to group droplets when labels are
+        # clustered for crowded frames.
+        self.cluster_cell_size = 100
+
         # Pixel buffer width at the edge of the video frame to avoid putting labels in.
 
     # @property
@@ -115,7 +123,13 @@ class Labeler:
                 ):
                     self.labels[label].corner_status[box] = False
 
-    def draw(self, video_frame):
+    def draw(self, video_frame, CLUSTERED=False):
+
+        # A pathological frame, with more droplets than we can sensibly lay out
+        # labels for, gets one label per cluster of droplets instead. (See
+        # frame.FrameGuard.)
+        if CLUSTERED:
+            return self._draw_clusters(video_frame)
 
         # Each droplet has four possible label positions, 0-3, starting in with the
         # upper left quadrant, and continuing clockwise. We'll need a data structure
@@ -308,8 +322,8 @@ class Labeler:
 
                 # Assign label corner, starting with 0, checking for any
                 # marked as False by frame edge test or collision code, etc.
-                for corner in this_label.corner_status:
-                    if this_label.corner_status[corner] is not False:
+                for corner, status in enumerate(this_label.corner_status):
+                    if status is not False:
                         this_label.corner_used = corner
                         break
                     else:
@@ -331,6 +345,51 @@ class Labeler:
 
         return video_frame
 
+    def _draw_clusters(self, video_frame):
+        """
+        Degraded labeling for crowded frames. Droplets are grouped by the grid cell
+        their contour bounding box center falls in, and each group gets one outline
+        and one line of text with its droplet count and pixel area. This skips the
+        label overlap matrix and the nearest-neighbor chain, both of which grow with
+        the square of the number of labels.
+
+        :param video_frame: opencv video frame to draw on
+        :return: video frame
+        """
+        clusters = defaultdict(list)
+        for label_id in self.labels:
+            center_x, center_y = self.labels[label_id].contour_bounding_box.center
+            cell = (
+                int(center_x) // self.cluster_cell_size,
+                int(center_y) // self.cluster_cell_size,
+            )
+            clusters[cell].append(label_id)
+
+        for cell in clusters:
+            cluster_box = reduce(
+                lambda a, b: a | b,
+                [self.labels[x].contour_bounding_box for x in clusters[cell]],
+            )
+            cluster_box.draw(video_frame, color=amber, thickness=1)
+
+            droplet_count = len(clusters[cell])
+            text_string = "{} droplet{}, {}px".format(
+                droplet_count,
+                "" if droplet_count == 1 else "s",
+                sum([self.labels[x].area for x in clusters[cell]]),
+            )
+            cv2.putText(
+                video_frame,
+                text_string,
+                (cluster_box.min_x, cluster_box.min_y - 3),
+                fontFace=cv2.FONT_HERSHEY_PLAIN,
+                fontScale=1,
+                thickness=1,
+                color=bright_green,
+            )
+
+        return video_frame
+
     def _choose_label_corners(self):
         # List of object centers
         object_centers = [self.labels[x].center for x in self.labels]
@@ -515,14 +574,17 @@ class Labeler:
         Given a an x,y coordinate tuple for a starting point and a pair of lists, one of
         object center coordinates and the other identifiers for each center point, in
         corresponding order, finds the object nearest to the starting point and then
-        recursively sorts the remainder of the object list into a chain, where each
-        object is the one closest, by euclidean distance, to its predecessor. Returns
-        the sorted list of object ids.
+        sorts the remainder of the object list into a chain, where each object is the
+        one closest, by euclidean distance, to its predecessor. Returns the sorted list
+        of object ids.
+
+        (This used to recurse once per object, which ran into the interpreter's
+        recursion limit on frames with a thousand or so droplets.)
 
         :param first_point: starting x,y tuple; for instance, the center of video frame
         :param object_centers: list of object center coordinate tuples
         :param object_indices: list of object ids for the centers, in the same order
-        :param last_found: internal tracker for intermediate recursion results
+        :param last_found: optional list of already-sorted ids to add to
 
         """
 
@@ -532,10 +594,12 @@ class Labeler:
         if last_found is None:
             last_found = []
 
-        if len(object_indices) > 1:
+        nearest_point = first_point
+
+        while len(object_indices) > 1:
 
             # Creates an array, with distances from the starting point to all objects.
-            distances = distance.cdist(first_point, object_centers, "euclidean")
+            distances = distance.cdist(nearest_point, object_centers, "euclidean")
 
             # Finds index of object/coordinate pair with the shortest distance to
             # starting point.
@@ -550,11 +614,8 @@ class Labeler:
             ]
 
             # And we repeat, until our original list only has one object left.
-            last_found = self._sort_nearest(
-                nearest_point, object_centers, object_indices, last_found=last_found
-            )
-        else:
-            # Add the remaining object id to the list.
-            last_found.extend(object_indices)
+
+        # Add the remaining object id to the list.
+        last_found.extend(object_indices)
 
         return last_found
@@ -0,0 +1,141 @@
+# Copyright (c) 2020 Fredrick Levine
+# rick@xoab.us
+#
+# This file is part of Droplet Video Analyzer
+# https://github.com/rlevine/droplet_video_analyzer
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+###
+
+from PIL import Image
+import numpy as np
+import cv2
+
+from utils.video import draw_text
+
+"""
+
+Frame furniture that's the same on every frame of a video: the file name and
+settings in the frame header, the graph's axis and labels, the UI prompt.
+
+It's drawn once, into a BGRA layer the size of the frame, and each frame only
+gets the layer's pixels copied on to it. Lines and opencv text are opaque, and
+copied as they are; PIL text is antialiased, and its edges are blended with
+what's under them, as draw_text() would blend them. The pixels to copy and to
+blend are found once, when the layer is drawn, so a frame costs as much as
+the furniture covers, not the whole frame.
+
+The layer is drawn again when its key changes: whatever the furniture depends
+on, like the brightness threshold in the header, or the graph's y scale.
+
+"""
+
+
+class Overlay:
+    def __init__(self):
+        self._key = None
+        self._layer = None
+        # (rows, columns, BGRA colors) of the layer's opaque pixels, and of the
+        # partly transparent ones, as a one row PIL image to composite.
+        self._opaque = None
+        self._blended = None
+
+    def stale(self, shape, key):
+        """
+        Check whether the layer needs to be drawn again.
+
+        :param shape: np shape of the frames it goes on
+        :param key: anything the furniture depends on, to compare with ==
+        :return: boolean
+        """
+        return (
+            self._layer is None
+            or self._layer.shape[:2] != tuple(shape[:2])
+            or key != self._key
+        )
+
+    def clear(self, shape, key):
+        """
+        Start the layer again, empty, to draw the furniture for a key.
+
+        :param shape: np shape of the frames it goes on
+        :param key: anything the furniture depends on, to compare with ==
+        """
+        height, width = shape[:2]
+        if self._layer is None or self._layer.shape[:2] != (height, width):
+            self._layer = np.zeros((height, width, 4), dtype=np.uint8)
+        else:
+            self._layer[:] = 0
+        self._key = key
+        self._opaque = None
+        self._blended = None
+
+    def line(self, point_1, point_2, color, thickness=1):
+        cv2.line(self._layer, point_1, point_2, tuple(color) + (255,), thickness)
+
+    def put_text(self, text_string, xy, font_scale, color):
+        # As frame_label.py draws text.
+        cv2.putText(
+            self._layer,
+            text_string,
+            xy,
+            fontFace=cv2.FONT_HERSHEY_PLAIN,
+            fontScale=font_scale,
+            thickness=1,
+            color=tuple(color) + (255,),
+        )
+
+    def draw_text(self, xy, text, fill, font, angle=0):
+        draw_text(self._layer, xy, text, fill=fill, font=font, angle=angle)
+
+    def composite(self, display_frame):
+        """
+        Copy the layer on to a frame, in place.
+
+        :param display_frame: np video frame, BGR or BGRA
+        :return: np video frame
+        """
+        if self._opaque is None:
+            self._index_pixels()
+        depth = display_frame.shape[2]
+
+        rows, columns, colors = self._opaque
+        display_frame[rows, columns] = colors[:, :depth]
+
+        rows, columns, text_image = self._blended
+        if len(rows):
+            base = display_frame[rows, columns]
+            if depth == 3:
+                base = np.column_stack((base, np.full(len(rows), 255, dtype=np.uint8)))
+            composited = Image.alpha_composite(
+                Image.fromarray(base[np.newaxis], "RGBA"), text_image
+            )
+            display_frame[rows, columns] = np.asarray(composited)[0, :, :depth]
+
+        return display_frame
+
+    # Private
+
+    def _index_pixels(self):
+        alpha = self._layer[:, :, 3]
+        rows, columns = np.nonzero(alpha == 255)
+        self._opaque = (rows, columns, self._layer[rows, columns])
+
+        rows, columns = np.nonzero((alpha > 0) & (alpha < 255))
+        colors = np.ascontiguousarray(self._layer[rows, columns])
+        self._blended = (
+            rows,
+            columns,
+            Image.fromarray(colors[np.newaxis], "RGBA") if len(rows) else None,
+        )
@@ -19,13 +19,23 @@
 ###
 
 import cv2
+import numpy as np
 from utils.video import measure_text_size, draw_text
+from frame.Overlay import Overlay
 from config.common import dark_green
 from config.common import dark_amber
 from config.common import amber
 from config.common import magenta
 from config.common import graph_axis_font
 
+# Room to the right of the graph for the right y axis labels, in pixels.
+RIGHT_AXIS_WIDTH = 120
+
+# Shortest distance between second ticks on the x axis, in pixels, and the
+# intervals, in seconds, they can be spaced at.
+MIN_TICK_SPACING = 15
+TICK_SECONDS = (1, 5, 10, 30, 60, 300, 600, 1800, 3600)
+
 
 class Grapher:
     """
@@ -46,13 +56,16 @@ class Grapher:
         max_y_data=None,
         max_y2_data=None,
         y_axis_height=None,
+        max_x_data=None,
     ):
         self.canvas = None
         self.origin = origin
         self.x, self.y = self.origin
-        self.value_1_values = []
-        self.value_2_values = []
-        self.value_3_values = []
+        # Per-frame data, in arrays sized for the file (max_x_data frames), rather
+        # than lists that grow for the whole video.
+        self._value_count = 0
+        self._values = np.zeros((3, max(max_x_data or 0, 1)), dtype=np.int64)
+        self._max_x_data = max_x_data
         self.value_3_scale = 30  # I've given up on generalizing at this point. :)
         self.x_label = x_label
         self.lower_x_label = lower_x_label
@@ -68,47 +81,146 @@ class Grapher:
         self.y1_max = max_y_data  # Max Y data value
         self.y2_max = max_y2_data  # Max Y data value
         self.y_axis_height = y_axis_height  # Pixel height of Y axis
+        # The graph's lines, kept from frame to frame: a BGRA layer, the mask of
+        # pixels drawn in it, the area they cover, how many values are drawn,
+        # and the y scale they were drawn at.
+        self._layer = None
+        self._layer_mask = None
+        self._layer_bounds = None
+        self._layer_value_count = 0
+        self._layer_scale = None
+        self._y1_scaling_factor = 0
+        self._y2_scaling_factor = 0
+        # Long files get more than one frame per pixel column on the x axis.
+        # Each column shows the smallest and largest values of its frames,
+        # kept in bins as the values come in.
+        self._frames_per_column = 1
+        self._frames_per_tick = 30
+        self._bin_min = np.zeros((3, 1), dtype=np.int64)
+        self._bin_max = np.zeros((3, 1), dtype=np.int64)
+        # The y axis and its labels, and the x axis labels.
+        self._overlay = Overlay()
+
+    @property
+    def value_1_values(self):
+        return self._values[0, : self._value_count]
+
+    @property
+    def value_2_values(self):
+        return self._values[1, : self._value_count]
+
+    @property
+    def value_3_values(self):
+        return self._values[2, : self._value_count]
+
+    @property
+    def value_count(self):
+        return self._value_count
 
     def update(self, value_1, value_3):
-        self.value_1_values.append(value_1)
-        self.value_2_values.append(sum(self.value_1_values))
-        self.value_3_values.append(int(value_3 * self.value_3_scale))
+        if self._value_count == self._values.shape[1]:
+            self._values = np.concatenate(
+                (self._values, np.zeros_like(self._values)), axis=1
+            )
+        # Value 2 is the running total of value 1.
+        if self._value_count:
+            running_total = self._values[1, self._value_count - 1]
+        else:
+            running_total = 0
+        self._values[:, self._value_count] = (
+            value_1,
+            running_total + value_1,
+            int(value_3 * self.value_3_scale),
+        )
+        self._value_count += 1
+
+    def rewind(self, value_count):
+        # Drop the values after the first value_count, to add them again.
+        self._value_count = min(value_count, self._value_count)
 
-    def reset_max_y(self, max_y1_data):
+    def reset_max_y(self, max_y1_data, max_y2_data=None):
         self.y1_max = max_y1_data
+        if max_y2_data is not None:
+            self.y2_max = max_y2_data
 
     def draw_graph(self):
 
-        self._max_data_label_width, self._max_data_label_height = measure_text_size(
-            self.canvas, self.y1_max, graph_axis_font
-        )
+        # The axes and data are drawn into a persistent layer, a column at a
+        # time as values come in, and copied on to each frame. The layer is
+        # only drawn again from scratch when the y scale changes, or after a
+        # rewind.
+        if (self.y1_max, self.y2_max) != self._layer_scale or (
+            self._layer_value_count > self._value_count
+        ):
+            self._max_data_label_width, self._max_data_label_height = measure_text_size(
+                self.canvas, self.y1_max, graph_axis_font
+            )
+            self._clear_layer()
+
+        # The y axis and the labels that stay put are drawn once, into an
+        # overlay, and drawn again when the y scale changes.
+        if self._overlay.stale(self.canvas.shape, self._layer_scale):
+            self._draw_overlay()
+        self._overlay.composite(self.canvas)
+
+        # One frame gets one pixel column on the x axis, as long as the file
+        # fits across the frame; longer files are binned, several frames to a
+        # column (see _clear_layer()).
+
+        # Bin the new values, draw the columns they changed, and copy the layer
+        # on to the frame.
+        self._draw_values(self._layer_value_count, self._value_count)
+        self._layer_value_count = self._value_count
+        self._composite_layer()
+
+        self._draw_right_y_axis()
+
+        return self.canvas
+
+    # Private
+
+    def _clear_layer(self):
+        # Start the layer again, empty, at the current scale.
+        height, width = self.canvas.shape[:2]
+        if self._layer is None or self._layer.shape[:2] != (height, width):
+            self._layer = np.zeros((height, width, 4), dtype=np.uint8)
+            self._layer_mask = np.zeros((height, width), dtype=np.uint8)
+        else:
+            self._layer[:] = 0
+            self._layer_mask[:] = 0
+        self._layer_bounds = None
+        self._layer_value_count = 0
+        self._layer_scale = (self.y1_max, self.y2_max)
 
-        # I'm assuming for now that I don't have to scale the on-screen graph
-        # horizontally, so one frame gets one pixel on the x axis.
-        # This will break on files longer than about 60 seconds of video for
-        # 1920x1080 files.
         try:
-            y1_scaling_factor = self.y_axis_height / self.y1_max
+            self._y1_scaling_factor = self.y_axis_height / self.y1_max
         except ZeroDivisionError:
-            y1_scaling_factor = 0
+            self._y1_scaling_factor = 0
 
         try:
-            y2_scaling_factor = self.y_axis_height / self.y2_max
+            self._y2_scaling_factor = self.y_axis_height / self.y2_max
         except ZeroDivisionError:
-            y2_scaling_factor = 0
+            self._y2_scaling_factor = 0
+
+        # Enough frames per column for the whole file to fit across the frame,
+        # and second ticks far enough apart to read.
+        columns = max(width - self.x - 2 - RIGHT_AXIS_WIDTH, 1)
+        self._frames_per_column = max(-(-(self._max_x_data or 0) // columns), 1)
+        for seconds in TICK_SECONDS:
+            self._frames_per_tick = 30 * seconds
+            if self._frames_per_tick >= MIN_TICK_SPACING * self._frames_per_column:
+                break
+
+    def _draw_overlay(self):
+        self._overlay.clear(self.canvas.shape, self._layer_scale)
 
         # y axis
-        self.canvas = cv2.line(
-            self.canvas,
-            self.origin,
-            (self.x, self.y - self.y_axis_height),
-            self.axis_color,
-            1,
+        self._overlay.line(
+            self.origin, (self.x, self.y - self.y_axis_height), self.axis_color
         )
 
         # y axis label
-        self.canvas = draw_text(
-            self.canvas,
+        self._overlay.draw_text(
             (self.x - self._max_data_label_width - 13, self.y - 20),
             self.y_label,
             fill=self.axis_color,
@@ -116,89 +228,146 @@ class Grapher:
             angle=90,
         )
         # x axis label
-        self.canvas = draw_text(
-            self.canvas,
+        self._overlay.draw_text(
             (self.x + 20, self.y + 15),
             self.x_label,
             fill=self.axis_color,
             font=graph_axis_font,
         )
         # lower x axis label
-        self.canvas = draw_text(
-            self.canvas,
+        self._overlay.draw_text(
             (self.x + 20, self.y + 80),
             self.lower_x_label,
             fill=self.axis_color,
             font=graph_axis_font,
         )
         # y axis max annotation
-        self.canvas = draw_text(
-            self.canvas,
+        self._overlay.draw_text(
             (self.x - self._max_data_label_width - 5, self.y - self.y_axis_height - 11),
             str(self.y1_max),
             fill=self.data_color_1,
             font=graph_axis_font,
         )
 
+    def _draw_values(self, start, stop):
+        """
+        Bin values into their columns, and draw the columns that changed.
+
+        :param start: int index of the first value not yet binned
+        :param stop: int number of values
+        """
+        if start == stop:
+            return
+        frames_per_column = self._frames_per_column
+        first_column = start // frames_per_column
+        column_count = -(-stop // frames_per_column)
+        if column_count > self._bin_max.shape[1]:
+            self._bin_min = self._grown(self._bin_min, column_count)
+            self._bin_max = self._grown(self._bin_max, column_count)
+
+        # Min and max of each column's values, from the first column with
+        # new values on; a column that already had values keeps them.
+        bin_start = first_column * frames_per_column
+        bin_starts = np.arange(bin_start, stop, frames_per_column)
+        values = self._values[:, bin_start:stop]
+        self._bin_min[:, first_column:column_count] = np.minimum.reduceat(
+            values, bin_starts - bin_start, axis=1
+        )
+        self._bin_max[:, first_column:column_count] = np.maximum.reduceat(
+            values, bin_starts - bin_start, axis=1
+        )
+
+        for column in range(first_column, column_count):
+            self._draw_column(column, stop)
+
+    def _draw_column(self, column, value_count):
+        # Draw one column of the graph into the layer, over whatever was there.
+        value_1_max, value_2_max, value_3_max = self._bin_max[:, column].tolist()
+        value_2_min = int(self._bin_min[1, column])
+        data_x = self.x + 2 + column
+        if data_x < self._layer.shape[1]:
+            self._layer[:, data_x] = 0
+            self._layer_mask[:, data_x] = 0
+
         # data 1 - droplets per frame
-        data_x = self.x + 2
         data_y = self.y - 2
-        value_1_count = 1
-        for value_1 in self.value_1_values:
-            if value_1 > 0:
-                self.canvas = cv2.line(
-                    self.canvas,
-                    (data_x, data_y),
-                    (data_x, data_y - int(value_1 * y1_scaling_factor)),
-                    self.data_color_1,
-                    1,
-                )
-
-            self._draw_x_axis(value_1_count)
-            if value_1_count % 30 == 0:
-                self._draw_second_tick(data_x)
-            value_1_count += 1
-            data_x += 1
+        if value_1_max > 0:
+            self._draw_line(
+                (data_x, data_y),
+                (data_x, data_y - int(value_1_max * self._y1_scaling_factor)),
+                self.data_color_1,
+            )
+
+        self._draw_x_axis(column + 1)
+        # A tick in the column of every frames_per_tick'th frame.
+        first_frame = column * self._frames_per_column
+        last_frame = min(first_frame + self._frames_per_column, value_count)
+        if last_frame // self._frames_per_tick > first_frame // self._frames_per_tick:
+            self._draw_second_tick(data_x)
 
         # data 2 - cumulative - plot after per/frame data, so it appears over.
-        data_x = self.x + 2
-        data_y = self.y - 2
-        value_2_count = 1
-        for value_2 in self.value_2_values:
-            if value_2 > 0:
-                self.canvas = cv2.line(
-                    self.canvas,
-                    (data_x, data_y - int(value_2 * y2_scaling_factor + 1)),
-                    (data_x, data_y - int(value_2 * y2_scaling_factor)),
-                    self.data_color_2,
-                    1,
-                )
-
-            value_2_count += 1
-            data_x += 1
+        if value_2_max > 0:
+            self._draw_line(
+                (data_x, data_y - int(value_2_max * self._y2_scaling_factor + 1)),
+                (data_x, data_y - int(value_2_min * self._y2_scaling_factor)),
+                self.data_color_2,
+            )
 
         # data 3 - audio data.
-        data_x = self.x + 2
         data_y = self.y + 40 + self.value_3_scale
-        value_3_count = 1
-        for value_3 in self.value_3_values:
-            if value_3 > 0:
-                self.canvas = cv2.line(
-                    self.canvas,
-                    (data_x, data_y),
-                    (data_x, data_y - value_3),
-                    self.data_color_3,
-                    1,
-                )
-
-            value_3_count += 1
-            data_x += 1
+        if value_3_max > 0:
+            self._draw_line(
+                (data_x, data_y), (data_x, data_y - value_3_max), self.data_color_3
+            )
 
-        self._draw_right_y_axis()
+    def _grown(self, bins, size):
+        grown = np.zeros((3, max(size, bins.shape[1] * 2)), dtype=bins.dtype)
+        grown[:, : bins.shape[1]] = bins
+        return grown
 
-        return self.canvas
+    def _draw_line(self, point_1, point_2, color):
+        # A one pixel line in the layer, in the color cv2.line() would leave on
+        # a BGRA frame, and in the layer's mask.
+        cv2.line(self._layer, point_1, point_2, color + (0,), 1)
+        cv2.line(self._layer_mask, point_1, point_2, 1, 1)
 
-    # Private
+        bounds = (
+            min(point_1[0], point_2[0]),
+            min(point_1[1], point_2[1]),
+            max(point_1[0], point_2[0]) + 1,
+            max(point_1[1], point_2[1]) + 1,
+        )
+        if self._layer_bounds is not None:
+            bounds = (
+                min(bounds[0], self._layer_bounds[0]),
+                min(bounds[1], self._layer_bounds[1]),
+                max(bounds[2], self._layer_bounds[2]),
+                max(bounds[3], self._layer_bounds[3]),
+            )
+        self._layer_bounds = bounds
+
+    def _composite_layer(self):
+        # Copy the layer's pixels on to the frame, within the area drawn on.
+        if self._layer_bounds is None:
+            return
+        height, width, depth = self.canvas.shape
+        left, top, right, bottom = self._layer_bounds
+        left, top = max(left, 0), max(top, 0)
+        right, bottom = min(right, width), min(bottom, height)
+        if left >= right or top >= bottom:
+            return
+        canvas = self.canvas[top:bottom, left:right]
+        layer = self._layer[top:bottom, left:right]
+        mask = self._layer_mask[top:bottom, left:right].view(np.bool_)
+        if depth == 4:
+            # A BGRA pixel at a time, as one 32 bit value.
+            np.copyto(
+                canvas.view(np.uint32)[..., 0],
+                layer.view(np.uint32)[..., 0],
+                where=mask,
+            )
+        else:
+            np.copyto(canvas, layer[..., :depth], where=mask[..., np.newaxis])
 
     def _draw_x_axis(self, data_count):
         if data_count <= 90:
@@ -206,19 +375,13 @@ class Grapher:
         else:
             self._x_axis_length = 10 + data_count
 
-        self.canvas = cv2.line(
-            self.canvas,
-            self.origin,
-            (self.x + self._x_axis_length, self.y),
-            self.axis_color,
-            1,
+        self._draw_line(
+            self.origin, (self.x + self._x_axis_length, self.y), self.axis_color
         )
 
     def _draw_second_tick(self, tick_x):
 
-        self.canvas = cv2.line(
-            self.canvas, (tick_x, self.y + 5), (tick_x, self.y + 10), self.axis_color, 1
-        )
+        self._draw_line((tick_x, self.y + 5), (tick_x, self.y + 10), self.axis_color)
 
     def _draw_right_y_axis(self):
         #     # y axis
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""Tests for the .csv data and lineage files."""
+
+import os
+
+import pytest
+
+from droplet.DropletStore import DropletStore
+from utils import Csv
+from utils.Csv import CsvFile
+from utils.Csv import write_lineage_file
+
+
+class Master:
+    # Stand-in for VideoFilePreprocessor: just the store.
+    def __init__(self, droplet_store):
+        self.droplet_store = droplet_store
+
+
+def build_store(spill_dir=None):
+    """
+    A store with two detections in each of five frames, ids 1 to 10, where each
+    frame's first detection is a later sighting of droplet 1.
+    """
+    droplet_store = DropletStore(spill_dir=spill_dir)
+    for frame_id in range(5):
+        droplet_store.begin_frame(frame_id)
+        for i in range(2):
+            droplet_store.add(2 * frame_id + i + 1, frame_id)
+    for frame_id in range(1, 5):
+        droplet_store.relocate(0, 2 * frame_id, 1)
+    return droplet_store
+
+
+def write_csv_file(droplet_store, file_path):
+    csv_file = CsvFile(Master(droplet_store), file_path)
+    ids = droplet_store.column("id")
+    for row in range(len(droplet_store) - 1):
+        # The last detection is never updated.
+        csv_file.update_csv_row(0, row + 1, (ids[row], 20 + row, 1.5 * row, 2.25 * row))
+    csv_file.write()
+
+
+def read(file_path):
+    with open(file_path) as csv_file:
+        return csv_file.read()
+
+
+@pytest.mark.parametrize("spilled", [False, True])
+def test_csv_file(tmp_path, spilled):
+    droplet_store = build_store(str(tmp_path / "spill") if spilled else None)
+    file_path = str(tmp_path / "data.csv")
+
+    write_csv_file(droplet_store, file_path)
+
+    assert read(file_path).splitlines() == [
+        "assigned_droplet_id,initial_droplet_id,frame,initial_pixels,duplicate_pixels,centroid_x,centroid_y",
+        ",10,5,0,,,",
+        "1,1,1,0,,0.00,0.00",
+        "1,3,2,,22,3.00,4.50",
+        "1,5,3,,24,6.00,9.00",
+        "1,7,4,,26,9.00,13.50",
+        "1,9,5,,28,12.00,18.00",
+        "2,2,1,0,,1.50,2.25",
+        "4,4,2,0,,4.50,6.75",
+        "6,6,3,0,,7.50,11.25",
+        "8,8,4,0,,10.50,15.75",
+    ]
+
+    droplet_store.close()
+    if spilled:
+        assert os.listdir(str(tmp_path / "spill")) == []
+
+
+def test_csv_file_in_chunks(tmp_path, monkeypatch):
+    droplet_store = build_store()
+    write_csv_file(droplet_store, str(tmp_path / "data.csv"))
+
+    monkeypatch.setattr(Csv, "WRITE_CHUNK_ROWS", 3)
+    write_csv_file(droplet_store, str(tmp_path / "chunked_data.csv"))
+
+    assert read(str(tmp_path / "chunked_data.csv")) == read(str(tmp_path / "data.csv"))
+
+
+def test_lineage_file(tmp_path, monkeypatch):
+    droplet_store = build_store()
+    file_path = str(tmp_path / "lineage.csv")
+
+    write_lineage_file(droplet_store, file_path)
+
+    assert read(file_path).splitlines() == [
+        "droplet_id,parent_initial_id,child_initial_id,parent_frame,child_frame,generation",
+        "1,1,3,1,2,2",
+        "1,3,5,2,3,3",
+        "1,5,7,3,4,4",
+        "1,7,9,4,5,5",
+    ]
+
+    monkeypatch.setattr(Csv, "WRITE_CHUNK_ROWS", 3)
+    write_lineage_file(droplet_store, str(tmp_path / "chunked_lineage.csv"))
+    assert read(str(tmp_path / "chunked_lineage.csv")) == read(file_path)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""Tests for the droplet store's lineage: relocation, history and undo."""
+
+import pytest
+
+from droplet.DropletStore import DropletStore
+
+
+@pytest.fixture
+def store():
+    """A store with one detection in each of four frames, ids 1 to 4."""
+    droplet_store = DropletStore()
+    for frame_id in range(4):
+        droplet_store.begin_frame(frame_id)
+        droplet_store.add(frame_id + 1, frame_id)
+    return droplet_store
+
+
+def test_relocate_links_sightings(store):
+    store.relocate(0, 1, 1)
+    store.relocate(0, 3, 1)
+
+    assert list(store.history_rows(0)) == [3, 1, 0]
+    assert store.generations(0) == 3
+    assert store.column("id").tolist() == [1, 1, 3, 1]
+    assert store.column("initial_id").tolist() == [1, 2, 3, 4]
+    assert store.lineage_edges().tolist() == [[0, 1], [1, 3]]
+    assert store.relocations().tolist() == [[0, 1, 1], [0, 3, 1]]
+
+
+def test_relocate_refuses_the_latest_sighting(store):
+    # Tracking a frame again, on top of its own droplets, tries this.
+    store.relocate(0, 1, 1)
+
+    with pytest.raises(ValueError):
+        store.relocate(0, 1, 1)
+    with pytest.raises(ValueError):
+        store.relocate(2, 2, 3)
+
+    assert list(store.history_rows(0)) == [1, 0]
+    assert store.relocation_count == 1
+
+
+def test_relocate_refuses_a_sighting_of_another_droplet(store):
+    store.relocate(0, 1, 1)
+
+    with pytest.raises(ValueError):
+        store.relocate(2, 1, 3)
+    with pytest.raises(ValueError):
+        store.relocate(1, 0, 2)
+
+    assert list(store.history_rows(0)) == [1, 0]
+    assert list(store.history_rows(2)) == [2]
+
+
+def test_undo_relocations(store):
+    store.relocate(0, 1, 1)
+    store.relocate(0, 2, 1)
+    store.relocate(0, 3, 1)
+
+    store.undo_relocations(1)
+
+    assert store.relocation_count == 1
+    assert list(store.history_rows(0)) == [1, 0]
+    assert list(store.history_rows(2)) == [2]
+    assert list(store.history_rows(3)) == [3]
+    assert store.column("id").tolist() == [1, 1, 3, 4]
+    assert store.column("child").tolist() == [1, -1, -1, -1]
+    assert store.column("generation").tolist() == [1, 2, 1, 1]
+
+    # Undone sightings can be relocated again, to a different droplet.
+    store.relocate(2, 3, 3)
+    assert list(store.history_rows(2)) == [3, 2]
+
+    store.undo_relocations(0)
+    assert store.lineage_edges().tolist() == []
+    assert store.column("id").tolist() == [1, 2, 3, 4]
+
+
+def test_lineage_edges_by_child_rows(store):
+    store.relocate(0, 1, 1)
+    store.relocate(2, 3, 3)
+
+    assert store.lineage_edges(0, 2).tolist() == [[0, 1]]
+    assert store.lineage_edges(2, 4).tolist() == [[2, 3]]
+    assert store.lineage_edges(1, 3).tolist() == [[0, 1]]
+    assert store.lineage_edges(4).tolist() == []
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""Tests for shape similarity from cached Hu moments."""
+
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+from utils.common import log_transform
+from utils.hu_moments import log_hu_moments
+from utils.hu_moments import shape_similarity
+
+
+def match_shapes_similarity(contour_a, contour_b):
+    """The tracker's score before the moments were cached, from matchShapes."""
+    score = abs(
+        log_transform(cv2.matchShapes(contour_a, contour_b, cv2.CONTOURS_MATCH_I2, 0))
+    )
+    if 308.0 < score < 308.5:
+        score = 0.5
+    return score
+
+
+def polygon(center, radii, angle, sides, jitter, random):
+    """A droplet-like contour: a jittered ellipse, as int32 points."""
+    theta = np.linspace(0, 2 * np.pi, sides, endpoint=False)
+    radius = 1 + random.uniform(-jitter, jitter, sides)
+    x = radii[0] * radius * np.cos(theta)
+    y = radii[1] * radius * np.sin(theta)
+    points = np.column_stack(
+        (
+            center[0] + x * np.cos(angle) - y * np.sin(angle),
+            center[1] + x * np.sin(angle) + y * np.cos(angle),
+        )
+    )
+    return np.round(points).astype(np.int32).reshape(-1, 1, 2)
+
+
+def contours():
+    random = np.random.default_rng(0)
+    shapes = [
+        # Degenerate contours: no area, or too few pixels for the moments.
+        np.array([[[5, 5]]], dtype=np.int32),
+        np.array([[[5, 5]], [[9, 5]]], dtype=np.int32),
+        np.array([[[0, 0]], [[3, 3]], [[6, 6]]], dtype=np.int32),
+        np.array([[[0, 0]], [[1, 0]], [[1, 1]], [[0, 1]]], dtype=np.int32),
+        np.array([[[0, 0]], [[2, 0]], [[0, 1]]], dtype=np.int32),
+        np.array([[[10, 10]], [[12, 10]], [[12, 12]], [[10, 12]]], dtype=np.int32),
+    ]
+    for _ in range(200):
+        shapes.append(
+            polygon(
+                random.uniform(0, 1000, 2),
+                random.uniform(1, 40, 2),
+                random.uniform(0, np.pi),
+                int(random.integers(3, 40)),
+                random.uniform(0, 0.3),
+                random,
+            )
+        )
+    return shapes
+
+
+@pytest.fixture(scope="module")
+def shapes():
+    shapes = contours()
+    log_hu, nonzero = zip(*(log_hu_moments(cv2.moments(shape)) for shape in shapes))
+    return shapes, np.array(log_hu), np.array(nonzero)
+
+
+def test_shape_similarity_matches_match_shapes(shapes):
+    shapes, log_hu, nonzero = shapes
+    scores = shape_similarity(
+        log_hu[:, np.newaxis], nonzero[:, np.newaxis], log_hu, nonzero
+    )
+
+    expected = np.array(
+        [[match_shapes_similarity(a, b) for b in shapes] for a in shapes]
+    )
+    # Bit for bit, as borderline tracking decisions depend on it.
+    assert scores.tolist() == expected.tolist()
+
+
+def test_shape_similarity_edge_cases(shapes):
+    shapes, log_hu, nonzero = shapes
+    point, big = 0, len(shapes) - 1
+    assert not nonzero[point] and nonzero[big]
+
+    # The same shape: matchShapes gives 0, which log_transform() turns into 999.
+    assert (
+        shape_similarity(log_hu[[big]], nonzero[[big]], log_hu[[big]], nonzero[[big]])
+        == 999
+    )
+    # No moments against some: DBL_MAX, whose log is close to 308.25.
+    assert cv2.matchShapes(
+        shapes[point], shapes[big], cv2.CONTOURS_MATCH_I2, 0
+    ) == pytest.approx(sys.float_info.max)
+    assert (
+        shape_similarity(
+            log_hu[[point]], nonzero[[point]], log_hu[[big]], nonzero[[big]]
+        )
+        == 0.5
+    )
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""Tests for saving a scan to the scan cache, and loading it again."""
+
+import os
+import zipfile
+
+import numpy as np
+import pytest
+
+from droplet import DropletStore as droplet_store_module
+from droplet.DropletStore import DropletStore
+from utils.scan_cache import load_scan
+from utils.scan_cache import save_scan
+
+
+@pytest.fixture
+def store():
+    """A store with three detections, with contours, in each of five frames."""
+    droplet_store = DropletStore()
+    for frame_id in range(5):
+        droplet_store.begin_frame(frame_id)
+        for i in range(3):
+            row = droplet_store.add(3 * frame_id + i + 1, frame_id)
+            x, y = 40 * i + 10, 30 * frame_id + 10
+            droplet_store.set_contour(
+                row,
+                np.array(
+                    [[[x, y]], [[x + 4 + i, y]], [[x + 4 + i, y + 5]], [[x, y + 5]]],
+                    dtype=np.int32,
+                ),
+            )
+    return droplet_store
+
+
+@pytest.fixture
+def cache_file_path(store, tmp_path):
+    cache_file_path = str(tmp_path / "scan.npz")
+    save_scan(cache_file_path, store, [0.25] * store.frame_count)
+    return cache_file_path
+
+
+@pytest.mark.parametrize("spilled", [False, True])
+def test_load_scan(store, cache_file_path, tmp_path, monkeypatch, spilled):
+    # Small chunks, to read the arrays in several pieces.
+    monkeypatch.setattr(droplet_store_module, "READ_CHUNK_BYTES", 100)
+    spill_dir = str(tmp_path / "spill") if spilled else None
+
+    loaded, scan_seconds_by_frame = load_scan(cache_file_path, spill_dir=spill_dir)
+
+    assert scan_seconds_by_frame == [0.25] * 5
+    assert len(loaded) == len(store)
+    assert loaded.frame_starts.tolist() == store.frame_starts.tolist()
+    for name, array in store.to_arrays().items():
+        assert loaded.to_arrays()[name].tobytes() == array.tobytes()
+    assert isinstance(loaded.column("id"), np.memmap) == spilled
+
+    # The store works as one straight from a scan.
+    loaded.begin_frame(5)
+    loaded.add(16, 5)
+    loaded.relocate(0, 3, 1)
+    assert list(loaded.history_rows(0)) == [3, 0]
+
+    loaded.close()
+    if spilled:
+        assert os.listdir(spill_dir) == []
+
+
+def test_load_scan_rejects_a_cut_short_cache_file(cache_file_path, tmp_path):
+    with zipfile.ZipFile(cache_file_path) as cache:
+        members = {name: cache.read(name) for name in cache.namelist()}
+    with zipfile.ZipFile(cache_file_path, "w") as cache:
+        for name, data in members.items():
+            cache.writestr(name, data[:-10] if name == "points.npy" else data)
+    spill_dir = str(tmp_path / "spill")
+
+    assert load_scan(cache_file_path, spill_dir=spill_dir) is None
+    # The spilled store's files went with it.
+    assert os.listdir(spill_dir) == []
+
+
+def test_load_scan_without_a_usable_cache_file(tmp_path):
+    cache_file_path = str(tmp_path / "scan.npz")
+    assert load_scan(cache_file_path) is None
+
+    with open(cache_file_path, "wb") as cache_file:
+        cache_file.write(b"not a cache file")
+    assert load_scan(cache_file_path) is None
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+"""Tests for tracking a file in segments, against tracking it frame by frame."""
+
+import numpy as np
+import pytest
+
+from benchmarks.association import ANGLES
+from benchmarks.association import SyntheticMaster
+from droplet.DropletStore import DropletStore
+from tracker.TrackRecord import TrackRecord
+from tracker.Tracker import Tracker
+from utils import segment_tracking
+
+FRAME_COUNT = 60
+# Frames without droplets: gaps longer than the tracker's history split the file
+# into segments, and the one frame gaps don't.
+EMPTY_FRAMES = set(range(15, 20)) | set(range(35, 38)) | {46, 52}
+# A laser flash, with more droplets than max_frame_droplets.
+FLASH_FRAME = 27
+MAX_FRAME_DROPLETS = 30
+
+
+class SegmentMaster(SyntheticMaster):
+    # What track_ahead() hands on to the worker processes, which build the same
+    # store for themselves.
+    video_file_path = threshold = border_width = cache_dir = None
+
+
+def build_store():
+    """
+    Return a DropletStore of droplets flying in straight lines, in bursts.
+
+    :return: DropletStore
+    """
+    random = np.random.default_rng(0)
+    store = DropletStore()
+    droplet_id = 0
+    positions = velocities = None
+
+    for frame_id in range(FRAME_COUNT):
+        store.begin_frame(frame_id)
+        if frame_id in EMPTY_FRAMES:
+            positions = None
+            continue
+        if positions is None:
+            positions = random.uniform(100, 900, (8, 2))
+            velocities = random.normal(0, 8, (8, 2))
+
+        if frame_id == FLASH_FRAME:
+            sightings = random.uniform(0, 1000, (50, 2))
+        else:
+            # Some sightings are missed.
+            seen = random.uniform(size=len(positions)) >= 0.1
+            sightings = (positions + random.normal(0, 0.5, positions.shape))[seen]
+        for x, y in sightings:
+            radius = random.uniform(3, 6)
+            contour = np.stack(
+                (x + radius * np.cos(ANGLES), y + radius * np.sin(ANGLES)), axis=1
+            )
+            droplet_id += 1
+            row = store.add(droplet_id, frame_id)
+            store.set_contour(row, contour.astype(np.int32).reshape(-1, 1, 2))
+
+        positions = positions + velocities
+
+    return store
+
+
+def droplet_corrections(store):
+    # Connect a droplet across the first gap, and leave one unconnected.
+    ids = store.column("id")
+    frame_starts = store.frame_starts
+    return {
+        int(ids[frame_starts[20]]): int(ids[frame_starts[14]]),
+        int(ids[frame_starts[40]]): None,
+    }
+
+
+def _load_synthetic_scan(
+    video_file_path, threshold, border, cache_dir, tracker_settings, skipped
+):
+    # Worker process set-up, in place of segment_tracking._load_scan().
+    segment_tracking._segment_tracking.update(
+        video_master=SegmentMaster(build_store()),
+        tracker_settings=tracker_settings,
+        skipped=skipped,
+    )
+
+
+@pytest.fixture
+def video_master():
+    return SegmentMaster(build_store())
+
+
+@pytest.fixture
+def tracker_settings(video_master):
+    return {
+        "frames_before_deregister": 2,
+        "confidence_threshold": 30,
+        "distance_threshold": 40,
+        "droplet_corrections": droplet_corrections(video_master.droplet_store),
+        "assignment": "greedy",
+        "motion_model": "none",
+        "prediction_radius": 10,
+    }
+
+
+def track_serially(video_master, tracker_settings, skipped):
+    """
+    Track every frame with one tracker, as VideoFrameProcessor does.
+
+    :return: TrackRecord
+    """
+    store = video_master.droplet_store
+    tracker = Tracker(droplet_master=video_master, VERBOSE=False, **tracker_settings)
+    track_record = TrackRecord(corrections=tracker_settings["droplet_corrections"])
+
+    for frame_id in range(FRAME_COUNT):
+        droplets = video_master.frames[frame_id].droplets
+        relocation_count = store.relocation_count
+        if frame_id in skipped:
+            tracker.skip_frame(this_frame=frame_id)
+            winnowed_droplets = droplets
+        else:
+            winnowed_droplets = tracker.update(
+                new_droplet_dict=droplets, this_frame=frame_id
+            )
+        track_record.record_frame(
+            frame_id, list(winnowed_droplets), store.relocations(relocation_count)
+        )
+
+    store.undo_relocations(0)
+    return track_record
+
+
+def assert_same_tracking(track_record, expected):
+    assert track_record.frame_count == FRAME_COUNT
+    for frame_id in range(FRAME_COUNT):
+        ids, relocations = track_record.frame(frame_id)
+        expected_ids, expected_relocations = expected.frame(frame_id)
+        assert ids.tolist() == expected_ids.tolist()
+        assert relocations.tolist() == expected_relocations.tolist()
+
+
+def test_synthetic_store_has_segments(video_master, tracker_settings):
+    skipped = segment_tracking.skipped_frames(
+        video_master.droplet_counts_by_frame, MAX_FRAME_DROPLETS, "skip-tracking"
+    )
+    segments = segment_tracking.find_segments(
+        video_master.droplet_counts_by_frame,
+        tracker_settings["frames_before_deregister"],
+        skipped,
+    )
+
+    assert skipped == {FLASH_FRAME}
+    assert segments == [(0, 20), (20, 38), (38, FRAME_COUNT)]
+
+
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_track_ahead_matches_serial_tracking(
+    video_master, tracker_settings, jobs, monkeypatch
+):
+    monkeypatch.setattr(segment_tracking, "_load_scan", _load_synthetic_scan)
+    skipped = segment_tracking.skipped_frames(
+        video_master.droplet_counts_by_frame, MAX_FRAME_DROPLETS, "skip-tracking"
+    )
+    expected = track_serially(video_master, tracker_settings, skipped)
+
+    track_record = TrackRecord()
+    segment_tracking.track_ahead(
+        track_record,
+        video_master,
+        jobs,
+        tracker_settings,
+        max_frame_droplets=MAX_FRAME_DROPLETS,
+    )
+
+    # The tracker linked droplets, and the correction across the first gap.
+    assert sum(len(expected.frame(i)[1]) for i in range(FRAME_COUNT)) > 50
+    correction_row = video_master.droplet_store.frame_starts[20]
+    assert correction_row in expected.frame(20)[1][:, 1]
+    assert_same_tracking(track_record, expected)
+
+
+def test_retrack_corrections_matches_serial_tracking(video_master, tracker_settings):
+    skipped = segment_tracking.skipped_frames(
+        video_master.droplet_counts_by_frame, MAX_FRAME_DROPLETS, "skip-tracking"
+    )
+    previous_settings = dict(tracker_settings, droplet_corrections={})
+    previous_track_record = track_serially(video_master, previous_settings, skipped)
+    expected = track_serially(video_master, tracker_settings, skipped)
+
+    track_record = TrackRecord()
+    segment_tracking.retrack_corrections(
+        track_record,
+        previous_track_record,
+        video_master,
+        tracker_settings,
+        max_frame_droplets=MAX_FRAME_DROPLETS,
+    )
+
+    assert_same_tracking(track_record, expected)
@@ -0,0 +1,146 @@
+# Copyright (c) 2020 Fredrick Levine
+# rick@xoab.us
+#
+# This file is part of Droplet Video Analyzer
+# https://github.com/rlevine/droplet_video_analyzer
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+###
+
+"""
+
+Droplet corrections, checked against a file's scan and indexed by frame.
+
+A correction file names droplets by the ids the scan gave them. Compiled against
+the droplet store, each correction is filed under the frame its droplet was
+found in, so the tracker only looks at a frame's own corrections, instead of
+going through every correction in the file on every frame.
+
+Corrections the scan can't support are left out, with the reason:
+
+    - the droplet isn't in the scan
+    - the droplet it's to be connected to isn't in the scan
+    - the droplet it's to be connected to isn't in an earlier frame
+
+Otherwise the index reads like the corrections dict, new id: original id, or
+None for droplets to leave unconnected, in file order.
+
+"""
+
+# Stands in for a missing correction, as None means "leave unconnected".
+_MISSING = object()
+
+
+class CorrectionIndex:
+    def __init__(self, droplet_corrections=None, droplet_store=None):
+        """
+        Compile corrections against a scan.
+
+        :param droplet_corrections: dict of droplet corrections, new id: original
+                                    id, or None for droplets to leave unconnected
+        :param droplet_store: DropletStore for the file's scan
+        """
+        self._corrections = {}
+        # Corrected droplets by the frame they were found in, in file order.
+        self._by_frame = {}
+        # (new id, original id, reason) for corrections left out.
+        self.problems = []
+
+        frames = droplet_store.column("frame")
+        for new_droplet_id, original_droplet_id in (droplet_corrections or {}).items():
+            if not droplet_store.has_id(new_droplet_id):
+                self.problems.append(
+                    (new_droplet_id, original_droplet_id, "it isn't in the scan")
+                )
+                continue
+            frame_id = int(frames[droplet_store.row_for_id(new_droplet_id)])
+
+            if original_droplet_id is not None:
+                if not droplet_store.has_id(original_droplet_id):
+                    self.problems.append(
+                        (
+                            new_droplet_id,
+                            original_droplet_id,
+                            "droplet {} isn't in the scan".format(original_droplet_id),
+                        )
+                    )
+                    continue
+                if frames[droplet_store.row_for_id(original_droplet_id)] >= frame_id:
+                    self.problems.append(
+                        (
+                            new_droplet_id,
+                            original_droplet_id,
+                            "droplet {} isn't in an earlier frame".format(
+                                original_droplet_id
+                            ),
+                        )
+                    )
+                    continue
+
+            self._corrections[new_droplet_id] = original_droplet_id
+            self._by_frame.setdefault(frame_id, []).append(new_droplet_id)
+
+    def __contains__(self, new_droplet_id):
+        return new_droplet_id in self._corrections
+
+    def __getitem__(self, new_droplet_id):
+        return self._corrections[new_droplet_id]
+
+    def __iter__(self):
+        return iter(self._corrections)
+
+    def __len__(self):
+        return len(self._corrections)
+
+    def keys(self):
+        return self._corrections.keys()
+
+    def items(self):
+        return self._corrections.items()
+
+    def get(self, new_droplet_id, default=None):
+        return self._corrections.get(new_droplet_id, default)
+
+    def in_frame(self, frame_id):
+        """
+        Return the corrections for the droplets found in a frame.
+
+        :param frame_id: int frame number
+        :return: list of (new id, original id) tuples, in file order
+        """
+        return [
+            (new_droplet_id, self._corrections[new_droplet_id])
+            for new_droplet_id in self._by_frame.get(frame_id, ())
+        ]
+
+    def changed_frames(self, previous_corrections, droplet_store):
+        """
+        Return the frames whose corrections differ from an earlier set, as when
+        the correction file has been edited since the last analysis.
+
+        :param previous_corrections: dict of droplet corrections, new id:
+                                     original id, or None
+        :param droplet_store: DropletStore for the file's scan
+        :return: set of int frame numbers
+        """
+        frames = droplet_store.column("frame")
+        changed = set()
+        for new_droplet_id in set(self._corrections) | set(previous_corrections):
+            if self._corrections.get(
+                new_droplet_id, _MISSING
+            ) == previous_corrections.get(new_droplet_id, _MISSING):
+                continue
+            if droplet_store.has_id(new_droplet_id):
+                changed.add(int(frames[droplet_store.row_for_id(new_droplet_id)]))
+        return changed
@@ -0,0 +1,246 @@
+# Copyright (c) 2020 Fredrick Levine
+# rick@xoab.us
+#
+# This file is part of Droplet Video Analyzer
+# https://github.com/rlevine/droplet_video_analyzer
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+###
+
+import numpy as np
+
+"""
+
+The tracker's working set of droplets: the droplets in the current frame, and the
+droplets seen in the last --frame-history frames that a new droplet might be a
+sighting of.
+
+Both live in one fixed-capacity structured array, one slot per droplet, which
+doubles when it fills. Each slot holds:
+
+    id          droplet id
+    row         store row of the droplet's most recent sighting
+    root        store row the droplet was first seen in
+    x, y        centroid of the most recent sighting
+    age         frames since the droplet was last seen: 0 for droplets in the
+                current frame, 1 and up for droplets in the history
+    log_hu      log Hu moments of the most recent sighting, from the store
+    hu_nonzero  ...and whether any of them is nonzero
+    track       motion model state: x, y, vx, vy (see tracker/MotionModel.py)
+    alive       False for slots removed since the last compaction
+
+Slots are kept in the order their droplets were registered, so the current and
+history droplets come out in the same order as the OrderedDicts they replace.
+Ageing is one vectorized increment, and expiry a mask; removed slots are
+squeezed out once a frame, in expire().
+
+snapshot() saves the registry's state for restore(), for stepping the tracker
+back a few frames. Snapshots are copy-on-write: taking one only marks the slot
+array shared, and the next change copies it.
+
+"""
+
+REGISTRY_DTYPE = np.dtype(
+    [
+        ("id", np.int64),
+        ("row", np.int64),
+        ("root", np.int64),
+        ("x", np.float64),
+        ("y", np.float64),
+        ("age", np.int64),
+        ("log_hu", np.float64, (7,)),
+        ("hu_nonzero", np.bool_),
+        ("track", np.float64, (4,)),
+        ("alive", np.bool_),
+    ]
+)
+
+
+class DropletRegistry:
+    def __init__(self, capacity=1024):
+        """
+        Initialize an empty registry.
+
+        :param capacity: int initial number of slots
+        """
+        self._slots = np.zeros(capacity, dtype=REGISTRY_DTYPE)
+        self._count = 0
+        # True while a snapshot holds the slot array; see _own().
+        self._shared = False
+
+    def __len__(self):
+        return int(np.count_nonzero(self._slots["alive"][: self._count]))
+
+    def column(self, name):
+        """
+        Return a column of the slots in use, removed ones included, as a view.
+        """
+        return self._slots[name][: self._count]
+
+    def current_slots(self):
+        """
+        :return: np array of the slots of droplets in the current frame, in order
+        """
+        return np.flatnonzero(self.column("alive") & (self.column("age") == 0))
+
+    def history_slots(self):
+        """
+        :return: np array of the slots of droplets in the history, in order
+        """
+        return np.flatnonzero(self.column("alive") & (self.column("age") > 0))
+
+    def centroids(self, slots):
+        """
+        :param slots: np array of slots
+        :return: np (N, 2) array of centroids
+        """
+        return np.column_stack(
+            (self._slots["x"][slots], self._slots["y"][slots])
+        ).reshape(-1, 2)
+
+    def find(self, droplet_id):
+        """
+        Return the slot a droplet id is registered in.
+
+        :param droplet_id: int droplet id
+        :return: int slot, or None if the droplet isn't registered
+        """
+        found = np.flatnonzero((self.column("id") == droplet_id) & self.column("alive"))
+        if len(found) == 0:
+            return None
+        return int(found[0])
+
+    def register(self, store, rows):
+        """
+        Add newly found droplets to the current frame, at age 0.
+
+        :param store: DropletStore holding the detections
+        :param rows: np array of store rows
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        self._own()
+        start = self._reserve(len(rows))
+        added = self._slots[start : start + len(rows)]
+
+        added["id"] = store.column("id")[rows]
+        added["row"] = rows
+        added["root"] = rows
+        added["x"] = store.column("x")[rows]
+        added["y"] = store.column("y")[rows]
+        added["age"] = 0
+        added["log_hu"] = store.column("log_hu")[rows]
+        added["hu_nonzero"] = store.column("hu_nonzero")[rows]
+        added["track"][:, :2] = np.column_stack((added["x"], added["y"]))
+        added["track"][:, 2:] = np.nan
+        added["alive"] = True
+
+    def reassign(self, slot, droplet_id, root, track=None, replacing=None):
+        """
+        Give a current droplet an earlier droplet's id, when it's found to be a
+        sighting of that droplet. The slot is removed, and the droplet registered
+        again at the end of the current frame, or in place of the replacing slot.
+
+        :param slot: int slot of the current droplet
+        :param droplet_id: int id of the earlier droplet
+        :param root: int store row the earlier droplet was first seen in
+        :param track: np array of the earlier droplet's corrected motion state, or
+                      None to keep the current droplet's
+        :param replacing: int slot to reuse, or None to add a slot
+        """
+        self._own()
+        if replacing is None:
+            replacing = self._reserve(1)
+        moved = self._slots[slot : slot + 1].copy()
+        self._slots["alive"][slot] = False
+
+        moved["id"] = droplet_id
+        moved["root"] = root
+        if track is not None:
+            moved["track"] = track
+        self._slots[replacing : replacing + 1] = moved
+
+    def remove(self, slot):
+        """
+        Remove a droplet from the registry.
+
+        :param slot: int slot
+        """
+        self._own()
+        self._slots["alive"][slot] = False
+
+    def age(self):
+        """
+        Add a frame to the age of every droplet. Current droplets join the history.
+        """
+        self._own()
+        self.column("age")[:] += 1
+
+    def expire(self, max_age):
+        """
+        Remove droplets older than max_age, and squeeze out removed slots.
+
+        :param max_age: int oldest age to keep
+        :return: np array of expired droplet ids
+        """
+        self._own()
+        alive = self.column("alive")
+        expired = alive & (self.column("age") > max_age)
+        expired_ids = self.column("id")[expired].copy()
+
+        keep = alive & ~expired
+        kept = np.count_nonzero(keep)
+        self._slots[:kept] = self._slots[: self._count][keep]
+        self._count = kept
+
+        return expired_ids
+
+    def snapshot(self):
+        """
+        Save the registry's state.
+
+        :return: opaque snapshot, for restore()
+        """
+        self._shared = True
+        return self._slots, self._count
+
+    def restore(self, snapshot):
+        """
+        Put the registry back the way it was when a snapshot was taken.
+
+        :param snapshot: from snapshot()
+        """
+        self._slots, self._count = snapshot
+        self._shared = True
+
+    ###
+
+    def _own(self):
+        # Copy the slot array before changing it, if a snapshot holds it.
+        if self._shared:
+            slots = np.zeros(len(self._slots), dtype=REGISTRY_DTYPE)
+            slots[: self._count] = self._slots[: self._count]
+            self._slots = slots
+            self._shared = False
+
+    def _reserve(self, count):
+        # Return the first of count new slots at the end, growing if needed.
+        start = self._count
+        if start + count > len(self._slots):
+            grown = np.zeros(
+                max(start + count, len(self._slots) * 2), dtype=REGISTRY_DTYPE
+            )
+            grown[:start] = self._slots[:start]
+            self._slots = grown
+        self._count += count
+        return start
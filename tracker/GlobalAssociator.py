@@ -0,0 +1,268 @@
+# Copyright (c) 2020 Fredrick Levine
+# rick@xoab.us
+#
+# This file is part of Droplet Video Analyzer
+# https://github.com/rlevine/droplet_video_analyzer
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+###
+
+from scipy.spatial import cKDTree
+import numpy as np
+
+from droplet.Droplet import Droplet
+from utils.assignment import optimal_assignment
+from utils.common import printc
+from utils.hu_moments import shape_similarity as hu_shape_similarity
+
+"""
+
+Offline droplet association over a whole file at once (--assignment global).
+
+The tracker decides frame by frame, and a match it makes can't be taken back when a
+better one turns up in a later frame. The scan has every detection in the file
+before tracking starts, though, so the whole file can be solved in one go:
+
+    1. Candidate links: every pair of detections up to frames_before_deregister
+       frames apart whose centroids are within the distance threshold, and whose
+       cost (distance x shape similarity, as in the tracker) is within the
+       similarity threshold. One KD-tree per frame, queried against the trees of
+       the frames before it.
+    2. Each detection can follow at most one earlier detection, and be followed
+       by at most one later one. That's a bipartite assignment, of detections as
+       predecessors to detections as successors, and a minimum-cost, maximum-
+       cardinality one gives the most links, and of those, the cheapest. It's
+       solved by utils.assignment.optimal_assignment(), which splits the links
+       into independent connected groups and solves each one, sparse for big
+       groups.
+    3. The links form chains, each a droplet's sightings. They're written back
+       frame by frame through Droplet.relocate(), as the tracker would, and the
+       results recorded in a track record, which the frame processor replays
+       while it renders (tracker/TrackReplayer.py).
+
+Corrections are applied on top: a corrected detection gets no solved link into it,
+and is connected to the droplet the correction names instead, if there is one.
+Frames the frame guard skips have no links in or out. Motion prediction isn't used.
+
+"""
+
+
+class GlobalAssociator:
+    def __init__(
+        self,
+        frames_before_deregister=10,
+        distance_threshold=40,
+        confidence_threshold=5.0,
+        droplet_corrections=None,
+        droplet_master=None,
+        VERBOSE=None,
+    ):
+        """
+        Initialize the associator, with the tracker's settings.
+
+        :param frames_before_deregister: int most frames between linked sightings
+        :param distance_threshold: largest centroid distance for a link
+        :param confidence_threshold: largest distance x similarity cost for a link
+        :param droplet_corrections: dict of droplet corrections, new id: original
+                                    id, or None for droplets to leave unconnected
+        :param droplet_master: VideoFilePreprocessor for the file
+        :param VERBOSE: verbose flag
+        """
+        self._FRAMES_BEFORE_DEREGISTER = frames_before_deregister
+        self._DISTANCE_THRESHOLD = distance_threshold
+        self._CONFIDENCE_THRESHOLD = confidence_threshold
+        self._droplet_corrections = droplet_corrections or {}
+        self._droplet_master = droplet_master
+        self._VERBOSE = VERBOSE
+
+    def candidate_links(self, skipped_frames=()):
+        """
+        Find every admissible link between detections.
+
+        :param skipped_frames: frame numbers whose detections aren't tracked
+        :return: (predecessor rows, successor rows, distances, costs) np arrays,
+                 one entry per link
+        """
+        store = self._droplet_master.droplet_store
+        centroids = np.column_stack((store.column("x"), store.column("y")))
+
+        # Detections named in corrections get their links from the corrections.
+        corrections = self._corrections_by_row(skipped_frames)
+        corrected_rows = np.fromiter(
+            corrections, dtype=np.int64, count=len(corrections)
+        )
+
+        links = []
+        # KD-trees of the frames still within reach, by frame number.
+        trees = {}
+        for frame_id in range(store.frame_count):
+            trees.pop(frame_id - self._FRAMES_BEFORE_DEREGISTER - 1, None)
+
+            rows = store.frame_rows(frame_id)
+            if len(rows) == 0 or frame_id in skipped_frames:
+                continue
+            tree = cKDTree(centroids[rows.start : rows.stop])
+
+            for earlier_rows, earlier_tree in trees.values():
+                # A hair of slack on the radius, and then the exact test, as
+                # in Tracker._candidate_pairs().
+                pairs = earlier_tree.sparse_distance_matrix(
+                    tree,
+                    self._DISTANCE_THRESHOLD * (1 + 1e-9),
+                    output_type="ndarray",
+                )
+                predecessors = earlier_rows.start + pairs["i"].astype(np.int64)
+                successors = rows.start + pairs["j"].astype(np.int64)
+                distances = np.sqrt(
+                    ((centroids[predecessors] - centroids[successors]) ** 2).sum(axis=1)
+                )
+                keep = (distances <= self._DISTANCE_THRESHOLD) & ~np.isin(
+                    successors, corrected_rows
+                )
+                links.append((predecessors[keep], successors[keep], distances[keep]))
+
+            trees[frame_id] = (rows, tree)
+
+        if not links:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, np.zeros(0), np.zeros(0)
+
+        predecessors, successors, distances = (
+            np.concatenate(column) for column in zip(*links)
+        )
+        log_hu = store.column("log_hu")
+        hu_nonzero = store.column("hu_nonzero")
+        costs = distances * hu_shape_similarity(
+            log_hu[predecessors],
+            hu_nonzero[predecessors],
+            log_hu[successors],
+            hu_nonzero[successors],
+        )
+        admissible = costs <= self._CONFIDENCE_THRESHOLD
+
+        return (
+            predecessors[admissible],
+            successors[admissible],
+            distances[admissible],
+            costs[admissible],
+        )
+
+    def associate(self, track_record, skipped_frames=()):
+        """
+        Solve the whole file, and record the result frame by frame. The droplet
+        store is left as it was; replaying the record relocates the droplets.
+
+        :param track_record: empty TrackRecord to fill in
+        :param skipped_frames: frame numbers whose detections aren't tracked
+        """
+        store = self._droplet_master.droplet_store
+        predecessors, successors, distances, costs = self.candidate_links(
+            skipped_frames
+        )
+        matched, _ = optimal_assignment(
+            predecessors, successors, distances, costs, self._CONFIDENCE_THRESHOLD
+        )
+
+        predecessor_of = np.full(len(store), -1, dtype=np.int64)
+        predecessor_of[successors[matched]] = predecessors[matched]
+        corrections = self._corrections_by_row(skipped_frames)
+
+        # Detections to connect, frame by frame, in the order the tracker would
+        # connect them: solved links nearest first, then corrections.
+        frames = store.column("frame")
+        solved_rows = successors[matched]
+        solved_rows = solved_rows[
+            np.lexsort((solved_rows, distances[matched], frames[solved_rows]))
+        ]
+        corrected_rows = [
+            row
+            for row, original_droplet_id in corrections.items()
+            if original_droplet_id is not None
+        ]
+        connected_rows = np.concatenate(
+            (solved_rows, np.array(corrected_rows, dtype=np.int64))
+        )
+        connected_rows = connected_rows[
+            np.argsort(frames[connected_rows], kind="stable")
+        ]
+        connected_starts = np.searchsorted(
+            frames[connected_rows], np.arange(store.frame_count + 1)
+        )
+
+        # Views of each droplet, by the row it was first seen in, and the row
+        # each detection's droplet was first seen in.
+        chains = {}
+        root_of = np.arange(len(store), dtype=np.int64)
+        relocation_count = store.relocation_count
+        for frame_id in range(store.frame_count):
+            connected = connected_rows[
+                connected_starts[frame_id] : connected_starts[frame_id + 1]
+            ]
+            for row in connected.tolist():
+                if row in corrections:
+                    original_droplet_id = corrections[row]
+                    if self._VERBOSE:
+                        printc(
+                            "Droplet correction: droplet {} will be connected to droplet {}.".format(
+                                int(store.column("initial_id")[row]),
+                                original_droplet_id,
+                            ),
+                            "red",
+                        )
+                    # As the tracker does it, from the original droplet's own row.
+                    root = store.row_for_id(original_droplet_id)
+                    self._droplet_master.index_by_droplet[original_droplet_id].relocate(
+                        Droplet(store, row)
+                    )
+                else:
+                    root = root_of[predecessor_of[row]]
+                    if root not in chains:
+                        chains[root] = Droplet(store, root)
+                    chains[root].relocate(Droplet(store, row))
+                root_of[row] = root
+
+            # The frame's droplets, as the tracker returns them: new droplets in
+            # scan order, then the connected ones.
+            frame_rows = store.frame_rows(frame_id)
+            rows = np.arange(frame_rows.start, frame_rows.stop)
+            rows = np.concatenate((rows[~np.isin(rows, connected)], connected))
+            track_record.record_frame(
+                frame_id,
+                store.column("id")[rows],
+                store.relocations(relocation_count),
+            )
+            relocation_count = store.relocation_count
+
+        # Leave the relocations to the replay.
+        store.undo_relocations(0)
+
+    ###
+
+    def _corrections_by_row(self, skipped_frames):
+        """
+        Return the corrections for detections in tracked frames, by row.
+
+        :param skipped_frames: frame numbers whose detections aren't tracked
+        :return: dict of row: original droplet id, or None
+        """
+        store = self._droplet_master.droplet_store
+        frames = store.column("frame")
+        corrections = {}
+        for new_droplet_id, original_droplet_id in self._droplet_corrections.items():
+            if not store.has_id(new_droplet_id):
+                continue
+            row = store.row_for_id(new_droplet_id)
+            if frames[row] not in skipped_frames:
+                corrections[row] = original_droplet_id
+        return corrections
@@ -0,0 +1,109 @@
+# Copyright (c) 2020 Fredrick Levine
+# rick@xoab.us
+#
+# This file is part of Droplet Video Analyzer
+# https://github.com/rlevine/droplet_video_analyzer
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+###
+
+import numpy as np
+
+"""
+
+Constant-velocity motion prediction for the tracker.
+
+Droplets in the laser sheet move ballistically, so where a droplet will be next is
+a better place to look for it than where it was last seen. Each track (a droplet
+id) gets an alpha-beta filter: a smoothed position and velocity, updated each time
+the droplet is seen again.
+
+    - A new droplet has a position and no velocity. The tracker searches for it
+      within --distance-threshold of where it was seen, as without prediction.
+    - At its second sighting, the velocity is the displacement over the frames
+      between the sightings.
+    - After that, the predicted position is position + velocity x frames elapsed,
+      and the tracker only searches within --prediction-radius of it. The
+      measured position corrects the prediction, by ALPHA for the position and
+      BETA for the velocity.
+
+"""
+
+MOTION_MODELS = ("none", "alpha-beta")
+
+# Alpha-beta filter gains. Droplet paths are close to straight at 30 fps, so
+# position follows the measurement closely, and velocity changes slowly.
+ALPHA = 0.85
+BETA = 0.3
+
+
+class MotionModel:
+    def __init__(self, alpha=ALPHA, beta=BETA):
+        """
+        Initialize the filter.
+
+        Track state lives with the tracker's droplets, in the track column of its
+        DropletRegistry: np array of x, y, vx, vy, where velocity is NaN until the
+        droplet has been seen twice. A new droplet's track is its centroid, with
+        no velocity.
+
+        :param alpha: float position gain, 0-1
+        :param beta: float velocity gain, 0-2
+        """
+        self._alpha = alpha
+        self._beta = beta
+
+    def corrected(self, track, centroid, frames_elapsed):
+        """
+        Correct a track with a new sighting of its droplet.
+
+        :param track: np array of x, y, vx, vy
+        :param centroid: (x, y) measured position
+        :param frames_elapsed: int frames since the droplet was last seen
+        :return: np array of the corrected x, y, vx, vy
+        """
+        track = np.array(track, dtype=np.float64)
+        measured = np.asarray(centroid, dtype=np.float64)
+        frames_elapsed = max(frames_elapsed, 1)
+
+        if np.isnan(track[2]):
+            # Second sighting: the first velocity estimate.
+            track[2:] = (measured - track[:2]) / frames_elapsed
+            track[:2] = measured
+        else:
+            predicted = track[:2] + track[2:] * frames_elapsed
+            residual = measured - predicted
+            track[:2] = predicted + self._alpha * residual
+            track[2:] += self._beta * residual / frames_elapsed
+
+        return track
+
+    def predict(self, tracks, frames_elapsed):
+        """
+        Predict where droplets are now.
+
+        :param tracks: np (N, 4) array of x, y, vx, vy
+        :param frames_elapsed: np array of frames since each was last seen
+        :return: (np (N, 2) array of predicted positions, np bool array, True
+                 for droplets with a velocity)
+        """
+        tracks = np.asarray(tracks, dtype=np.float64).reshape(-1, 4)
+        moving = ~np.isnan(tracks[:, 2])
+        positions = tracks[:, :2].copy()
+        positions[moving] += (
+            tracks[moving, 2:]
+            * np.asarray(frames_elapsed, dtype=np.float64)[moving, None]
+        )
+
+        return positions, moving
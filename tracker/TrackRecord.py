@@ -0,0 +1,229 @@
+# Copyright (c) 2020 Fredrick Levine
+# rick@xoab.us
+#
+# This file is part of Droplet Video Analyzer
+# https://github.com/rlevine/droplet_video_analyzer
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+###
+
+import json
+import numpy as np
+
+"""
+
+The tracker's decisions for a whole video file, saved so the file can be rendered
+again without tracking it again.
+
+For each frame, the record holds:
+
+    - the ids of the droplets the tracker returned for the frame, in order
+    - the relocations the tracker made in the frame, in order, as
+      (root row, destination row, assigned droplet id)
+
+along with the settings the file was scanned and tracked with, and the corrections
+that were applied. Replaying the relocations frame by frame (tracker/TrackReplayer.py)
+puts the droplet store in exactly the state the tracker left it in at each frame,
+so drawing the frame gives the same result.
+
+Ids and relocations are stored CSR-style, in memory and on disk: one flat array
+each, plus an offset table by frame, rather than a small array per frame.
+
+"""
+
+TRACK_RECORD_VERSION = 1
+
+
+class TrackRecord:
+    def __init__(self, params=None, corrections=None):
+        """
+        Initialize an empty track record.
+
+        :param params: dict of scan and tracker settings, JSON-serializable
+        :param corrections: dict of droplet corrections, new id: original id, or
+                            None for droplets to leave unconnected
+        """
+        self.params = dict(params or {})
+        self.corrections = dict(corrections or {})
+
+        self._frame_count = 0
+        self._ids = np.zeros(1024, dtype=np.int64)
+        self._id_starts = np.zeros(1024, dtype=np.int64)
+        self._relocations = np.zeros((1024, 3), dtype=np.int64)
+        self._relocation_starts = np.zeros(1024, dtype=np.int64)
+
+    @property
+    def frame_count(self):
+        return self._frame_count
+
+    def record_frame(self, frame_id, droplet_ids, relocations):
+        """
+        Add the tracker's results for the next frame.
+
+        :param frame_id: int frame number; frames must be recorded in order
+        :param droplet_ids: iterable of int droplet ids returned by the tracker
+        :param relocations: list of (root, destination_row, droplet_id) tuples
+        """
+        if frame_id != self.frame_count:
+            raise ValueError(
+                "Frames must be recorded in order: expected frame {}, got {}.".format(
+                    self.frame_count, frame_id
+                )
+            )
+        droplet_ids = np.asarray(list(droplet_ids), dtype=np.int64)
+        relocations = np.asarray(relocations, dtype=np.int64).reshape(-1, 3)
+
+        # Each offset table has one more entry than there are frames.
+        self._id_starts = self._reserved(self._id_starts, frame_id + 2)
+        self._relocation_starts = self._reserved(self._relocation_starts, frame_id + 2)
+
+        id_start = self._id_starts[frame_id]
+        id_stop = id_start + len(droplet_ids)
+        self._ids = self._reserved(self._ids, id_stop)
+        self._ids[id_start:id_stop] = droplet_ids
+        self._id_starts[frame_id + 1] = id_stop
+
+        relocation_start = self._relocation_starts[frame_id]
+        relocation_stop = relocation_start + len(relocations)
+        self._relocations = self._reserved(self._relocations, relocation_stop)
+        self._relocations[relocation_start:relocation_stop] = relocations
+        self._relocation_starts[frame_id + 1] = relocation_stop
+
+        self._frame_count += 1
+
+    def frame(self, frame_id):
+        """
+        Return the tracker's results for a frame.
+
+        :param frame_id: int frame number
+        :return: (np array of droplet ids, np (N, 3) array of relocations)
+        """
+        if not 0 <= frame_id < self._frame_count:
+            raise IndexError(frame_id)
+        id_start, id_stop = self._id_starts[frame_id : frame_id + 2]
+        relocation_start, relocation_stop = self._relocation_starts[
+            frame_id : frame_id + 2
+        ]
+        return (
+            self._ids[id_start:id_stop],
+            self._relocations[relocation_start:relocation_stop],
+        )
+
+    def is_complete(self, frame_count):
+        return self.frame_count == frame_count
+
+    def validate(self, video_master):
+        """
+        Check that the record belongs to the scan in video_master.
+
+        :param video_master: VideoFilePreprocessor
+        :raises ValueError: if the scan doesn't match
+        """
+        store = video_master.droplet_store
+        if (
+            self.frame_count != store.frame_count
+            or self.params.get("droplet_count") != len(store)
+        ):
+            raise ValueError(
+                "Track record is for {} frames and {} droplets, but the scan found {} frames and {} droplets.".format(
+                    self.frame_count,
+                    self.params.get("droplet_count"),
+                    store.frame_count,
+                    len(store),
+                )
+            )
+
+    ###
+
+    def save(self, file_path):
+        """
+        Save the record as a .npz file.
+
+        :param file_path: str absolute file path
+        """
+        with open(file_path, "wb") as record_file:
+            np.savez_compressed(
+                record_file,
+                params=np.array(
+                    json.dumps(
+                        {
+                            "version": TRACK_RECORD_VERSION,
+                            "params": self.params,
+                            "corrections": [
+                                [
+                                    int(new_id),
+                                    None if original_id is None else int(original_id),
+                                ]
+                                for new_id, original_id in self.corrections.items()
+                            ],
+                        }
+                    )
+                ),
+                id_starts=self._id_starts[: self._frame_count + 1],
+                ids=self._ids[: self._id_starts[self._frame_count]],
+                relocation_starts=self._relocation_starts[: self._frame_count + 1],
+                relocations=self._relocations[
+                    : self._relocation_starts[self._frame_count]
+                ],
+            )
+
+    @classmethod
+    def load(cls, file_path):
+        """
+        Load a record saved with save().
+
+        :param file_path: str absolute file path
+        :return: TrackRecord
+        :raises ValueError: if the file isn't a usable track record
+        """
+        try:
+            with np.load(file_path) as saved:
+                header = json.loads(str(saved["params"]))
+                id_starts = saved["id_starts"]
+                ids = saved["ids"]
+                relocation_starts = saved["relocation_starts"]
+                relocations = saved["relocations"]
+        except (OSError, KeyError) as error:
+            raise ValueError("Can't read track record {}: {}".format(file_path, error))
+
+        if header.get("version") != TRACK_RECORD_VERSION:
+            raise ValueError(
+                "Track record {} is version {}, expected {}.".format(
+                    file_path, header.get("version"), TRACK_RECORD_VERSION
+                )
+            )
+
+        record = cls(
+            params=header["params"],
+            corrections={
+                new_id: original_id for new_id, original_id in header["corrections"]
+            },
+        )
+        record._frame_count = len(id_starts) - 1
+        record._ids = ids
+        record._id_starts = id_starts
+        record._relocations = relocations.reshape(-1, 3)
+        record._relocation_starts = relocation_starts
+
+        return record
+
+    ###
+
+    def _reserved(self, array, size):
+        # Return array, or a copy with room for at least size entries.
+        if size <= len(array):
+            return array
+        grown = np.zeros((max(size, len(array) * 2),) + array.shape[1:], array.dtype)
+        grown[: len(array)] = array
+        return grown
@@ -0,0 +1,111 @@
+# Copyright (c) 2020 Fredrick Levine
+# rick@xoab.us
+#
+# This file is part of Droplet Video Analyzer
+# https://github.com/rlevine/droplet_video_analyzer
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+###
+
+from collections import OrderedDict
+
+from utils.common import printc
+
+
+class TrackReplayer:
+    def __init__(self, track_record=None, droplet_master=None, VERBOSE=None):
+        """
+        Stand-in for Tracker that replays a saved TrackRecord instead of tracking.
+
+        update() and skip_frame() apply the frame's recorded relocations to the
+        droplet store and return the recorded droplets, so VideoFrameProcessor
+        renders the frame exactly as it did when the record was made.
+
+        :param track_record: TrackRecord for the video file
+        :param droplet_master: VideoFilePreprocessor the record was made from
+        :param VERBOSE: verbose flag
+        """
+        self._track_record = track_record
+        self._droplet_master = droplet_master
+
+        # Frames are replayed once each, in order.
+        self._replayed_frame_count = 0
+
+        self.current_droplet_registry = OrderedDict()
+
+        self._VERBOSE = VERBOSE
+
+    def skip_frame(self, this_frame=None):
+        return self._replay(this_frame)
+
+    def update(self, new_droplet_dict=None, this_frame=None, BACK=False):
+        return self._replay(this_frame)
+
+    def save_state(self):
+        """
+        Save the replay position, and the droplet store's state, before a frame.
+
+        :return: opaque state, for restore_state()
+        """
+        return (
+            self._replayed_frame_count,
+            self.current_droplet_registry,
+            self._droplet_master.droplet_store.relocation_count,
+        )
+
+    def restore_state(self, state):
+        """
+        Go back to a saved state, undoing the relocations replayed since.
+
+        :param state: from save_state()
+        """
+        (
+            self._replayed_frame_count,
+            self.current_droplet_registry,
+            relocation_count,
+        ) = state
+        self._droplet_master.droplet_store.undo_relocations(relocation_count)
+
+    def _replay(self, this_frame):
+        """
+        Replay the recorded tracker results for a frame.
+
+        :param this_frame: int current frame number
+        :return: OrderedDict of Droplet views, keyed by droplet id
+        """
+        if this_frame != self._replayed_frame_count:
+            # Going back, or reprocessing a frame. The store already has this
+            # frame's relocations; hand back the same droplets.
+            return self.current_droplet_registry
+
+        droplet_ids, relocations = self._track_record.frame(this_frame)
+
+        store = self._droplet_master.droplet_store
+        for root, destination_row, droplet_id in relocations.tolist():
+            store.relocate(root, destination_row, droplet_id)
+            if self._VERBOSE:
+                printc(
+                    "Replayed: droplet {} is the same as droplet {}.".format(
+                        int(store.column("initial_id")[destination_row]), droplet_id
+                    ),
+                    "blue",
+                )
+
+        self.current_droplet_registry = OrderedDict(
+            (droplet_id, self._droplet_master.index_by_droplet[droplet_id])
+            for droplet_id in droplet_ids.tolist()
+        )
+        self._replayed_frame_count += 1
+
+        return self.current_droplet_registry
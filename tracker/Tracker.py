@@ -18,16 +18,17 @@
 
 ###
 
-from scipy.spatial import distance
+from scipy.spatial import cKDTree
 from collections import OrderedDict
-import cv2
-import sys
 import numpy as np
-import re
 
-from prettytable import PrettyTable
 from droplet.Droplet import Droplet
-from utils.common import printc, log_transform, start_color, stop_color
+from tracker.CorrectionIndex import CorrectionIndex
+from tracker.DropletRegistry import DropletRegistry
+from tracker.MotionModel import MotionModel
+from utils.common import printc
+from utils.assignment import assign
+from utils.hu_moments import shape_similarity as hu_shape_similarity
 
 """
 
@@ -67,30 +68,34 @@ class Tracker:
         confidence_threshold=5.0,
         droplet_corrections=None,
         droplet_master=None,
+        assignment="greedy",
+        motion_model="none",
+        prediction_radius=10,
+        diagnostics=None,
         BACK=False,
         VERBOSE=None,
     ):
 
-        # Each registry is an OrderedDict of droplet data dicts, keyed by droplet id.
-        self.current_droplet_registry = OrderedDict()
-        self.droplet_candidate_registry = OrderedDict()
-        self.droplet_history_registry = OrderedDict()
+        # Current and history droplets, with their ages, in one array-backed
+        # registry: current droplets are age 0. See tracker/DropletRegistry.py.
+        self._registry = DropletRegistry()
 
-        # These are hardwired, rather than being a global config.
-        self._SHOW_DROPLET_SUMMARY = True
-        self._SHOW_DROPLET_TABLE = True
+        # What the tracker compared and decided in each frame, for dva inspect;
+        # see tracker/TrackerDiagnostics.py. None to record nothing.
+        self._diagnostics = diagnostics
+        self._recording = False
 
-        if droplet_corrections:
+        # Corrections, checked against the scan and indexed by frame; see
+        # tracker/CorrectionIndex.py.
+        if isinstance(droplet_corrections, CorrectionIndex):
             self._droplet_corrections = droplet_corrections
         else:
-            self._droplet_corrections = {}
+            self._droplet_corrections = CorrectionIndex(
+                droplet_corrections, droplet_master.droplet_store
+            )
 
         self._droplet_master = droplet_master
 
-        # Ageing dict is keyed by droplet id, value number of frames seen since last
-        # present in a frame.
-        self._ageing = OrderedDict()
-
         # Dict for collecting droplet separation for duplicate droplets, to understand
         # thresholds.
         # self.distance_research = defaultdict(dict)
@@ -102,60 +107,70 @@ class Tracker:
         self._CONFIDENCE_THRESHOLD = confidence_threshold
         self._DISTANCE_THRESHOLD = distance_threshold
 
-    def _register(self, droplet_dict):
-        # The default flow is to register to current, copy to history, and
-        # eventually deregister from history.
-        self.current_droplet_registry[droplet_dict.id] = droplet_dict
-        self._ageing[droplet_dict.id] = 0
-
-    def _deregister(self, id):
-        # Popping an unknown key from a list won't throw an exception,
-        # but OrderedDict does. :(
-        try:
-            self.droplet_history_registry.pop(id)
-        except KeyError:
-            pass
-        try:
-            self._ageing.pop(id)
-        except KeyError:
-            pass
-
-    def _deregister_current_housekeeping(self, id):
-        # When we need to remove a droplet from current prematurely,
-        # because it's a duplicate.
-        self.current_droplet_registry.pop(id)
-        self._ageing.pop(id)  # In case it made it to the history.
-
-    def _copy_to_history(self, id):
+        # How candidate droplet pairs are matched; see utils/assignment.py.
+        self._ASSIGNMENT = assignment
+
+        # Optional motion prediction: droplets with a velocity estimate are
+        # looked for within prediction_radius of where they should be now,
+        # instead of within distance_threshold of where they were.
+        if motion_model == "alpha-beta":
+            self._motion_model = MotionModel()
+        else:
+            self._motion_model = None
+        self._PREDICTION_RADIUS = prediction_radius
+
+    def _age_history(self):
+
+        # 1. Bump all ages. (Current droplets go to age 1, and join the history.)
+        self._registry.age()
+
+        # 2. Remove history droplets with age greater than FRAMES_BEFORE_DEREGISTER.
+        # Their motion tracks go with them.
+        self._registry.expire(self._FRAMES_BEFORE_DEREGISTER)
+
+    def _current_droplets(self):
+        # OrderedDict of current droplet views, keyed by droplet id.
+        store = self._droplet_master.droplet_store
+        slots = self._registry.current_slots()
+        return OrderedDict(
+            (droplet_id, Droplet(store, row, root=root))
+            for droplet_id, row, root in zip(
+                self._registry.column("id")[slots].tolist(),
+                self._registry.column("row")[slots].tolist(),
+                self._registry.column("root")[slots].tolist(),
+            )
+        )
+
+    def skip_frame(self, this_frame=None):
         """
-        Move droplet data dict from current set to history set.
-        :param id: unique droplet id
+        Let a frame go by without tracking any of its droplets, as when a
+        pathological frame is being degraded. The history still ages, so droplets
+        from before the skipped frame expire on schedule, and nothing from the
+        skipped frame is registered.
+
+        :param this_frame: current frame number
+        :return: empty droplet registry
         """
-        droplet_dict = self.current_droplet_registry[id]
-        self.droplet_history_registry[id] = droplet_dict
+        self._age_history()
+
+        if self._begin_recording(this_frame):
+            self._end_recording()
 
-    def _get_centroids(self, droplet_dict):
-        return [(droplet_dict[x].centroid) for x in droplet_dict]
+        return OrderedDict()
 
     def update(self, new_droplet_dict=None, this_frame=None, BACK=False):
         """
         Update the tracker.
 
-        TODO Tracker.update() was written as a one-way data transformation. In
-        TODO hindsight, it would be useful to back up through a video file and
-        TODO recalculate droplet tracking going forward. This will require tracking
-        TODO updates to save a prior frame's tracking data state.
+        Tracking a frame changes the tracker and the droplet store; to back up
+        and track frames again, save_state() before a frame, and restore_state()
+        to go back to it.
 
         :param new_droplet_dict: dict of raw droplets found in current frame
         :param this_frame: current frame number, used in corrections
         :return: winnowed droplet dict, filtered for already found droplets,
         """
 
-        if len(new_droplet_dict) != 0:
-            self._first_droplet = min(new_droplet_dict)
-        else:
-            self._first_droplet = 0
-
         # if this_frame == 45:
         #     debug_catcher = True
 
@@ -164,198 +179,82 @@ class Tracker:
         # there's an edge case that needs this to exist.
         matched_ids = OrderedDict()
 
-        # 0. Candidate registry is populated with new droplets.
-        if new_droplet_dict:
-            self.droplet_candidate_registry = new_droplet_dict.copy()
-
-        # 1. Bump all ages in history. (Newest goes to age 1.)
-        for id in self._ageing:
-            self._ageing[id] += 1
-
-        # 2. Remove history droplets with age greater than FRAMES_BEFORE_DEREGISTER
-        for id in [
-            x for x in self._ageing if self._ageing[x] > self._FRAMES_BEFORE_DEREGISTER
-        ]:
-            self._deregister(id)
-
-        # 3. Move current droplets to history. (Newest ones are now age 0.)
-        for id in list(
-            self.current_droplet_registry
-        ):  # Use list, so we don't mutate index.
-            self._copy_to_history(id)
-            self.current_droplet_registry.pop(id)
-
-        # 4. Current should be empty: add new droplets to current.
-        if len(self.current_droplet_registry) > 0:
-            sys.exit(
-                "Oops. self.current_droplet_registry should be empty, "
-                "but it still has {} droplets in it!"
-            ).format(len(self.current_droplet_registry))
-        else:
-            for droplet in self.droplet_candidate_registry:
-                self._register(self.droplet_candidate_registry[droplet])
-            self.droplet_candidate_registry.clear()
+        # 1.-3. Age the history, and move current droplets to history.
+        self._age_history()
 
-        # 5. If we have droplets in this frame and history, compare distances.
-        if (
-            len(self.current_droplet_registry) > 0
-            and len(self.droplet_history_registry) > 0
-        ):
-            # Without either current droplets or droplets in history, a droplet
-            # comparison doesn't make sense!
+        self._begin_recording(this_frame)
 
-            # Create an MxN array of distances between each known droplet and
-            # each new droplet center.
-            current_droplet_centroids = np.array(
-                self._get_centroids(self.current_droplet_registry)
-            )
-            droplet_history_centroids = np.array(
-                self._get_centroids(self.droplet_history_registry)
+        # 4. Add new droplets to current.
+        store = self._droplet_master.droplet_store
+        if new_droplet_dict:
+            self._registry.register(
+                store,
+                np.fromiter(
+                    (droplet.row for droplet in new_droplet_dict.values()),
+                    dtype=np.int64,
+                    count=len(new_droplet_dict),
+                ),
             )
 
-            distances = distance.cdist(
-                droplet_history_centroids, current_droplet_centroids, "euclidean"
+        history_slots = self._registry.history_slots()
+        current_slots = self._registry.current_slots()
+
+        # 5. If we have droplets in this frame and history, compare distances.
+        if self._recording and not (len(current_slots) and len(history_slots)):
+            # Nothing to compare, but note who was there.
+            self._diagnostics.record_comparison(
+                (
+                    self._registry.column("id")[history_slots],
+                    self._registry.centroids(history_slots),
+                ),
+                (
+                    self._registry.column("id")[current_slots],
+                    self._registry.centroids(current_slots),
+                ),
             )
 
-            # Generate sorted list of rows, smallest distance first.
-            distance_row_sort = distances.min(axis=1).argsort()
-            # And the same for columns.
-            distance_column_sort = distances.argmin(axis=1)[distance_row_sort]
-
-            # Let's visualize distances.
-
-            # This is now the default. I started with the thought that we might
-            # need to have a quiet mode, but went the other way, not only chattering
-            # in the output, but offering to save the colorful console output to
-            # an html log file.
-
-            distance_highlight_column = distance_column_sort[0] + 1
-            # (+1 because we're adding droplet numbers to the left side of
-            # the table.)
-            distance_highlight_row = distance_row_sort[0]
-
-            if self._SHOW_DROPLET_TABLE and self._VERBOSE:
-                printc("\nDistance", "bright red")
-                print(
-                    self._print_distance_array(
-                        distances,
-                        self.droplet_history_registry.keys(),
-                        self.current_droplet_registry.keys(),
-                        highlight_column=distance_highlight_column,
-                        highlight_row=distance_highlight_row,
-                        color="red",
-                    )
-                )
+        if len(current_slots) > 0 and len(history_slots) > 0:
+            # Without either current droplets or droplets in history, a droplet
+            # comparison doesn't make sense!
 
-            # print("distance_row_sort: {}".format(distance_row_sort))  # Debug
-            # print(
-            #     "self.droplet_history_registry.keys(): {}".format(
-            #         list(self.droplet_history_registry.keys())
-            #     )
-            # )  # Debug
-
-            # 6. Create shape comparison matrix for history vs current.
-            current_droplet_contours = []
-            for id in self.current_droplet_registry:
-                current_droplet_contours.append(
-                    self.current_droplet_registry[id].contour
+            # Gate candidate pairs on centroid distance: only (history, current)
+            # pairs within the distance threshold can ever be matched, so only
+            # those get a distance and a shape comparison. In a crowded frame
+            # that's a few pairs per droplet, instead of every history droplet
+            # against every current droplet.
+            registry = self._registry
+            history_ids = registry.column("id")[history_slots]
+            current_ids = registry.column("id")[current_slots]
+            current_droplet_centroids = registry.centroids(current_slots)
+            droplet_history_centroids = registry.centroids(history_slots)
+
+            if self._motion_model is not None:
+                # Compare against where history droplets should be by now. The
+                # "distances" below are then distances from the predictions.
+                droplet_history_centroids, moving = self._motion_model.predict(
+                    registry.column("track")[history_slots],
+                    registry.column("age")[history_slots],
                 )
-
-            droplet_history_contours = []
-            for id in self.droplet_history_registry:
-                droplet_history_contours.append(
-                    self.droplet_history_registry[id].contour
+                search_radii = np.where(
+                    moving, self._PREDICTION_RADIUS, self._DISTANCE_THRESHOLD
                 )
+            else:
+                search_radii = None
 
-            shape_similarity = np.zeros(
-                (len(droplet_history_contours), len(current_droplet_contours)),
-                dtype=float,
+            rows, columns, pair_distances = self._candidate_pairs(
+                droplet_history_centroids, current_droplet_centroids, search_radii
             )
 
-            for row_index, history_contour in enumerate(droplet_history_contours):
-                for col_index, current_contour in enumerate(current_droplet_contours):
-                    raw_similarity_score = cv2.matchShapes(
-                        history_contour, current_contour, cv2.CONTOURS_MATCH_I2, 0
-                    )
-                    # Biiiiig numbers. (Mostly not dealing well with 0 and inf.) I
-                    # should probably do a log transform on the raw hu moments first,
-                    # and do my own calcs, but matchShapes is convenient, and it'll be
-                    # in the right ballpark.
-                    transformed_score = abs(log_transform(raw_similarity_score))
-                    if 308.0 < transformed_score < 308.5:
-                        # Edge case, close to 308.25 from float; too few pixels for
-                        # moments to work.
-                        transformed_score = 0.5  # SWAG that seems to mostly work.
-                    shape_similarity[row_index, col_index] = transformed_score
-
-            # Use an array mask to filter out large numbers and (effectively) zeroes
-            # and less.
-            mshape_similarity = shape_similarity
-            # mshape_similarity = ma.masked_outside(shape_similarity, 0.000001, 100.0)
-
-            # We're going to use the distance sort to drive the decision order.
-            # However, here the similarity matrix will highlight the smallest similarity
-            # value, which may not match the distance table.
-
-            shape_row_sort = mshape_similarity.min(axis=1).argsort()
-            shape_column_sort = mshape_similarity.argmin(axis=1)[shape_row_sort]
-            shape_highlight_column = shape_column_sort[0] + 1
-            shape_highlight_row = shape_row_sort[0]
-
-            if self._SHOW_DROPLET_TABLE and self._VERBOSE:
-                printc("Similarity", "bright blue")
-                print(
-                    self._print_distance_array(
-                        mshape_similarity,
-                        self.droplet_history_registry.keys(),
-                        self.current_droplet_registry.keys(),
-                        highlight_column=shape_highlight_column,
-                        highlight_row=shape_highlight_row,
-                        color="bright blue",
-                    )
-                )
-
-            if self._SHOW_DROPLET_SUMMARY and self._VERBOSE:
-
-                # Ditto on default.
-
-                new_string = " ".join(
-                    [
-                        "{: >7}".format(list(self.current_droplet_registry.keys())[x])
-                        for x in distance_column_sort
-                    ]
-                )
-                old_string = " ".join(
-                    [
-                        "{: >7}".format(list(self.droplet_history_registry.keys())[x])
-                        for x in distance_row_sort
-                    ]
-                )
-                distance_string = " ".join(
-                    [
-                        "{: >7.2f}".format(distances[x, y])
-                        for x, y in zip(distance_row_sort, distance_column_sort)
-                    ]
-                )
-
-                # similarity_string = " ".join(
-                #     [
-                #         "{: >7.2f} ({},{})".format(mshape_similarity[x, y], x, y)
-                #         for x, y in zip(shape_row_sort, shape_column_sort)
-                #     ]
-                # )  # Debug - x,y of smallest similarity number.
-
-                similarity_string = " ".join(
-                    [
-                        "{: >7.2f}".format(mshape_similarity[x, y])
-                        for x, y in zip(distance_row_sort, distance_column_sort)
-                    ]
-                )
-                similarity_string = re.sub(r"--", "     --", similarity_string)
-                print("       new {}".format(new_string))
-                print("       old {}".format(old_string))
-                print("  distance {}".format(distance_string))
-                print("similarity {}\n".format(similarity_string))
+            # 6. Shape comparisons, for the candidate pairs only, from the Hu
+            # moments cached in the registry.
+            pair_history_slots = history_slots[rows]
+            pair_current_slots = current_slots[columns]
+            shape_similarity = hu_shape_similarity(
+                registry.column("log_hu")[pair_history_slots],
+                registry.column("hu_nonzero")[pair_history_slots],
+                registry.column("log_hu")[pair_current_slots],
+                registry.column("hu_nonzero")[pair_current_slots],
+            )
 
             # 7. ...back to making decisions on which droplets might be
             #       previously seen...
@@ -365,83 +264,43 @@ class Tracker:
             #    could be a re-sighting of a prior droplet. Let's start with
             #    (d * s) < 5 as starting point for our guesses.
 
-            # Sets used to track if a row/column pair has been used.
-            used_rows = set()
-            used_columns = set()
-            matched_ids = OrderedDict()
+            #    Every pair we look at is within the distance threshold; history
+            #    droplets with nothing in range can't be matched, and aren't tried.
 
-            combinations_to_try = zip(distance_row_sort, distance_column_sort)
-            for row, column in combinations_to_try:
+            #    Which pairs get tried, and in what order, is up to the assignment
+            #    engine (utils/assignment.py).
 
-                if row in used_rows or column in used_columns:
-                    # Skip this combination, as this pair has been matched.
-                    # printc("{}, {}".format(row, column), 'bright cyan') # Debug.
-                    continue
-
-                similarity_factor = mshape_similarity[row, column]
-                confidence = distances[row, column] * similarity_factor
+            confidences = pair_distances * shape_similarity
+            tried_pairs, accepted = assign(
+                self._ASSIGNMENT,
+                rows,
+                columns,
+                pair_distances,
+                confidences,
+                self._CONFIDENCE_THRESHOLD,
+            )
 
-                # Communicate.
-                if confidence > self._CONFIDENCE_THRESHOLD:
-                    # Not a winner. This droplet isn't one we've seen before.
-                    if self._VERBOSE:
-                        printc(
-                            "Confidence: - {:.2f} - Droplets {} and {} are {:.2f} pixels apart, similarity = {:.2f}".format(
-                                confidence,
-                                list(self.droplet_history_registry.keys())[row],
-                                list(self.current_droplet_registry.keys())[column],
-                                distances[row, column],
-                                mshape_similarity[row, column],
-                            ),
-                            "red",
-                        )
-                elif distances[row, column] > self._DISTANCE_THRESHOLD:
-                    # Not a winner. This droplet isn't one we've seen before.
-                    if self._VERBOSE:
-                        printc(
-                            "Droplets {} and {} are {:.2f} pixels apart, greater than threshold of {}".format(
-                                list(self.droplet_history_registry.keys())[row],
-                                list(self.current_droplet_registry.keys())[column],
-                                distances[row, column],
-                                self._DISTANCE_THRESHOLD,
-                            ),
-                            "red",
-                        )
-                else:
-                    if self._VERBOSE:
-                        printc(
-                            "Confidence: + {:.2f} - Droplets {} and {} are {:.2f} pixels apart, similarity = {:.2f}".format(
-                                confidence,
-                                list(self.droplet_history_registry.keys())[row],
-                                list(self.current_droplet_registry.keys())[column],
-                                distances[row, column],
-                                mshape_similarity[row, column],
-                            ),
-                            "green",
-                        )
+            # Remember the matched pairs, and we'll update our registry when
+            # we're done.
+            matched_pairs = tried_pairs[accepted]
+            matched_ids = OrderedDict(
+                zip(
+                    current_ids[columns[matched_pairs]].tolist(),
+                    history_ids[rows[matched_pairs]].tolist(),
+                )
+            )
 
-                    # self.distance_research["accepted"][
-                    #     (
-                    #         list(self.droplet_history_registry.keys())[row],
-                    #         list(self.current_droplet_registry.keys())[column],
-                    #     )
-                    # ] = distances[row, column]
-
-                    # Remember the matched pair, and we'll update our registries
-                    # when we're done..
-                    original_droplet_id = list(self.droplet_history_registry.keys())[
-                        row
-                    ]
-                    new_droplet_id = list(self.current_droplet_registry.keys())[column]
-                    matched_ids[new_droplet_id] = original_droplet_id
-
-                    # Add the info to our tracking sets, so we don't look at
-                    # these again.
-                    used_rows.add(row)
-                    used_columns.add(column)
-
-            if self._VERBOSE:
-                print()
+            if self._recording:
+                # Pairs tried, in the order they were tried.
+                tried = np.full(len(rows), -1, dtype=np.int64)
+                tried[tried_pairs] = np.arange(len(tried_pairs))
+                matched = np.zeros(len(rows), dtype=bool)
+                matched[matched_pairs] = True
+                self._diagnostics.record_comparison(
+                    (history_ids, droplet_history_centroids),
+                    (current_ids, current_droplet_centroids),
+                    (rows, columns, pair_distances, shape_similarity, tried, matched),
+                )
 
             # Loop over all matched droplet pairs, make needed registry changes
             # for corrections.
@@ -499,16 +358,16 @@ class Tracker:
                 self._process_droplet_connection(new_droplet_id, original_droplet_id)
 
         # And Case 3: correction droplets captured in this frame but were
-        # otherwise ignored.
+        # otherwise ignored. The corrections are indexed by frame, so only this
+        # frame's are looked at.
 
-        for new_droplet_id in self._droplet_corrections:
+        for new_droplet_id, corrected_droplet_id in self._droplet_corrections.in_frame(
+            this_frame
+        ):
 
-            if (
-                new_droplet_id in self._droplet_master.index_by_frame[this_frame]
-                and new_droplet_id not in matched_ids
-            ):
+            if new_droplet_id not in matched_ids:
 
-                if self._droplet_corrections[new_droplet_id] is None:
+                if corrected_droplet_id is None:
                     # Oops. If we're trying to connect one of the droplets in this frame
                     # to a droplet in a prior frame. If this droplet correction doesn't
                     # specify a droplet to connect to, then it's an error.
@@ -526,33 +385,95 @@ class Tracker:
                     if self._VERBOSE:
                         printc(
                             "Droplet correction: droplet {} will be connected to droplet {}.".format(
-                                new_droplet_id,
-                                self._droplet_corrections[new_droplet_id],
+                                new_droplet_id, corrected_droplet_id
                             ),
                             "red",
                         )
 
-                self._process_droplet_connection(
-                    new_droplet_id, self._droplet_corrections[new_droplet_id]
-                )
+                self._process_droplet_connection(new_droplet_id, corrected_droplet_id)
+
+        self._end_recording()
+
+        return self._current_droplets()
+
+    def save_state(self):
+        """
+        Save the tracker's state, and the droplet store's, before a frame.
 
-        return self.current_droplet_registry
+        Cheap enough to do every frame: the registry snapshot is copy-on-write,
+        and the store is marked by its relocation count.
+
+        :return: opaque state, for restore_state()
+        """
+        return (
+            self._registry.snapshot(),
+            self._droplet_master.droplet_store.relocation_count,
+        )
+
+    def restore_state(self, state):
+        """
+        Go back to a saved state, undoing the droplet connections made since, so
+        the frames after it can be tracked again.
+
+        :param state: from save_state()
+        """
+        registry_snapshot, relocation_count = state
+        self._droplet_master.droplet_store.undo_relocations(relocation_count)
+        self._registry.restore(registry_snapshot)
 
     ###
 
+    def _begin_recording(self, this_frame):
+        # Record diagnostics for the frame, if we're keeping them, and it's the
+        # first time through it.
+        self._recording = (
+            self._diagnostics is not None
+            and this_frame == self._diagnostics.frame_count
+        )
+        if self._recording:
+            self._diagnostics.begin_frame(this_frame)
+        return self._recording
+
+    def _end_recording(self):
+        if self._recording:
+            self._diagnostics.end_frame()
+            self._recording = False
+
     def _process_droplet_connection(self, new_droplet_id, original_droplet_id):
         """
         Utility function to add droplet connections
         :param new_droplet_id:
         :param old_droplet_id:
         """
-        if self._VERBOSE:
-            print(
-                "New droplet {} is the same as droplet {} from frame {}.".format(
-                    new_droplet_id,
-                    original_droplet_id,
-                    self._droplet_master.index_by_droplet[original_droplet_id].frame,
-                )
+        if self._recording:
+            self._diagnostics.record_connection(
+                new_droplet_id,
+                original_droplet_id,
+                self._droplet_master.index_by_droplet[original_droplet_id].frame,
+            )
+
+        registry = self._registry
+        new_slot = registry.find(new_droplet_id)
+        if new_slot is None:
+            raise KeyError(new_droplet_id)
+        original_slot = registry.find(original_droplet_id)
+
+        if self._motion_model is None or original_slot is None:
+            # No motion model, or the original droplet has expired, and its track
+            # starts over from the new sighting.
+            track = None
+        else:
+            # Correct the original droplet's track with the new sighting; the
+            # track the new one started goes with its slot.
+            store = self._droplet_master.droplet_store
+            frame = store.column("frame")
+            track = self._motion_model.corrected(
+                registry.column("track")[original_slot],
+                registry.centroids([new_slot])[0],
+                int(
+                    frame[registry.column("row")[new_slot]]
+                    - frame[registry.column("row")[original_slot]]
+                ),
             )
 
         # Add new location data to original droplet.
@@ -560,97 +481,53 @@ class Tracker:
             self._droplet_master.index_by_droplet[new_droplet_id]
         )
 
-        # Jigger our registries, moving the historical droplet up to current,
-        # and erasing most traces of the new one.
-        new_droplet_data = self.current_droplet_registry[new_droplet_id]
-        new_droplet_data.id = original_droplet_id
-
-        # Remove the original droplet from our history, including ageing...
-        self._deregister(original_droplet_id)
-        # ...recreate it the current registry with the old id number, which is
-        # picked up from the internal droplet data...
-        self._register(new_droplet_data)
-        # ...and remove the found duplicate droplet from the current list.
-        self._deregister_current_housekeeping(new_droplet_id)
-
-        if self._VERBOSE:
-            print()  # Last blank line before next frame.
+        # Jigger our registry, moving the historical droplet up to current, and
+        # erasing most traces of the new one: the new droplet's slot takes the
+        # original droplet's id, and the original's history slot is removed.
+        # (An original already in the current frame keeps its place.)
+        root = self._droplet_master.droplet_store.row_for_id(original_droplet_id)
+        if original_slot is not None and registry.column("age")[original_slot] > 0:
+            registry.remove(original_slot)
+            original_slot = None
+        registry.reassign(
+            new_slot, original_droplet_id, root, track=track, replacing=original_slot
+        )
 
     ###
 
-    def _print_distance_array(
-        self,
-        data_array,
-        prior_frame_droplet_ids,
-        new_frame_droplet_ids,
-        highlight_column=None,
-        highlight_row=None,
-        color="red",
-    ):
+    def _candidate_pairs(self, history_centroids, current_centroids, radii=None):
         """
-        Pretty-printer for numpy distance/shape arrays
-
-        :param prior_frame_droplets: OrderedDict of frame droplet centroids,
-                                     keyed by droplet #
-        :param new_frame_droplets: Same, for the incoming frame
-        :param highlight_column: Column to highlight from sort
-        :param highlight_row: And row to highlight.
-        :param color: Highlight color.
-
-        :return: Unicode string ready for printing to ANSI console.
-
+        Find every (history, current) pair of droplets whose centroids are within
+        the distance threshold, with a KD-tree.
+
+        :param history_centroids: np (M, 2) array of history droplet centroids
+        :param current_centroids: np (N, 2) array of current droplet centroids
+        :param radii: np array of search radii by history droplet, or None to use
+                      the distance threshold for all of them
+        :return: (rows, columns, distances) np arrays, one entry per pair; rows
+                 index history droplets and columns current droplets
         """
-        # Float formatting and alignment appear to be broken in
-        # PrettyTable, and padding width shows no difference between 0 and 1. Hmpf.
-        table = PrettyTable(
-            border=False,
-            left_padding_width=0,
-            right_padding_width=0,
-            padding_width=0,
-            float_format=".2",
-            align="r",
+        if radii is None:
+            radius = self._DISTANCE_THRESHOLD
+        else:
+            radius = radii.max()
+
+        # A hair of slack on the radius, and then the exact test, computed the
+        # way cdist() computes it, so borderline pairs go the same way they
+        # would with a full distance matrix.
+        pairs = cKDTree(history_centroids).sparse_distance_matrix(
+            cKDTree(current_centroids),
+            radius * (1 + 1e-9),
+            output_type="ndarray",
         )
-
-        # Add initial blank field to header for left-side droplet numbers
-        column_headers = [""] + list(
-            new_frame_droplet_ids
-        )  # Convert numpy array to plain list.
-        # Left side numbers, from prior frame.
-        row_leads = list(prior_frame_droplet_ids)  # Ditto.
-        rows, columns = data_array.shape
-
-        # row_holder is a list of row lists.
-        row_holder = []
-        # Column header highlight - this column contains the smallest value.
-        column_headers[highlight_column] = (
-            start_color(color) + str(column_headers[highlight_column]) + stop_color()
+        rows = pairs["i"].astype(np.int64)
+        columns = pairs["j"].astype(np.int64)
+        distances = np.sqrt(
+            ((history_centroids[rows] - current_centroids[columns]) ** 2).sum(axis=1)
         )
+        if radii is None:
+            in_range = distances <= self._DISTANCE_THRESHOLD
+        else:
+            in_range = distances <= radii[rows]
 
-        for row in range(rows):
-            # Have to do our own float formatting. row_leads are the prior
-            # frame droplet numbers.
-            row_list = [row_leads[row]] + [
-                "{: 4.2f}".format(x) for x in list(data_array[row])
-            ]
-            if highlight_column:
-                # Highlight the column with the smallest value, hitting each row
-                # as it goes by.
-                row_list[highlight_column] = (
-                    start_color(color) + str(row_list[highlight_column]) + stop_color()
-                )
-            if highlight_row:
-                # List comprehension to light up all value_1_values in the highlighted row.
-                if row == highlight_row:
-                    row_list = [
-                        start_color(color) + str(row_list[x]) + stop_color()
-                        for x in range(len(row_list))
-                    ]
-            # And add the row to our holder.
-            row_holder.append(row_list)
-
-        # Assemble the parts.
-        table.field_names = column_headers
-        for row in row_holder:
-            table.add_row(row)
-
-        return "\n" + table.get_string() + "\n"
+        return rows[in_range], columns[in_range], distances[in_range]
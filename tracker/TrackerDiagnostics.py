@@ -0,0 +1,263 @@
+# Copyright (c) 2020 Fredrick Levine
+# rick@xoab.us
+#
+# This file is part of Droplet Video Analyzer
+# https://github.com/rlevine/droplet_video_analyzer
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+###
+
+import json
+import numpy as np
+
+"""
+
+What the tracker looked at and decided in each frame, recorded as raw arrays
+instead of being printed as it goes, so verbose runs track as fast as quiet ones.
+dva inspect (droplet_video_analyzer/inspection.py) prints the distance and
+similarity tables, the pair summary and the match decisions for any frame
+afterwards.
+
+For each frame the tracker compared droplets in, the diagnostics hold four
+tables:
+
+    history      id, x, y of each history droplet, in registry order; x, y
+                 are where the tracker looked for it (its predicted position,
+                 with a motion model)
+    current      id, x, y of each droplet in the frame, in registry order
+    pairs        each candidate pair within range: history and current index,
+                 distance, shape similarity, the order the assignment engine
+                 tried it in (-1 if it wasn't tried), and whether it matched
+    connections  each droplet connection made, matches and corrections:
+                 new id, original id, and the frame the original was last
+                 seen in
+
+Like the track record, each table is stored CSR-style: one flat array, plus an
+offset table by frame.
+
+"""
+
+TRACKER_DIAGNOSTICS_VERSION = 1
+
+DIAGNOSTICS_DTYPES = {
+    "history": np.dtype([("id", np.int64), ("x", np.float64), ("y", np.float64)]),
+    "current": np.dtype([("id", np.int64), ("x", np.float64), ("y", np.float64)]),
+    "pairs": np.dtype(
+        [
+            ("row", np.int64),
+            ("column", np.int64),
+            ("distance", np.float64),
+            ("similarity", np.float64),
+            ("tried", np.int64),
+            ("accepted", np.bool_),
+        ]
+    ),
+    "connections": np.dtype(
+        [
+            ("new_id", np.int64),
+            ("original_id", np.int64),
+            ("original_frame", np.int64),
+        ]
+    ),
+}
+
+
+class TrackerDiagnostics:
+    def __init__(self, params=None):
+        """
+        Initialize empty diagnostics.
+
+        :param params: dict of tracker settings, JSON-serializable
+        """
+        self.params = dict(params or {})
+
+        self._frame_count = 0
+        self._tables = {
+            name: np.zeros(1024, dtype=dtype)
+            for name, dtype in DIAGNOSTICS_DTYPES.items()
+        }
+        self._starts = {
+            name: np.zeros(1024, dtype=np.int64) for name in DIAGNOSTICS_DTYPES
+        }
+        # The frame being recorded, until end_frame().
+        self._pending = None
+
+    @property
+    def frame_count(self):
+        return self._frame_count
+
+    def begin_frame(self, frame_id):
+        """
+        Start recording the next frame. Tables not recorded before end_frame()
+        are empty for the frame.
+
+        :param frame_id: int frame number; frames must be recorded in order
+        """
+        if frame_id != self.frame_count:
+            raise ValueError(
+                "Frames must be recorded in order: expected frame {}, got {}.".format(
+                    self.frame_count, frame_id
+                )
+            )
+        self._pending = {name: [] for name in DIAGNOSTICS_DTYPES}
+
+    def record_comparison(self, history, current, pairs=None):
+        """
+        Record the droplets compared in the frame, and the candidate pairs.
+
+        :param history: (ids, np (M, 2) array of centroids) for history droplets
+        :param current: (ids, np (N, 2) array of centroids) for current droplets
+        :param pairs: (rows, columns, distances, similarities, tried, accepted)
+                      np arrays, one entry per candidate pair; tried is the
+                      order the pair was tried in, or -1; None if there were
+                      no droplets to compare
+        """
+        for name, (ids, centroids) in (("history", history), ("current", current)):
+            table = np.zeros(len(ids), dtype=DIAGNOSTICS_DTYPES[name])
+            table["id"] = ids
+            table["x"] = centroids[:, 0]
+            table["y"] = centroids[:, 1]
+            self._pending[name].append(table)
+
+        if pairs is not None:
+            table = np.zeros(len(pairs[0]), dtype=DIAGNOSTICS_DTYPES["pairs"])
+            for field, values in zip(DIAGNOSTICS_DTYPES["pairs"].names, pairs):
+                table[field] = values
+            self._pending["pairs"].append(table)
+
+    def record_connection(self, new_id, original_id, original_frame):
+        """
+        Record a droplet connection made in the frame.
+
+        :param new_id: int id of the droplet found in the frame
+        :param original_id: int id of the earlier droplet it's a sighting of
+        :param original_frame: int frame the earlier droplet was last seen in
+        """
+        self._pending["connections"].append(
+            np.array(
+                [(new_id, original_id, original_frame)],
+                dtype=DIAGNOSTICS_DTYPES["connections"],
+            )
+        )
+
+    def end_frame(self):
+        """
+        Finish recording the frame.
+        """
+        frame_id = self._frame_count
+        for name, dtype in DIAGNOSTICS_DTYPES.items():
+            pending = self._pending[name]
+            rows = np.concatenate(pending) if pending else np.zeros(0, dtype=dtype)
+
+            self._starts[name] = self._reserved(self._starts[name], frame_id + 2)
+            start = self._starts[name][frame_id]
+            stop = start + len(rows)
+            self._tables[name] = self._reserved(self._tables[name], stop)
+            self._tables[name][start:stop] = rows
+            self._starts[name][frame_id + 1] = stop
+
+        self._pending = None
+        self._frame_count += 1
+
+    def frame(self, frame_id):
+        """
+        Return the diagnostics for a frame.
+
+        :param frame_id: int frame number
+        :return: dict of np structured arrays, by table name
+        """
+        if not 0 <= frame_id < self._frame_count:
+            raise IndexError(frame_id)
+        return {
+            name: self._tables[name][
+                self._starts[name][frame_id] : self._starts[name][frame_id + 1]
+            ]
+            for name in DIAGNOSTICS_DTYPES
+        }
+
+    ###
+
+    def save(self, file_path):
+        """
+        Save the diagnostics as a .npz file.
+
+        :param file_path: str absolute file path
+        """
+        arrays = {}
+        for name in DIAGNOSTICS_DTYPES:
+            starts = self._starts[name][: self._frame_count + 1]
+            arrays[name + "_starts"] = starts
+            arrays[name] = self._tables[name][: starts[-1]]
+
+        with open(file_path, "wb") as diagnostics_file:
+            np.savez_compressed(
+                diagnostics_file,
+                params=np.array(
+                    json.dumps(
+                        {
+                            "version": TRACKER_DIAGNOSTICS_VERSION,
+                            "params": self.params,
+                        }
+                    )
+                ),
+                **arrays
+            )
+
+    @classmethod
+    def load(cls, file_path):
+        """
+        Load diagnostics saved with save().
+
+        :param file_path: str absolute file path
+        :return: TrackerDiagnostics
+        :raises ValueError: if the file isn't usable diagnostics
+        """
+        try:
+            with np.load(file_path) as saved:
+                header = json.loads(str(saved["params"]))
+                arrays = {name: saved[name] for name in saved.files}
+        except (OSError, KeyError, ValueError) as error:
+            raise ValueError(
+                "Can't read tracker diagnostics {}: {}".format(file_path, error)
+            )
+
+        if header.get("version") != TRACKER_DIAGNOSTICS_VERSION:
+            raise ValueError(
+                "Tracker diagnostics {} are version {}, expected {}.".format(
+                    file_path, header.get("version"), TRACKER_DIAGNOSTICS_VERSION
+                )
+            )
+
+        diagnostics = cls(params=header["params"])
+        try:
+            for name in DIAGNOSTICS_DTYPES:
+                diagnostics._tables[name] = arrays[name]
+                diagnostics._starts[name] = arrays[name + "_starts"]
+        except KeyError as error:
+            raise ValueError(
+                "Can't read tracker diagnostics {}: {}".format(file_path, error)
+            )
+        diagnostics._frame_count = len(diagnostics._starts["history"]) - 1
+
+        return diagnostics
+
+    ###
+
+    def _reserved(self, array, size):
+        # Return array, or a copy with room for at least size entries.
+        if size <= len(array):
+            return array
+        grown = np.zeros((max(size, len(array) * 2),) + array.shape[1:], array.dtype)
+        grown[: len(array)] = array
+        return grown
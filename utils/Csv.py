@@ -18,8 +18,12 @@
 
 ###
 
-from collections import OrderedDict
 import csv
+import numpy as np
+
+# Rows turned into Python values at a time, when writing a file; writing a
+# whole long file's columns at once would take several times their size.
+WRITE_CHUNK_ROWS = 65536
 
 
 class CsvFile:
@@ -27,10 +31,15 @@ class CsvFile:
         """
         Initialize csv file.
 
+        The data is kept as columns over the rows of the video master's droplet
+        store, one entry per initial droplet detection, rather than as a dict of
+        lists, so it stays small for long files. In streaming mode, the columns
+        are memory-mapped next to the store's.
+
         :return: string absolute file name
         """
         self.csv_file_path = file_path
-        self._csv_data_dict = OrderedDict()
+        self._store = video_master.droplet_store
 
         self._load_initial_csv_data(video_master)
 
@@ -38,27 +47,27 @@ class CsvFile:
 
     @property
     def row_count(self):
-        return len(self._csv_data_dict)
+        return len(self._store)
 
     def _load_initial_csv_data(self, video_master):
 
-        # Collect initial .csv file data dict, based on first, unwinnowed
-        # pass through video file, keyed by tuple (<frame #>, <initial droplet id>)
-        # Blanks in data will be filled in later with assigned droplet id and
-        # updated area.
+        # Collect initial .csv file data, based on first, unwinnowed pass through
+        # video file, one entry per store row, ie per (<frame #>, <initial droplet
+        # id>). Blanks in data will be filled in later with assigned droplet id and
+        # updated area. The initial pixel area is the store's area column.
 
-        # TODO Using named tuples might make these methods more readable.
+        row_count = len(self._store)
 
-        for frame_id, _ in enumerate(video_master.frames):
-            for droplet_id in video_master.frames[frame_id].droplets:
-                initial_id = (
-                    video_master.frames[frame_id].droplets[droplet_id].initial_id
-                )
-                self._csv_data_dict[(str(frame_id + 1), str(initial_id))] = [
-                    '',
-                    video_master.frames[frame_id].droplets[droplet_id].area,
-                    '',
-                ]
+        # 0 until a row has been updated; droplet ids start at 1.
+        self._assigned_ids = self._store.scratch(
+            "csv_assigned_ids", row_count, np.int64
+        )
+        self._duplicate_areas = self._store.scratch(
+            "csv_duplicate_areas", row_count, np.int64
+        )
+        self._centroids = self._store.scratch(
+            "csv_centroids", (row_count, 2), np.float64
+        )
 
     def update_csv_row(self, frame, initial_droplet_id, value):
         """
@@ -76,29 +85,14 @@ class CsvFile:
             droplet_centroid_y,
         ) = value
 
-        current_row = self._csv_data_dict[(str(frame), str(initial_droplet_id))]
+        row = self._store.row_for_id(int(initial_droplet_id))
 
-        if str(assigned_droplet_id) == str(initial_droplet_id):
-            # Isn't a duplicate of a prior droplet, ie no change in id.
-            self._csv_data_dict[(str(frame), str(initial_droplet_id))] = [
-                assigned_droplet_id,
-                current_row[1],
-                '',
-            ]
-        else:
-            # Duplicate droplet, with new assigned id and new pixel area.
-            self._csv_data_dict[(str(frame), str(initial_droplet_id))] = [
-                assigned_droplet_id,
-                '',
-                droplet_area,
-            ]
+        # A duplicate of a prior droplet gets its new assigned id and new pixel
+        # area; otherwise, the id doesn't change.
+        self._assigned_ids[row] = int(assigned_droplet_id)
+        self._duplicate_areas[row] = droplet_area
         # Add centroid coordinates to all rows.
-        self._csv_data_dict[(str(frame), str(initial_droplet_id))].extend(
-            [
-                droplet_centroid_x,
-                droplet_centroid_y,
-            ]
-        )
+        self._centroids[row] = (float(droplet_centroid_x), float(droplet_centroid_y))
 
     def write(self):
 
@@ -123,28 +117,84 @@ class CsvFile:
 
         # Rearrange, sort and write csv data.
 
-        # We had to use a unique key for our dict, but now we can untangle the data,
-        # putting the assigned (and potentially duplicated) droplet id first.
-        data_list = []
-        for key in self._csv_data_dict:
-            (frame_count, droplet_id) = key
-            data_list.append(
-                [
-                    self._csv_data_dict[key][0],
-                    droplet_id,
-                    frame_count,
-                    self._csv_data_dict[key][1],
-                    self._csv_data_dict[key][2],
-                    self._csv_data_dict[key][3],
-                    self._csv_data_dict[key][4],
-                ]
-            )
-        # Sort the rows by the assigned droplet id.
-        data_list.sort(key=lambda x: x[0])
-        # Rock & roll.
-        for row in data_list:
-            csv_writer.writerow(row)
+        # Sort the rows by the assigned droplet id, keeping scan order within an id.
+        # Rows that were never updated have no assigned id, and go first.
+        order = np.argsort(self._assigned_ids, kind="stable")
+
+        initial_ids = self._store.column("initial_id")
+        frames = self._store.column("frame")
+        areas = self._store.column("area")
+
+        # Rock & roll, a chunk of rows at a time.
+        for start in range(0, len(order), WRITE_CHUNK_ROWS):
+            rows = order[start : start + WRITE_CHUNK_ROWS]
+            for assigned_id, initial_id, frame, area, duplicate_area, centroid in zip(
+                self._assigned_ids[rows].tolist(),
+                initial_ids[rows].tolist(),
+                (frames[rows] + 1).tolist(),
+                areas[rows].tolist(),
+                self._duplicate_areas[rows].tolist(),
+                self._centroids[rows].tolist(),
+            ):
+                if assigned_id == 0:
+                    csv_writer.writerow(['', initial_id, frame, area, '', '', ''])
+                    continue
+                # We had to key the data by detection, but now we can untangle it,
+                # putting the assigned (and potentially duplicated) droplet id
+                # first.
+                csv_writer.writerow(
+                    [
+                        assigned_id,
+                        initial_id,
+                        frame,
+                        area if assigned_id == initial_id else '',
+                        '' if assigned_id == initial_id else duplicate_area,
+                        "{:.2f}".format(centroid[0]),
+                        "{:.2f}".format(centroid[1]),
+                    ]
+                )
         csv_file.close()
 
         if self._VERBOSE:
             print("\nCreated data file {}.".format(self.csv_file_path))
+
+
+def write_lineage_file(store, file_path):
+    """
+    Write the droplet lineage graph as a .csv edge list, one row per link between
+    successive sightings of a droplet.
+
+    :param store: DropletStore, after tracking
+    :param file_path: str absolute file path
+    """
+    lineage_file = open(file_path, "w", newline="")
+    csv_writer = csv.writer(lineage_file, dialect="excel")
+    csv_writer.writerow(
+        [
+            'droplet_id',
+            'parent_initial_id',
+            'child_initial_id',
+            'parent_frame',
+            'child_frame',
+            'generation',
+        ]
+    )
+    ids = store.column("id")
+    initial_ids = store.column("initial_id")
+    frames = store.column("frame")
+    generations = store.column("generation")
+    # A chunk of child rows at a time.
+    for start in range(0, len(store), WRITE_CHUNK_ROWS):
+        edges = store.lineage_edges(start, start + WRITE_CHUNK_ROWS)
+        parents, children = edges[:, 0], edges[:, 1]
+        csv_writer.writerows(
+            zip(
+                ids[children].tolist(),
+                initial_ids[parents].tolist(),
+                initial_ids[children].tolist(),
+                (frames[parents] + 1).tolist(),
+                (frames[children] + 1).tolist(),
+                generations[children].tolist(),
+            )
+        )
+    lineage_file.close()
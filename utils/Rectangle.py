@@ -26,6 +26,9 @@ from config.common import bright_red
 
 
 class Rectangle:
+    # Labels make several of these per droplet per frame.
+    __slots__ = ("min_x", "max_x", "min_y", "max_y")
+
     def __init__(self, upper_left=(0, 0), lower_right=(0, 0)):
         self.min_x = upper_left[0]
         self.max_x = lower_right[0]
@@ -0,0 +1,230 @@
+# Copyright (c) 2020 Fredrick Levine
+# rick@xoab.us
+#
+# This file is part of Droplet Video Analyzer
+# https://github.com/rlevine/droplet_video_analyzer
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+###
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import coo_matrix
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+
+"""
+
+Assignment engines for the tracker: given the candidate (history, current) droplet
+pairs within the distance threshold, with their distances and costs (distance x
+shape similarity), decide which pairs are repeat sightings of the same droplet.
+
+    greedy   - the tracker's original rule: each history droplet tries only its
+               nearest current droplet, closest pairs first, and takes it if the
+               cost is within the similarity threshold and the current droplet
+               hasn't been taken yet
+    optimal  - a minimum-cost assignment over every admissible pair (cost within
+               the threshold): as many matches as possible, and of those, the
+               smallest total cost. The pairs split into independent connected
+               groups, and each group is solved on its own, with
+               linear_sum_assignment, or for the big groups in crowded frames,
+               with a sparse solver, so the work grows with the size of the
+               groups, not the frame.
+
+Every engine takes the same arguments, and returns the pairs it decided on, in
+decision order, as indices into the candidate arrays, and which of those it
+accepted.
+
+"""
+
+ASSIGNMENT_ENGINES = ("greedy", "optimal")
+
+# Groups with bigger dense cost matrices than this are solved sparse.
+DENSE_GROUP_LIMIT = 1 << 16
+
+
+def nearest_pairs(rows, columns, distances):
+    """
+    Return each history droplet's nearest candidate pair, nearest pairs first.
+
+    :param rows: np array of history droplet indices, one per candidate pair
+    :param columns: np array of current droplet indices
+    :param distances: np array of centroid distances
+    :return: np array of candidate pair indices
+    """
+    # Sort by row, then distance, then column, and take the first pair for
+    # each row.
+    pair_order = np.lexsort((columns, distances, rows))
+    nearest = pair_order[np.flatnonzero(np.diff(rows[pair_order], prepend=-1))]
+    return nearest[np.argsort(distances[nearest], kind="stable")]
+
+
+def greedy_assignment(rows, columns, distances, costs, cost_threshold):
+    """
+    Greedy assignment: nearest pairs first, one try per history droplet.
+
+    :param rows: np array of history droplet indices, one per candidate pair
+    :param columns: np array of current droplet indices
+    :param distances: np array of centroid distances
+    :param costs: np array of distance x similarity costs
+    :param cost_threshold: largest cost for a match
+    :return: (np array of pair indices tried, np bool array of which matched)
+    """
+    used_columns = set()
+    tried = []
+    accepted = []
+
+    for pair in nearest_pairs(rows, columns, distances).tolist():
+        column = int(columns[pair])
+        if column in used_columns:
+            # This current droplet has been matched.
+            continue
+        tried.append(pair)
+        accepted.append(bool(costs[pair] <= cost_threshold))
+        if accepted[-1]:
+            used_columns.add(column)
+
+    return np.array(tried, dtype=np.int64), np.array(accepted, dtype=bool)
+
+
+def optimal_assignment(rows, columns, distances, costs, cost_threshold):
+    """
+    Minimum-cost, maximum-cardinality assignment over the admissible pairs.
+
+    :param rows: np array of history droplet indices, one per candidate pair
+    :param columns: np array of current droplet indices
+    :param distances: np array of centroid distances
+    :param costs: np array of distance x similarity costs
+    :param cost_threshold: largest cost for a match
+    :return: (np array of matched pair indices, nearest first; np bool array,
+             all True)
+    """
+    admissible = np.flatnonzero(costs <= cost_threshold)
+    if len(admissible) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool)
+
+    # Number the rows and columns in play, and find the connected groups of
+    # pairs; rows and columns are nodes of one bipartite graph.
+    row_ids, row_nodes = np.unique(rows[admissible], return_inverse=True)
+    column_ids, column_nodes = np.unique(columns[admissible], return_inverse=True)
+    column_nodes = column_nodes + len(row_ids)
+    node_count = len(row_ids) + len(column_ids)
+    _, labels = connected_components(
+        coo_matrix(
+            (np.ones(len(admissible)), (row_nodes, column_nodes)),
+            shape=(node_count, node_count),
+        ),
+        directed=False,
+    )
+    pair_labels = labels[row_nodes]
+
+    # Most groups are a single pair, and need no solving.
+    group_sizes = np.bincount(pair_labels)
+    single = group_sizes[pair_labels] == 1
+    matched = [admissible[single]]
+
+    pair_order = np.argsort(pair_labels[~single], kind="stable")
+    grouped = admissible[~single][pair_order]
+    group_starts = np.flatnonzero(np.diff(pair_labels[~single][pair_order], prepend=-1))
+
+    for start, stop in zip(group_starts, np.append(group_starts[1:], len(grouped))):
+        group = grouped[start:stop]
+        group_rows, row_index = np.unique(rows[group], return_inverse=True)
+        group_columns, column_index = np.unique(columns[group], return_inverse=True)
+
+        if len(group_rows) * len(group_columns) > DENSE_GROUP_LIMIT:
+            matched.append(
+                _sparse_group_assignment(
+                    group,
+                    row_index,
+                    column_index,
+                    costs[group],
+                    len(group_rows),
+                    len(group_columns),
+                    cost_threshold,
+                )
+            )
+            continue
+
+        # Pairs that aren't candidates get a cost bigger than any set of real
+        # pairs, so the solver only uses them when it has to, and we drop them.
+        no_pair = cost_threshold * (len(group) + 1) + 1
+        cost_matrix = np.full(
+            (len(group_rows), len(group_columns)), no_pair, dtype=np.float64
+        )
+        pair_matrix = np.full(cost_matrix.shape, -1, dtype=np.int64)
+        cost_matrix[row_index, column_index] = costs[group]
+        pair_matrix[row_index, column_index] = group
+
+        solved_rows, solved_columns = linear_sum_assignment(cost_matrix)
+        solved = pair_matrix[solved_rows, solved_columns]
+        matched.append(solved[solved >= 0])
+
+    matched = np.concatenate(matched)
+    matched = matched[np.lexsort((columns[matched], distances[matched]))]
+
+    return matched, np.ones(len(matched), dtype=bool)
+
+
+def _sparse_group_assignment(
+    group, row_index, column_index, group_costs, row_count, column_count, cost_threshold
+):
+    # Minimum-cost, maximum-cardinality assignment for a big group, without a
+    # dense cost matrix. Every row gets a stand-in column of its own, at a cost
+    # bigger than any set of real pairs, so every row can always be matched and
+    # min_weight_full_bipartite_matching can solve it, and it only uses a
+    # stand-in when it has to. Every cost is offset by 1, as the solver doesn't
+    # take zero-cost pairs.
+    pair_count = len(group)
+    no_pair = (cost_threshold + 2) * (pair_count + 1)
+    biadjacency = csr_matrix(
+        (
+            np.concatenate(
+                (group_costs + 1, np.full(row_count, no_pair, dtype=np.float64))
+            ),
+            (
+                np.concatenate((row_index, np.arange(row_count))),
+                np.concatenate((column_index, column_count + np.arange(row_count))),
+            ),
+        ),
+        shape=(row_count, column_count + row_count),
+    )
+    solved_rows, solved_columns = min_weight_full_bipartite_matching(biadjacency)
+
+    real = solved_columns < column_count
+    pair_keys = row_index * column_count + column_index
+    key_order = np.argsort(pair_keys)
+    found = np.searchsorted(
+        pair_keys[key_order], solved_rows[real] * column_count + solved_columns[real]
+    )
+    return group[key_order[found]]
+
+
+def assign(engine, rows, columns, distances, costs, cost_threshold):
+    """
+    Run an assignment engine by name.
+
+    :param engine: one of ASSIGNMENT_ENGINES
+    :return: see greedy_assignment()
+    """
+    if engine == "greedy":
+        return greedy_assignment(rows, columns, distances, costs, cost_threshold)
+    if engine == "optimal":
+        return optimal_assignment(rows, columns, distances, costs, cost_threshold)
+    raise ValueError(
+        "Unknown assignment engine '{}', expected one of {}.".format(
+            engine, ", ".join(ASSIGNMENT_ENGINES)
+        )
+    )
@@ -19,6 +19,7 @@
 ###
 
 import argparse
+import os
 
 
 def get_test_args(TEST=False):
@@ -115,6 +116,17 @@ def get_options(TEST_ARGS=None):
     group1.add_argument('--frame-history', metavar='<frame history>',
                         dest='frame_history', type=int, action='store', default=1,
                         help='number of frames to consider for prior droplet similarity; default=1')
+    group1.add_argument('--assignment', metavar='<engine>',
+                        dest='assignment', action='store', default='greedy',
+                        choices=['greedy', 'optimal', 'global'],
+                        help='how to match droplets to prior droplets: greedy (nearest first), optimal (minimum total cost) or global (minimum total cost over the whole file at once; no motion model); default=greedy')
+    group1.add_argument('--motion-model', metavar='<model>',
+                        dest='motion_model', action='store', default='none',
+                        choices=['none', 'alpha-beta'],
+                        help='predict where prior droplets have moved to: none or alpha-beta (constant velocity); default=none')
+    group1.add_argument('--prediction-radius', metavar='<pixels>',
+                        dest='prediction_radius', type=int, action='store', default=10,
+                        help='with a motion model, distance from a moving droplet\'s predicted position to look for it; default=10')
     group1.add_argument('--top-10',
                         dest='TOP_10', action='store_true', default=False,
                         help='generate image files for the top 10 frames by droplet count')
@@ -151,6 +163,31 @@ def get_options(TEST_ARGS=None):
     group3.add_argument('--output-frames', metavar='<output frames>',
                         dest='output_frames', type=int, action='store', default=1,
                         help='number of frames to duplicate for each source frame')
+    group3.add_argument('--max-frame-droplets', metavar='<droplet count>',
+                        dest='max_frame_droplets', type=int, action='store', default=0,
+                        help='raw droplet count above which a frame is treated as pathological (laser flash, lens hit); 0 turns the check off; default=0')
+    group3.add_argument('--pathological-frames', metavar='<policy>',
+                        dest='pathological_frame_policy', action='store', default='skip-tracking',
+                        choices=['cluster-labels', 'skip-tracking', 'mark-anomalous'],
+                        help='how to handle pathological frames: cluster-labels, skip-tracking (and cluster labels) or mark-anomalous (skip tracking and labels, leave out of totals); default=skip-tracking')
+    group3.add_argument('-j', '--jobs', metavar='<job count>',
+                        dest='jobs', type=int, action='store', default=1,
+                        help='number of video files to analyze at the same time; ignored with --show-video or --capture-log; default=1')
+    group3.add_argument('--tracking-jobs', metavar='<process count>',
+                        dest='tracking_jobs', type=int, action='store', default=1,
+                        help='track the whole file before rendering it, split into segments at gaps without droplets, on this many processes; same results, but no tracker diagnostics for dva inspect; default=1 (track frames as they\'re rendered)')
+    group3.add_argument('--render-only',
+                        dest='RENDER_ONLY', action='store_true', default=False,
+                        help='render the video and data files again from the most recent track record in the output directory, without tracking; scan and tracker settings come from the record')
+    group3.add_argument('--streaming',
+                        dest='STREAMING', action='store_true', default=False,
+                        help='keep droplet data in files in the output directory instead of in memory, for very long recordings')
+    group3.add_argument('--no-scan-cache',  # Note reversed flag.
+                        dest='SCAN_CACHE', action='store_false', default=True,
+                        help='Do *not* use or update the initial scan cache in the output directory')
+    group3.add_argument('--lineage',
+                        dest='LINEAGE', action='store_true', default=False,
+                        help='also write a .csv file linking each droplet sighting to the previous sighting of the same droplet')
     group3.add_argument('--no-audio',  # Note reversed flag.
                         dest='INCLUDE_AUDIO', action='store_false', default=True,
                         help='Do *not* copy source audio to annotated video output file')
@@ -173,3 +210,172 @@ def get_options(TEST_ARGS=None):
             TEST_ARGS = get_test_args(TEST=True)
             args = parser.parse_args(TEST_ARGS.split())
     return args
+
+
+def get_query_options(args):
+    # construct the argument parser for "dva query", and parse the arguments
+
+    parser = argparse.ArgumentParser(
+        prog='dva query',
+        description='Find droplets in an analyzed video file by size, time and position.',
+    )
+
+    # fmt: off
+    group0 = parser.add_argument_group('Input/Output')
+
+    group0.add_argument('video_file', metavar='<file name>',
+                        help='video file to query, either absolute or relative path')
+    group0.add_argument('-o', '--output-dir', metavar='<output directory>',
+                        dest='output_directory', action='store', default=None,
+                        help='directory holding the scan cache and track records for the file (optional; default is "output" in video source dir)')
+    group0.add_argument('--csv', metavar='<csv file>',
+                        dest='csv_file', action='store', default=None,
+                        help='write results to a .csv file instead of the console')
+
+    group1 = parser.add_argument_group('Droplet Detection')
+
+    group1.add_argument('-t', '--threshold', metavar='<detection threshold>',
+                        dest='threshold', type=int, action='store', default=62,
+                        help='droplet detection threshold the file was analyzed with; default=62')
+    group1.add_argument('-b', '--border', metavar='<border width>',
+                        dest='border', type=int, action='store', default=20,
+                        help='border width the file was analyzed with, in pixels; default=20')
+
+    group2 = parser.add_argument_group('Query')
+
+    group2.add_argument('--min-area', metavar='<pixels>',
+                        dest='min_area', type=int, action='store', default=None,
+                        help='smallest droplet pixel area, inclusive')
+    group2.add_argument('--max-area', metavar='<pixels>',
+                        dest='max_area', type=int, action='store', default=None,
+                        help='largest droplet pixel area, inclusive')
+    group2.add_argument('--from', metavar='<time code>',
+                        dest='from_timecode', action='store', default=None,
+                        help='first time code to include, HH:MM:SS[:FF], or a 0-based frame number')
+    group2.add_argument('--to', metavar='<time code>',
+                        dest='to_timecode', action='store', default=None,
+                        help='time code to stop at (not included), HH:MM:SS[:FF], or a 0-based frame number')
+    group2.add_argument('--quadrant', metavar='<quadrant>',
+                        dest='quadrant', action='store', default=None,
+                        choices=['upper-left', 'upper-right', 'lower-left', 'lower-right'],
+                        help='only droplets centered in this quadrant of the frame')
+    group2.add_argument('--region', metavar='<x0,y0,x1,y1>',
+                        dest='region', action='store', default=None,
+                        help='only droplets centered in this rectangle, in pixels')
+    group2.add_argument('-q', '--quiet', # Note reversed flag.
+                        dest='VERBOSE', action='store_false', default=True,
+                        help='suppress console window output other than results')
+
+    # fmt: on
+
+    return parser.parse_args(args)
+
+
+def get_inspect_options(args):
+    # construct the argument parser for "dva inspect", and parse the arguments
+
+    parser = argparse.ArgumentParser(
+        prog='dva inspect',
+        description="Print the tracker's distance and similarity tables and match decisions for an analyzed video file's frames.",
+    )
+
+    # fmt: off
+    group0 = parser.add_argument_group('Input/Output')
+
+    group0.add_argument('video_file', metavar='<file name>',
+                        help='analyzed video file, either absolute or relative path')
+    group0.add_argument('-o', '--output-dir', metavar='<output directory>',
+                        dest='output_directory', action='store', default=None,
+                        help='directory holding the tracker diagnostics for the file (optional; default is "output" in video source dir)')
+
+    group1 = parser.add_argument_group('Frames')
+
+    group1.add_argument('--from', metavar='<time code>',
+                        dest='from_timecode', action='store', default=None,
+                        help='first time code to print, HH:MM:SS[:FF], or a 0-based frame number')
+    group1.add_argument('--to', metavar='<time code>',
+                        dest='to_timecode', action='store', default=None,
+                        help='time code to stop at (not included), HH:MM:SS[:FF], or a 0-based frame number')
+    group1.add_argument('--all-frames',
+                        dest='ALL_FRAMES', action='store_true', default=False,
+                        help='print frames where the tracker had nothing to compare, too')
+
+    # fmt: on
+
+    return parser.parse_args(args)
+
+
+def get_sweep_options(args):
+    # construct the argument parser for "dva sweep", and parse the arguments
+
+    parser = argparse.ArgumentParser(
+        prog='dva sweep',
+        description='Track a video file with every combination of tracker settings, from its scan cache, and compare the results.',
+    )
+
+    # fmt: off
+    group0 = parser.add_argument_group('Input/Output')
+
+    group0.add_argument('video_file', metavar='<file name>',
+                        help='video file to sweep, either absolute or relative path')
+    group0.add_argument('-o', '--output-dir', metavar='<output directory>',
+                        dest='output_directory', action='store', default=None,
+                        help='directory holding the scan cache for the file (optional; default is "output" in video source dir)')
+    group0.add_argument('--csv', metavar='<csv file>',
+                        dest='csv_file', action='store', default=None,
+                        help='also write results to a .csv file')
+
+    group1 = parser.add_argument_group('Droplet Detection')
+
+    group1.add_argument('-t', '--threshold', metavar='<detection threshold>',
+                        dest='threshold', type=int, action='store', default=62,
+                        help='droplet detection threshold; default=62')
+    group1.add_argument('-b', '--border', metavar='<border width>',
+                        dest='border', type=int, action='store', default=20,
+                        help='width of border region of frame to ignore, in pixels; default=20')
+
+    group2 = parser.add_argument_group('Tracker Settings to Sweep')
+
+    group2.add_argument('--droplet-similarity', metavar='<comma-separated thresholds>',
+                        dest='droplet_similarity', action='store', default='30',
+                        help='droplet similarity thresholds to try; default=30')
+    group2.add_argument('--distance-threshold', metavar='<comma-separated thresholds>',
+                        dest='distance_threshold', action='store', default='40',
+                        help='absolute distance thresholds to try; default=40')
+    group2.add_argument('--frame-history', metavar='<comma-separated frame counts>',
+                        dest='frame_history', action='store', default='1',
+                        help='frame histories to try; default=1')
+
+    group3 = parser.add_argument_group('Fixed Tracker Settings')
+
+    group3.add_argument('--assignment', metavar='<engine>',
+                        dest='assignment', action='store', default='greedy',
+                        choices=['greedy', 'optimal'],
+                        help='how to match droplets to prior droplets: greedy or optimal; default=greedy')
+    group3.add_argument('--motion-model', metavar='<model>',
+                        dest='motion_model', action='store', default='none',
+                        choices=['none', 'alpha-beta'],
+                        help='predict where prior droplets have moved to: none or alpha-beta; default=none')
+    group3.add_argument('--prediction-radius', metavar='<pixels>',
+                        dest='prediction_radius', type=int, action='store', default=10,
+                        help='with a motion model, distance from a moving droplet\'s predicted position to look for it; default=10')
+    group3.add_argument('--max-frame-droplets', metavar='<droplet count>',
+                        dest='max_frame_droplets', type=int, action='store', default=0,
+                        help='raw droplet count above which a frame is treated as pathological; 0 turns the check off; default=0')
+    group3.add_argument('--pathological-frames', metavar='<policy>',
+                        dest='pathological_frame_policy', action='store', default='skip-tracking',
+                        choices=['cluster-labels', 'skip-tracking', 'mark-anomalous'],
+                        help='how to handle pathological frames: cluster-labels, skip-tracking or mark-anomalous; default=skip-tracking')
+
+    group4 = parser.add_argument_group('Advanced')
+
+    group4.add_argument('-j', '--jobs', metavar='<job count>',
+                        dest='jobs', type=int, action='store', default=os.cpu_count() or 1,
+                        help='number of combinations to track at the same time, each in its own process; default=number of CPUs')
+    group4.add_argument('-q', '--quiet', # Note reversed flag.
+                        dest='VERBOSE', action='store_false', default=True,
+                        help='suppress console window output other than results')
+
+    # fmt: on
+
+    return parser.parse_args(args)
@@ -23,6 +23,7 @@ import cv2
 from config.common import dark_green, medium_gray, orange
 from utils.common import ess
 from frame.Frame import frames2timecode
+from frame.Overlay import Overlay
 
 
 def add_frame_header_text(
@@ -39,138 +40,147 @@ def add_frame_header_text(
     history,
     similarity,
     distance,
+    overlay=None,
 ):
+    """
+    Add the file name, frame number, droplet counts and settings to a frame.
+
+    :param display_frame: np video frame
+    :param overlay: optional Overlay for the lines that are the same on every
+                    frame, the file name and the settings, to draw them once
+    :return: np video frame
+    """
+
+    # (text, font scale, baselines of space above it, same on every frame)
+    lines = (
+        ("{}".format(video_file_name_base), 2, 0, True),
+        (
+            "Frame {} of {} ({})".format(
+                display_frame_number,
+                total_frame_count,
+                frames2timecode(display_frame_number - 1),
+            ),
+            2,
+            1,
+            False,
+        ),
+        (
+            "Frame: {} new droplet{}, {} pixel{}".format(
+                frame_droplets, ess(frame_droplets), frame_area, ess(frame_area)
+            ),
+            1,
+            1,
+            False,
+        ),
+        (
+            "Total: {} unique droplet{}, {} pixel{} ({} raw droplet{})".format(
+                total_droplets,
+                ess(total_droplets),
+                total_area,
+                ess(total_area),
+                video_total_unprocessed_droplet_count,
+                ess(video_total_unprocessed_droplet_count),
+            ),
+            1,
+            1,
+            False,
+        ),
+        ("Brightness threshold: {}/255".format(threshold), 1, 2, True),
+        (
+            "Similarity threshold: {}, frame memory {}".format(similarity, history),
+            1,
+            1,
+            True,
+        ),
+        (
+            "Distance threshold: less than or equal to {} pixels".format(distance),
+            1,
+            1,
+            True,
+        ),
+    )
+
+    # The lines that don't change go into the overlay, when the settings change.
+    settings = (video_file_name_base, threshold, history, similarity, distance)
+    if overlay is None:
+        settings_canvas = display_frame
+    elif overlay.stale(display_frame.shape, settings):
+        overlay.clear(display_frame.shape, settings)
+        settings_canvas = overlay
+    else:
+        settings_canvas = None
 
     (text_x, text_y) = (50, 50)
-    text_string = "{}".format(video_file_name_base)
-    ((width, height), baseline) = cv2.getTextSize(
-        text_string, cv2.FONT_HERSHEY_PLAIN, 2, 1
-    )
-    cv2.putText(
-        display_frame,
-        text_string,
-        (text_x, text_y),
-        fontFace=cv2.FONT_HERSHEY_PLAIN,
-        fontScale=2,
-        thickness=1,
-        color=dark_green,
-    )
+    baseline = 0
+    for line_number, (text_string, font_scale, leading, SETTING) in enumerate(lines):
+        ((width, height), next_baseline) = cv2.getTextSize(
+            text_string, cv2.FONT_HERSHEY_PLAIN, font_scale, 1
+        )
+        if line_number:
+            text_y += baseline * leading + height
+        baseline = next_baseline
 
-    text_y += baseline
-    text_string = "Frame {} of {} ({})".format(
-        display_frame_number,
-        total_frame_count,
-        frames2timecode(display_frame_number - 1),
-    )
-    ((width, height), baseline) = cv2.getTextSize(
-        text_string, cv2.FONT_HERSHEY_PLAIN, 2, 1
-    )
-    text_y += height
-    cv2.putText(
-        display_frame,
-        text_string,
-        (text_x, text_y),
-        fontFace=cv2.FONT_HERSHEY_PLAIN,
-        fontScale=2,
-        thickness=1,
-        color=dark_green,
-    )
+        canvas = settings_canvas if SETTING else display_frame
+        if canvas is not None:
+            _put_text(canvas, text_string, (text_x, text_y), font_scale, dark_green)
 
-    text_y += baseline
-    text_string = "Frame: {} new droplet{}, {} pixel{}".format(
-        frame_droplets, ess(frame_droplets), frame_area, ess(frame_area)
-    )
-    ((width, height), baseline) = cv2.getTextSize(
-        text_string, cv2.FONT_HERSHEY_PLAIN, 1, 1
-    )
-    text_y += height
-    cv2.putText(
-        display_frame,
-        text_string,
-        (text_x, text_y),
-        fontFace=cv2.FONT_HERSHEY_PLAIN,
-        fontScale=1,
-        thickness=1,
-        color=dark_green,
-    )
+    if overlay is not None:
+        overlay.composite(display_frame)
 
-    text_y += baseline
-    text_string = "Total: {} unique droplet{}, {} pixel{} ({} raw droplet{})".format(
-        total_droplets,
-        ess(total_droplets),
-        total_area,
-        ess(total_area),
-        video_total_unprocessed_droplet_count,
-        ess(video_total_unprocessed_droplet_count),
-    )
-    ((width, height), baseline) = cv2.getTextSize(
-        text_string, cv2.FONT_HERSHEY_PLAIN, 1, 1
-    )
-    text_y += height
-    cv2.putText(
-        display_frame,
-        text_string,
-        (text_x, text_y),
-        fontFace=cv2.FONT_HERSHEY_PLAIN,
-        fontScale=1,
-        thickness=1,
-        color=dark_green,
-    )
+    return display_frame
 
-    text_y += baseline * 2
-    text_string = "Brightness threshold: {}/255".format(threshold)
-    ((width, height), baseline) = cv2.getTextSize(
-        text_string, cv2.FONT_HERSHEY_PLAIN, 1, 1
-    )
-    text_y += height
-    cv2.putText(
-        display_frame,
-        text_string,
-        (text_x, text_y),
-        fontFace=cv2.FONT_HERSHEY_PLAIN,
-        fontScale=1,
-        thickness=1,
-        color=dark_green,
-    )
 
-    text_y += baseline
-    text_string = "Similarity threshold: {}, frame memory {}".format(
-        similarity, history
-    )
-    ((width, height), baseline) = cv2.getTextSize(
-        text_string, cv2.FONT_HERSHEY_PLAIN, 1, 1
-    )
-    text_y += height
-    cv2.putText(
-        display_frame,
-        text_string,
-        (text_x, text_y),
-        fontFace=cv2.FONT_HERSHEY_PLAIN,
-        fontScale=1,
-        thickness=1,
-        color=dark_green,
-    )
+def add_degraded_frame_text(display_frame, policy, raw_droplet_count):
+    """
+    Mark a frame that was handled by the pathological frame guard.
+
+    :param display_frame: np video frame
+    :param policy: str degradation policy applied to the frame
+    :param raw_droplet_count: int raw droplets found in the frame
+    :return: np video frame
+    """
+
+    descriptions = {
+        "cluster-labels": "labels clustered",
+        "skip-tracking": "tracking skipped",
+        "mark-anomalous": "anomalous frame, not counted",
+    }
 
-    text_y += baseline
-    text_string = "Distance threshold: less than or equal to {} pixels".format(distance)
-    ((width, height), baseline) = cv2.getTextSize(
-        text_string, cv2.FONT_HERSHEY_PLAIN, 1, 1
+    (text_x, text_y) = (1200, 50)
+    text_string = "{} raw droplet{}: {}".format(
+        raw_droplet_count, ess(raw_droplet_count), descriptions[policy]
     )
-    text_y += height
     cv2.putText(
         display_frame,
         text_string,
         (text_x, text_y),
         fontFace=cv2.FONT_HERSHEY_PLAIN,
-        fontScale=1,
+        fontScale=2,
         thickness=1,
-        color=dark_green,
+        color=orange,
     )
 
     return display_frame
 
 
-def add_ui_prompt(display_frame, INTERACTIVE=False, BACK_DISABLED=False):
+def add_ui_prompt(display_frame, INTERACTIVE=False, BACK_DISABLED=False, overlay=None):
+    """
+    Add the keyboard prompt to a displayed frame.
+
+    :param display_frame: np video frame
+    :param INTERACTIVE: flag for interactive video display
+    :param BACK_DISABLED: flag for going backwards being disabled
+    :param overlay: optional Overlay to draw the prompt in once
+    :return: np video frame
+    """
+
+    if overlay is None:
+        canvas = display_frame
+    elif overlay.stale(display_frame.shape, (INTERACTIVE, BACK_DISABLED)):
+        overlay.clear(display_frame.shape, (INTERACTIVE, BACK_DISABLED))
+        canvas = overlay
+    else:
+        return overlay.composite(display_frame)
 
     (text_x, text_y) = (50, 1050)
     if INTERACTIVE:
@@ -180,27 +190,30 @@ def add_ui_prompt(display_frame, INTERACTIVE=False, BACK_DISABLED=False):
         # so all they can do is quit.
         text_string = "esc or 'q' to quit"
 
-    cv2.putText(
-        display_frame,
-        text_string,
-        (text_x, text_y),
-        fontFace=cv2.FONT_HERSHEY_PLAIN,
-        fontScale=1,
-        thickness=1,
-        color=medium_gray,
-    )
+    _put_text(canvas, text_string, (text_x, text_y), 1, medium_gray)
 
     if BACK_DISABLED and INTERACTIVE:
         (text_x, text_y) = (1400, 1050)
         text_string = 'Creating video file or .csv: going backwards is disabled.'
+        _put_text(canvas, text_string, (text_x, text_y), 1, orange)
+
+    if overlay is not None:
+        overlay.composite(display_frame)
+
+    return display_frame
+
+
+def _put_text(canvas, text_string, xy, font_scale, color):
+    # Text on a frame, or in an Overlay.
+    if isinstance(canvas, Overlay):
+        canvas.put_text(text_string, xy, font_scale, color)
+    else:
         cv2.putText(
-            display_frame,
+            canvas,
             text_string,
-            (text_x, text_y),
+            xy,
             fontFace=cv2.FONT_HERSHEY_PLAIN,
-            fontScale=1,
+            fontScale=font_scale,
             thickness=1,
-            color=orange,
+            color=color,
         )
-
-    return display_frame
@@ -0,0 +1,98 @@
+# Copyright (c) 2020 Fredrick Levine
+# rick@xoab.us
+#
+# This file is part of Droplet Video Analyzer
+# https://github.com/rlevine/droplet_video_analyzer
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+###
+
+import sys
+from math import log10
+import cv2
+import numpy as np
+
+"""
+
+Shape similarity from cached Hu moments.
+
+The tracker compares droplet shapes with
+
+    abs(log_transform(cv2.matchShapes(a, b, cv2.CONTOURS_MATCH_I2, 0)))
+
+matchShapes works out the Hu moments of both contours on every call, and the tracker
+compares each history droplet against new ones for as many frames as it stays in
+history. Here, each contour's Hu moments are log-transformed once, by
+log_hu_moments(), when the contour is stored, and shape_similarity() does the
+matchShapes arithmetic on the cached vectors, for any number of pairs at once.
+
+The results are bit-for-bit the same as matchShapes. To match it, the logs are taken
+with the C library's log10 (math.log10), not NumPy's. NumPy's SIMD log10 differs in
+the last bit often enough to change a borderline tracking decision.
+
+"""
+
+# matchShapes ignores moments this small.
+HU_EPSILON = 1.0e-5
+
+
+def log_hu_moments(moments):
+    """
+    Log-transform the Hu moments of a contour, as matchShapes does.
+
+    :param moments: dict of contour moments, from cv2.moments()
+    :return: (np array of 7 signed log10 Hu moments, NaN for moments too small
+             to compare; bool True if any Hu moment is nonzero)
+    """
+    hu_moments = cv2.HuMoments(moments).ravel().tolist()
+    log_hu = [
+        (1 if hu > 0 else -1) * log10(abs(hu)) if abs(hu) > HU_EPSILON else np.nan
+        for hu in hu_moments
+    ]
+    return np.array(log_hu), any(hu != 0 for hu in hu_moments)
+
+
+def shape_similarity(log_hu_a, nonzero_a, log_hu_b, nonzero_b):
+    """
+    Shape similarity scores from cached Hu moments; smaller is more similar.
+
+    Arguments broadcast against each other, so this compares pairs of contours, or
+    one contour against many.
+
+    :param log_hu_a: np (..., 7) array from log_hu_moments()
+    :param nonzero_a: np bool array, the matching nonzero flags
+    :param log_hu_b: np (..., 7) array from log_hu_moments()
+    :param nonzero_b: np bool array, the matching nonzero flags
+    :return: np float array of scores
+    """
+    # CONTOURS_MATCH_I2: the sum of the differences of the log moments, skipping
+    # moments too small in either contour. Summed in order, as matchShapes does.
+    raw_similarity = np.zeros(np.broadcast(nonzero_a, nonzero_b).shape)
+    for moment in range(7):
+        difference = np.abs(log_hu_b[..., moment] - log_hu_a[..., moment])
+        raw_similarity = raw_similarity + np.where(
+            np.isnan(difference), 0.0, difference
+        )
+    # A contour with no moments at all doesn't match one that has some.
+    raw_similarity[nonzero_a != nonzero_b] = sys.float_info.max
+
+    # abs(log_transform(raw)): log_transform() turns 0 into 999.
+    similarity = np.array(
+        [abs(log10(raw)) if raw else 999.0 for raw in raw_similarity.ravel().tolist()]
+    ).reshape(raw_similarity.shape)
+
+    # Edge case, close to 308.25 from float; too few pixels for moments to work.
+    similarity[(similarity > 308.0) & (similarity < 308.5)] = 0.5  # SWAG
+
+    return similarity
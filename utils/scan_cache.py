@@ -0,0 +1,167 @@
+# Copyright (c) 2020 Fredrick Levine
+# rick@xoab.us
+#
+# This file is part of Droplet Video Analyzer
+# https://github.com/rlevine/droplet_video_analyzer
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+###
+
+import hashlib
+import os
+import tempfile
+import zipfile
+import numpy as np
+
+from droplet.DropletStore import DETECTION_DTYPE
+from droplet.DropletStore import DropletStore
+
+"""
+
+On-disk cache for the initial scan of a video file.
+
+The scan only depends on the video file's contents and the threshold and border
+settings. Tracker settings (--droplet-similarity, --distance-threshold,
+--frame-history) and output options don't change it, so a run that only changes
+those can load the scan instead of thresholding every frame again.
+
+A cache file is a .npz of the DropletStore arrays and the per-frame scan times. Its
+name is a hash of:
+
+    - the video file's size, and sampled chunks of its contents
+    - threshold and border width
+    - SCAN_CACHE_VERSION and the detection row layout
+
+Bump SCAN_CACHE_VERSION whenever a change to the scan would change its results.
+
+"""
+
+SCAN_CACHE_VERSION = 1
+
+# Bytes read from the start, middle and end of a video file for its hash.
+SAMPLE_SIZE = 1 << 20
+
+
+def scan_cache_key(file_path, threshold, border_width):
+    """
+    Return the cache key for a scan of a video file.
+
+    Hashing a whole multi-gigabyte video would take longer than some scans, so
+    only the size and three sampled chunks of the file go into the hash.
+
+    :param file_path: str absolute path to video file
+    :param threshold: int image brightness threshold
+    :param border_width: int pixel width of border to ignore
+    :return: str hex digest
+    """
+    file_size = os.path.getsize(file_path)
+
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(
+        "{}|{}|{}|{}|{}".format(
+            SCAN_CACHE_VERSION,
+            DETECTION_DTYPE.descr,
+            file_size,
+            threshold,
+            border_width,
+        ).encode()
+    )
+
+    with open(file_path, "rb") as video_file:
+        for offset in (0, (file_size - SAMPLE_SIZE) // 2, file_size - SAMPLE_SIZE):
+            video_file.seek(max(offset, 0))
+            digest.update(video_file.read(SAMPLE_SIZE))
+
+    return digest.hexdigest()
+
+
+def scan_cache_path(cache_dir, file_path, threshold, border_width):
+    """
+    Return the cache file path for a scan of a video file.
+
+    :param cache_dir: str directory holding cache files
+    :param file_path: str absolute path to video file
+    :param threshold: int image brightness threshold
+    :param border_width: int pixel width of border to ignore
+    :return: str absolute file path
+    """
+    video_filename_root = os.path.splitext(os.path.basename(file_path))[0]
+    return os.path.join(
+        cache_dir,
+        "{}_scan_{}.npz".format(
+            video_filename_root, scan_cache_key(file_path, threshold, border_width)
+        ),
+    )
+
+
+def save_scan(cache_file_path, store, scan_seconds_by_frame):
+    """
+    Save a scan to the cache.
+
+    The file is written under a temporary name and moved into place, so a
+    concurrent run never sees half a cache file.
+
+    :param cache_file_path: str absolute file path, from scan_cache_path()
+    :param store: DropletStore straight from a scan
+    :param scan_seconds_by_frame: list of float seconds spent scanning each frame
+    """
+    cache_dir = os.path.dirname(cache_file_path)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    file_descriptor, temp_file_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    try:
+        with os.fdopen(file_descriptor, "wb") as cache_file:
+            np.savez(
+                cache_file,
+                scan_seconds_by_frame=np.asarray(
+                    scan_seconds_by_frame, dtype=np.float64
+                ),
+                **store.to_arrays()
+            )
+        os.replace(temp_file_path, cache_file_path)
+    except BaseException:
+        os.remove(temp_file_path)
+        raise
+
+
+def load_scan(cache_file_path, spill_dir=None):
+    """
+    Load a scan from the cache.
+
+    :param cache_file_path: str absolute file path, from scan_cache_path()
+    :param spill_dir: str directory for a streaming mode store, or None
+    :return: (DropletStore, list of float scan seconds by frame), or None if there's
+             no usable cache file
+    """
+    if not os.path.exists(cache_file_path):
+        return None
+
+    try:
+        # Opened as the zip file it is, so the rows and points can be read into
+        # the store a chunk at a time, instead of loaded whole and then copied.
+        with zipfile.ZipFile(cache_file_path) as cache:
+            with cache.open("frame_starts.npy") as npy_file:
+                frame_starts = np.lib.format.read_array(npy_file)
+            with cache.open("scan_seconds_by_frame.npy") as npy_file:
+                scan_seconds_by_frame = np.lib.format.read_array(npy_file).tolist()
+            with cache.open("rows.npy") as rows_file:
+                with cache.open("points.npy") as points_file:
+                    store = DropletStore.from_npy_files(
+                        rows_file, points_file, frame_starts, spill_dir=spill_dir
+                    )
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        # Unreadable or out of date; scan the file again.
+        return None
+
+    return store, scan_seconds_by_frame
@@ -0,0 +1,381 @@
+# Copyright (c) 2020 Fredrick Levine
+# rick@xoab.us
+#
+# This file is part of Droplet Video Analyzer
+# https://github.com/rlevine/droplet_video_analyzer
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+###
+
+import time
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from frame.FrameGuard import FrameGuard
+from tracker.CorrectionIndex import CorrectionIndex
+from tracker.Tracker import Tracker
+from utils.common import ess
+from utils.common import printc
+
+"""
+
+Tracking a whole video file ahead of rendering, in segments, on a process pool.
+
+The tracker forgets a droplet frames_before_deregister frames after it was last
+seen. After that many frames in a row without any droplets for the tracker (no
+detections, or a pathological frame it skips), its history is empty, and it
+starts the next frame exactly as a new tracker would. Those gaps split a file
+into segments that can be tracked independently, in any order, each with its
+own tracker.
+
+Each worker process loads the file's scan from the scan cache once, and tracks
+whole segments, grouped into chunks of about the same number of detections. The
+chunks' results are stitched back together, frame by frame, into one track record,
+identical to the one tracking the file frame by frame would make. The frame
+processor then replays the record while it renders (tracker/TrackReplayer.py).
+
+A worker's droplet store only has its own segments' relocations, but nothing
+the tracker decides depends on another segment's relocations, even for
+corrections that connect droplets across a gap. Only the id a relocation gives
+its sighting does: it's the id of the root row, and a correction can name a
+droplet that an earlier segment made a later sighting of another. The ids are
+put right as the chunks are stitched together (_stitch_ids()).
+
+For the same reason, when only the corrections have changed since the file's last
+analysis, only the segments with changed corrections need tracking again; the
+rest of the new track record is copied from the last one.
+
+"""
+
+# Chunks of segments per worker process, so a slow chunk doesn't hold up the rest.
+CHUNKS_PER_JOB = 4
+
+# The scan and tracker settings, loaded once per worker process by _load_scan().
+_segment_tracking = {}
+
+
+def skipped_frames(droplet_counts_by_frame, max_frame_droplets, policy):
+    """
+    Return the frames the frame guard will keep from the tracker.
+
+    :param droplet_counts_by_frame: list of raw droplet counts, by frame
+    :param max_frame_droplets: int raw droplet count for pathological frames
+    :param policy: str FrameGuard policy
+    :return: set of int frame numbers
+    """
+    frame_guard = FrameGuard(max_frame_droplets, policy)
+    return {
+        frame_id
+        for frame_id, droplet_count in enumerate(droplet_counts_by_frame)
+        if frame_guard.check(droplet_count) in ("skip-tracking", "mark-anomalous")
+    }
+
+
+def find_segments(droplet_counts_by_frame, frames_before_deregister, skipped=()):
+    """
+    Split a file into segments that can be tracked independently.
+
+    A segment starts at a frame with droplets for the tracker when there were none
+    in the frames_before_deregister frames before it.
+
+    :param droplet_counts_by_frame: list of raw droplet counts, by frame
+    :param frames_before_deregister: int frames the tracker keeps history for
+    :param skipped: frame numbers whose droplets the tracker doesn't see
+    :return: list of (start, stop) frame ranges, covering every frame
+    """
+    tracked = np.asarray(droplet_counts_by_frame, dtype=np.int64) > 0
+    tracked[list(skipped)] = False
+    tracked_frames = np.flatnonzero(tracked)
+
+    gaps = np.diff(tracked_frames) > frames_before_deregister
+    starts = [0] + tracked_frames[1:][gaps].tolist()
+    stops = starts[1:] + [len(tracked)]
+
+    return list(zip(starts, stops))
+
+
+def chunk_segments(segments, droplet_counts_by_frame, chunk_count):
+    """
+    Group consecutive segments into about chunk_count chunks with about the same
+    number of detections each.
+
+    :param segments: list of (start, stop) frame ranges, from find_segments()
+    :param droplet_counts_by_frame: list of raw droplet counts, by frame
+    :param chunk_count: int number of chunks wanted
+    :return: list of (start, stop) frame ranges
+    """
+    frame_starts = np.concatenate(([0], np.cumsum(droplet_counts_by_frame)))
+    target = frame_starts[-1] / max(chunk_count, 1)
+
+    chunks = []
+    chunk_start = None
+    for start, stop in segments:
+        if chunk_start is None:
+            chunk_start = start
+        if frame_starts[stop] - frame_starts[chunk_start] >= target:
+            chunks.append((chunk_start, stop))
+            chunk_start = None
+    if chunk_start is not None:
+        chunks.append((chunk_start, segments[-1][1]))
+
+    return chunks
+
+
+def track_ahead(
+    track_record,
+    video_master,
+    jobs,
+    tracker_settings,
+    max_frame_droplets=None,
+    pathological_frame_policy="skip-tracking",
+    VERBOSE=False,
+):
+    """
+    Track a whole file, segment by segment on a process pool, into a track record.
+
+    :param track_record: empty TrackRecord to fill in
+    :param video_master: VideoFilePreprocessor, with its scan in the scan cache
+    :param jobs: int number of worker processes
+    :param tracker_settings: dict of Tracker keyword arguments
+    :param max_frame_droplets: int raw droplet count for pathological frames
+    :param pathological_frame_policy: str FrameGuard policy
+    :param VERBOSE: verbose flag
+    """
+    start_time = time.perf_counter()
+
+    droplet_counts_by_frame = video_master.droplet_counts_by_frame
+    skipped = skipped_frames(
+        droplet_counts_by_frame, max_frame_droplets, pathological_frame_policy
+    )
+    segments = find_segments(
+        droplet_counts_by_frame, tracker_settings["frames_before_deregister"], skipped
+    )
+    chunks = chunk_segments(segments, droplet_counts_by_frame, jobs * CHUNKS_PER_JOB)
+    row_ids = video_master.droplet_store.column("initial_id").copy()
+
+    with ProcessPoolExecutor(
+        max_workers=min(jobs, len(chunks)),
+        initializer=_load_scan,
+        initargs=(
+            video_master.video_file_path,
+            video_master.threshold,
+            video_master.border_width,
+            video_master.cache_dir,
+            tracker_settings,
+            skipped,
+        ),
+    ) as executor:
+        for chunk, tracked in zip(chunks, executor.map(_track_chunk, chunks)):
+            _record_frames(track_record, chunk, tracked, row_ids)
+
+    if VERBOSE:
+        printc(
+            "Tracked {} frames in {} segments on {} processes in {:.2f} seconds.\n".format(
+                len(droplet_counts_by_frame),
+                len(segments),
+                min(jobs, len(chunks)),
+                time.perf_counter() - start_time,
+            ),
+            "yellow",
+        )
+
+
+def retrack_corrections(
+    track_record,
+    previous_track_record,
+    video_master,
+    tracker_settings,
+    max_frame_droplets=None,
+    pathological_frame_policy="skip-tracking",
+    VERBOSE=False,
+):
+    """
+    Track again only the segments whose corrections have changed since a file's
+    last analysis, and copy the rest from its track record.
+
+    :param track_record: empty TrackRecord to fill in
+    :param previous_track_record: complete TrackRecord from the last analysis,
+                                  with the same scan and tracker settings
+    :param video_master: VideoFilePreprocessor
+    :param tracker_settings: dict of Tracker keyword arguments
+    :param max_frame_droplets: int raw droplet count for pathological frames
+    :param pathological_frame_policy: str FrameGuard policy
+    :param VERBOSE: verbose flag
+    """
+    start_time = time.perf_counter()
+    store = video_master.droplet_store
+
+    droplet_corrections = tracker_settings["droplet_corrections"]
+    if not isinstance(droplet_corrections, CorrectionIndex):
+        droplet_corrections = CorrectionIndex(droplet_corrections, store)
+    changed_frames = droplet_corrections.changed_frames(
+        previous_track_record.corrections, store
+    )
+
+    droplet_counts_by_frame = video_master.droplet_counts_by_frame
+    skipped = skipped_frames(
+        droplet_counts_by_frame, max_frame_droplets, pathological_frame_policy
+    )
+    segments = find_segments(
+        droplet_counts_by_frame, tracker_settings["frames_before_deregister"], skipped
+    )
+    segment_starts = [start for start, _ in segments]
+    changed_segments = {
+        bisect_right(segment_starts, frame_id) - 1 for frame_id in changed_frames
+    }
+
+    tracker_settings = dict(tracker_settings, droplet_corrections=droplet_corrections)
+    row_ids = store.column("initial_id").copy()
+    for i, (start, stop) in enumerate(segments):
+        if i in changed_segments:
+            _record_frames(
+                track_record,
+                (start, stop),
+                track_frames(video_master, tracker_settings, skipped, start, stop),
+                row_ids,
+            )
+        else:
+            # The ids can still change, with a correction in an earlier segment.
+            for frame_id in range(start, stop):
+                ids, relocations = previous_track_record.frame(frame_id)
+                track_record.record_frame(
+                    frame_id, ids, _stitch_ids(relocations, row_ids)
+                )
+
+    if VERBOSE:
+        printc(
+            "Corrections changed in {} frame{}: tracked {} of {} segments again in {:.2f} seconds.\n".format(
+                len(changed_frames),
+                ess(len(changed_frames)),
+                len(changed_segments),
+                len(segments),
+                time.perf_counter() - start_time,
+            ),
+            "yellow",
+        )
+
+
+def track_frames(video_master, tracker_settings, skipped, start, stop):
+    """
+    Track a range of frames with a new tracker, the way VideoFrameProcessor
+    would, frame by frame. The droplet store is left as it was.
+
+    :param video_master: VideoFilePreprocessor
+    :param tracker_settings: dict of Tracker keyword arguments
+    :param skipped: frame numbers whose droplets the tracker doesn't see
+    :param start: int first frame
+    :param stop: int frame after the last
+    :return: (ids, id counts by frame, relocations, relocation counts by frame),
+             as np arrays
+    """
+    store = video_master.droplet_store
+    first_relocation = relocation_count = store.relocation_count
+
+    tracker = Tracker(droplet_master=video_master, VERBOSE=False, **tracker_settings)
+
+    ids = []
+    id_counts = []
+    relocation_counts = []
+    for frame_id in range(start, stop):
+        droplets = video_master.frames[frame_id].droplets
+        if frame_id in skipped:
+            tracker.skip_frame(this_frame=frame_id)
+            winnowed_droplets = droplets
+        else:
+            winnowed_droplets = tracker.update(
+                new_droplet_dict=droplets, this_frame=frame_id
+            )
+        ids.extend(winnowed_droplets)
+        id_counts.append(len(winnowed_droplets))
+        relocation_counts.append(store.relocation_count - relocation_count)
+        relocation_count = store.relocation_count
+
+    relocations = store.relocations(first_relocation)
+    store.undo_relocations(first_relocation)
+
+    return (
+        np.asarray(ids, dtype=np.int64),
+        id_counts,
+        relocations.reshape(-1, 3),
+        relocation_counts,
+    )
+
+
+def _record_frames(track_record, chunk, tracked, row_ids):
+    # Add a tracked range of frames to a track record, frame by frame.
+    start, stop = chunk
+    ids, id_counts, relocations, relocation_counts = tracked
+    relocations = _stitch_ids(relocations, row_ids)
+    id_starts = np.concatenate(([0], np.cumsum(id_counts)))
+    relocation_starts = np.concatenate(([0], np.cumsum(relocation_counts)))
+    for i, frame_id in enumerate(range(start, stop)):
+        track_record.record_frame(
+            frame_id,
+            ids[id_starts[i] : id_starts[i + 1]],
+            relocations[relocation_starts[i] : relocation_starts[i + 1]],
+        )
+
+
+def _stitch_ids(relocations, row_ids):
+    """
+    Give relocations the droplet ids tracking the file frame by frame would have.
+
+    A relocation gives its sighting the id of its root row. In a worker's store,
+    a root that an earlier segment relocated still has its initial id, so the
+    id comes from row_ids instead, the ids of all the rows after the relocations
+    recorded so far. A row is only relocated in its own frame, and is only a
+    root in later ones; chains of such corrections settle in a few passes.
+
+    :param relocations: np (N, 3) array of (root, destination row, droplet id),
+                        in order
+    :param row_ids: np array of droplet ids by row, updated in place
+    :return: np (N, 3) array of relocations
+    """
+    relocations = relocations.copy()
+    while True:
+        row_ids[relocations[:, 1]] = relocations[:, 2]
+        droplet_ids = row_ids[relocations[:, 0]]
+        if np.array_equal(droplet_ids, relocations[:, 2]):
+            return relocations
+        relocations[:, 2] = droplet_ids
+
+
+def _load_scan(
+    video_file_path, threshold, border, cache_dir, tracker_settings, skipped
+):
+    # Worker process set-up: load the scan from the cache, once.
+    from video.processors import VideoFilePreprocessor
+
+    _segment_tracking.update(
+        video_master=VideoFilePreprocessor(
+            video_file_path, threshold, border, cache_dir=cache_dir
+        ),
+        tracker_settings=tracker_settings,
+        skipped=skipped,
+    )
+
+
+def _track_chunk(chunk):
+    # Worker process: track a chunk of segments from the scan loaded by
+    # _load_scan().
+    start, stop = chunk
+    return track_frames(
+        _segment_tracking["video_master"],
+        _segment_tracking["tracker_settings"],
+        _segment_tracking["skipped"],
+        start,
+        stop,
+    )
@@ -21,8 +21,10 @@
 import sys
 import cv2
 import time
+import functools
 from PIL import Image
 from PIL import ImageDraw
+from PIL import ImageFont
 import numpy as np
 
 from config.common import bright_red, amber, white, black
@@ -72,11 +74,13 @@ def draw_text(
     np_image, xy, text, fill=(255, 2555, 255, 255), font=None, angle=0, antialias=True
 ):
     """
-    Use PIL image library to draw text on a numpy image.
-    Converts an opencv np image to a PIL canvas and back again.
+    Use PIL image library to draw text on a numpy image, in place.
+    The text is rendered once, into a small sprite that's kept for the next time the
+    same text is drawn (see _text_sprite()), and only the part of the image under the
+    sprite is composited.
     xy position is upper left corner of right-reading text
-    Function expects a BGR color, and it will be translated to RGB for drawing.
-    BGRA is acceptable for transparent text, 0-255 alpha range.
+    Function expects a BGR color. BGRA is acceptable for transparent text, 0-255 alpha
+    range.
 
     :param np_image: numpy image to which text will be added
     :param xy: origin xy tuple
@@ -89,109 +93,89 @@ def draw_text(
     :return: np image with added text, with the same number of channels as the input image
     """
 
-    width, height, depth = np_image.shape
-
-    # Add an alpha channel if the image doesn't have one
-    ALPHA_CHANNEL_ADDED = False
-    if depth == 3:
-        ALPHA_CHANNEL_ADDED = True
-        np_image = add_alpha_channel(np_image)
-
-    # Flip the color information to RGB.
-    # (This isn't really needed, as PIL will ignore the color order: it doesn't know
-    # that our color value_1_values are BGR. However, it makes debugging easier if I peek at
-    # an intermediate stage of the process and red is red. :)
-    np_image[:, :, [0, 1, 2]] = np_image[:, :, [2, 1, 0]]
-
-    # max_dimension = max(width, height)
-
     # Add alpha for full opacity to supplied color if it doesn't already have an alpha value.
     if len(fill) == 3:
-        BGRA_color = fill + (255,)
-    else:
-        BGRA_color = fill
+        fill = tuple(fill) + (255,)
 
-    # Flip the requested text fill color to RGBA as opencv uses BGRA.
-    (b, g, r, a) = BGRA_color
-    RGBA_color = (r, g, b, a)
+    sprite, (offset_x, offset_y) = _text_sprite(
+        str(text), font, tuple(fill), angle, antialias
+    )
 
-    # Make a PIL image from the supplied opencv image.
-    _imagepil = Image.fromarray(np_image)
+    # The part of the sprite that lands on the image.
+    height, width, depth = np_image.shape
+    left, top = xy[0] + offset_x, xy[1] + offset_y
+    right, bottom = left + sprite.width, top + sprite.height
+    if left >= width or top >= height or right <= 0 or bottom <= 0:
+        return np_image
+    crop = (max(-left, 0), max(-top, 0))
+    left, top = max(left, 0), max(top, 0)
+    right, bottom = min(right, width), min(bottom, height)
+    if crop != (0, 0) or (right - left, bottom - top) != sprite.size:
+        sprite = sprite.crop(crop + (crop[0] + right - left, crop[1] + bottom - top))
+
+    # Composite the text on top of the image, under the sprite only. PIL doesn't care
+    # that the channels are BGR, as long as the sprite's are too.
+    region = np_image[top:bottom, left:right]
+    if depth == 3:
+        base = np.dstack((region, np.full(region.shape[:2], 255, dtype=np.uint8)))
+    else:
+        base = np.ascontiguousarray(region)
+    composited_region = Image.alpha_composite(Image.fromarray(base, "RGBA"), sprite)
+    region[:] = np.asarray(composited_region)[:, :, :depth]
 
-    # base = Image.open(image.convert("RGBA")
+    return np_image
 
-    # Create a new image to draw text on.
-    text_image = Image.new("RGBA", _imagepil.size, (255, 255, 255, 0))
 
-    # build a transparency mask large enough to hold the text
-    # canvas_size = (max_dimension * 2, max_dimension * 2)
-    # text_canvas = Image.new("RGBA", pil_image.size, (0, 0, 0, 0))
+@functools.lru_cache(maxsize=512)
+def _text_sprite(text, font, fill, angle, antialias):
+    """
+    Render text into an image just big enough to hold it, rotated, and the offset of
+    its upper left corner from the text's xy position. Sprites are cached, as the same
+    labels are drawn on every frame.
 
-    # Create a drawing context on the PIL image...
-    draw = ImageDraw.Draw(text_image)
+    :param text: text to write
+    :param font: PIL ImageFont font
+    :param fill: BGRA color tuple
+    :param angle: rotation angle for text - only 90 degree increments right now
+    :param antialias: antialias flag, boolean
+    :return: (RGBA PIL image, holding BGRA color, (x, y) offset tuple)
+    """
+    if font is None:
+        font = ImageFont.load_default()
+    left, top, right, bottom = font.getbbox(text)
+
+    sprite = Image.new(
+        "RGBA", (max(right - left, 1), max(bottom - top, 1)), (255, 255, 255, 0)
+    )
+    draw = ImageDraw.Draw(sprite)
 
     # This is an undocumented hack in the PIL code to turn off font antialiasing.
     if not antialias:
         draw.fontmode = "1"
 
-    # .. and draw the text.
-    draw.text(xy, text, fill=RGBA_color, font=font)
-
-    if angle % 90 == 0:
-        # rotate by multiple of 90 deg is easier
-        text_image = text_image.rotate(angle, center=xy)
-    else:
-        # For now, we're just doing multiples of 90 degrees.
-        # To do odd angles, we'll need to scale up/scale down the text to smooth jaggies.
-        pass
-
-    # Notes here are random fodder for arbitrary rotation
-
-    # # rotate an an enlarged mask to minimize jaggies
-    # bigger_canvas = text_image.resize((max_dim*8, max_dim*8),
-    #                           resample=Image.BICUBIC)
-    # rotated_canvas = text_image.rotate(angle).resize(
-    #     canvas_size, resample=Image.LANCZOS)
-    #
-    # # crop the mask to match image
-    # canvas_xy = (max_dimension - xy[0], max_dimension - xy[1])
-    # bounding_box = canvas_xy + (canvas_xy[0] + width, canvas_xy[1] + height)
-    # canvas = rotated_canvas.crop(bounding_box)
-
-    # paste the appropriate color, with the text transparency mask
-    # color_image = Image.new('RGBA', (width, height), RGBA_color)
-    # pil_image.paste(canvas)
+    draw.text((-left, -top), text, fill=fill, font=font)
 
-    # Composite the text on top of the base image.
-    composited_image = Image.alpha_composite(_imagepil, text_image)
-
-    # composited_image.show() # Debug
-
-    # Back to a numpy image.
-    np_output_image = np.array(composited_image)
-
-    # Remove the alpha channel if we added one.
-    if ALPHA_CHANNEL_ADDED:
-        remove_alpha_channel(np_output_image)
-
-    # And flip RGB back to BGR
-    np_output_image[:, :, [0, 1, 2]] = np_output_image[:, :, [2, 1, 0]]
-    # Note that this preserves the alpha channel data, whereas
-    #   np_output_image = np_output_image[:,:,[2,1,0]]
-    # does not.
-
-    return np_output_image
+    # Rotated counterclockwise about xy, a pixel at a time, as Image.rotate() does it.
+    # For now, we're just doing multiples of 90 degrees.
+    # To do odd angles, we'll need to scale up/scale down the text to smooth jaggies.
+    if angle % 360 == 90:
+        return sprite.transpose(Image.ROTATE_90), (top, -right)
+    if angle % 360 == 180:
+        return sprite.transpose(Image.ROTATE_180), (-right, -bottom)
+    if angle % 360 == 270:
+        return sprite.transpose(Image.ROTATE_270), (-bottom, left)
+    return sprite, (left, top)
 
 
 def measure_text_size(np_image, text, font=None):
     """
-    Wrapper for PIL text size function.
+    Wrapper for PIL text size function: the width and height of text drawn at the
+    origin. The image isn't needed, and is only there for older callers.
     """
+    if font is None:
+        font = ImageFont.load_default()
 
-    pil_image = Image.fromarray(np_image)
-    draw = ImageDraw.Draw(pil_image)
-
-    return draw.textsize(str(text), font)
+    return font.getbbox(str(text))[2:]
 
 
 def threshold_and_find_droplets(frame, threshold, border_width=None, DROPLET_SCAN=True):
@@ -67,6 +67,8 @@ class FrameDispenser:
         # Buffer for processed frames returned from upstream.
         self._processed_buffer = None
         self._buffer_size = history_size
+        # Number of processed frames returned, one per frame read.
+        self._returned_frame_count = 0
 
         self.is_empty = None
 
@@ -194,11 +196,25 @@ class FrameDispenser:
         self.index_frame_number -= 1
         self.counting_frame_number -= 1
 
+    @property
+    def history_size(self):
+        return self._buffer_size
+
+    def raw_frame(self):
+        # The unprocessed frame at the current position, in history or not, for
+        # processing a frame again.
+        return self._raw_buffer[self.history_retrieval_point]
+
     def processed_frame_return(self, frame):
         # Used by upstream processor to add a processed
         # frame to be returned instead of a raw frame when
         # traversing history.
-        self._processed_buffer.append(frame)
+        if self.index_frame_number < self._returned_frame_count:
+            # A frame processed again replaces its earlier version.
+            self._processed_buffer[self.history_retrieval_point] = frame
+        else:
+            self._processed_buffer.append(frame)
+            self._returned_frame_count += 1
 
     def _make_hash_dict_entry(
         self, frame, sample_width=100, sample_height=100, center=True
@@ -18,36 +18,58 @@
 
 ###
 
-from collections import OrderedDict, defaultdict
+from collections import OrderedDict
 import time
 import cv2
 import numpy as np
-from math import trunc
 import os
 import re
 
 import config.common as config
-from droplet.Droplet import Droplet
-from frame.Frame import Frame
+from droplet.DropletStore import DropletStore
+from droplet.DropletStore import DropletIndex
+from droplet.DropletStore import FrameDropletIndex
+from droplet.DropletStore import AreaDropletIndex
+from droplet.DropletStore import FrameIndex
+from droplet.IdAllocator import IdAllocator
+from frame.FrameGuard import FrameGuard
 from frame.Labeler import Labeler
+from frame.Overlay import Overlay
 from utils.Csv import CsvFile
 from utils.frame_label import add_frame_header_text
+from utils.frame_label import add_degraded_frame_text
 from utils.video import remove_alpha_channel
 from utils.video import threshold_and_find_droplets
 from utils.video import calculate_fps
-from utils.video import add_alpha_channel
 from utils.ffmpeg_processing import get_normalized_audio_level_by_frame
+from utils.scan_cache import scan_cache_path
+from utils.scan_cache import load_scan
+from utils.scan_cache import save_scan
 from droplet_video_analyzer.parts import get_filename_from_path
 from utils.common import printc, ess
 from config.common import white
 from video.FrameDispenser import FrameDispenser
 from grapher.Grapher import Grapher
+from tracker.GlobalAssociator import GlobalAssociator
 from tracker.Tracker import Tracker
+from tracker.CorrectionIndex import CorrectionIndex
+from tracker.TrackRecord import TrackRecord
+from tracker.TrackerDiagnostics import TrackerDiagnostics
+from tracker.TrackReplayer import TrackReplayer
+from utils.segment_tracking import retrack_corrections
+from utils.segment_tracking import skipped_frames
+from utils.segment_tracking import track_ahead
 
 
 class VideoFilePreprocessor:
     def __init__(
-        self, file_path=None, threshold=None, border_width=None, VERBOSE=False
+        self,
+        file_path=None,
+        threshold=None,
+        border_width=None,
+        cache_dir=None,
+        spill_dir=None,
+        VERBOSE=False,
     ):
         """
         Video Preprocessor
@@ -81,6 +103,9 @@ class VideoFilePreprocessor:
         :param file_path: str absolute path to video file
         :param threshold: int image brightness threshold for
         :param border_width:
+        :param cache_dir: str directory for the scan cache; None to always scan
+        :param spill_dir: str directory for the droplet store's files in streaming
+                          mode; None keeps the store in RAM
         :param VERBOSE:
         """
 
@@ -91,6 +116,7 @@ class VideoFilePreprocessor:
 
         self._second_count = 0
         self.droplet_counts_by_frame = []
+        self.scan_seconds_by_frame = []
 
         # pixel width of border to ignore
         self.border_width = border_width
@@ -98,13 +124,24 @@ class VideoFilePreprocessor:
         self.threshold = threshold
         # absolute video file path
         self.video_file_path = file_path
+        # scan cache directory, see utils/scan_cache.py
+        self.cache_dir = cache_dir
+        # streaming mode droplet store directory, see droplet/DropletStore.py
+        self.spill_dir = spill_dir
+        self.droplet_store = None
 
         self.good_file = True
 
         self.VERBOSE = VERBOSE
 
-        # Scan the video file and collect frame and droplet info.
-        self.scan()
+        # Scan the video file and collect frame and droplet info. A scan that
+        # doesn't finish doesn't leave its streaming mode files behind.
+        try:
+            self.scan()
+        except BaseException:
+            if self.droplet_store is not None:
+                self.droplet_store.close()
+            raise
 
         # self._frame.key=Frame
 
@@ -116,29 +153,43 @@ class VideoFilePreprocessor:
     def frames(self):
         return self._frames
 
-    def _initialize_data(self):
-        # Frame and droplet data
-        self._frames = OrderedDict()
+    def _initialize_data(self, droplet_store=None):
+        # A rescan starts over with a new store.
+        if self.droplet_store is not None:
+            self.droplet_store.close()
+
+        # Columnar store for all droplet detections in the file.
+        if droplet_store is None:
+            droplet_store = DropletStore(spill_dir=self.spill_dir)
+        self.droplet_store = droplet_store
+
+        # Droplet ids for this file, numbered from 1 for every scan. Each video
+        # master has its own, so analyses in the same process don't collide.
+        self.id_allocator = IdAllocator(start=len(self.droplet_store) + 1)
 
-        # Master indices for droplet info
+        # Frame data, views over the store, made when they're asked for.
+        self._frames = FrameIndex(self.droplet_store)
+
+        # Master indices for droplet info, also views over the store.
         # Returns a droplet.
-        self.index_by_droplet = {}
-        # Returns a list of frame numbers.
-        self.index_by_frame = defaultdict(list)
-        # Returns a list of droplets with key (int) number of pixels.
-        self.index_by_area = defaultdict(list)
+        self.index_by_droplet = DropletIndex(self.droplet_store)
+        # Returns an array of droplet ids found in a frame.
+        self.index_by_frame = FrameDropletIndex(self.droplet_store)
+        # Returns an array of droplet ids with key (int) number of pixels.
+        self.index_by_area = AreaDropletIndex(self.droplet_store)
 
         self.second_count = 0
         self.droplet_counts_by_frame = []
+        # Seconds spent finding and measuring the droplets in each frame.
+        self.scan_seconds_by_frame = []
 
     def add_frame(self, id):
         """
         Add new frame instance to this Video.
         :return Frame object
         """
-        f = Frame(id)
-        self._frames[f.id] = f
-        return f
+        self.droplet_store.begin_frame(id)
+        return self._frames[id]
 
     def scan(self):
 
@@ -155,6 +206,13 @@ class VideoFilePreprocessor:
 
         scan_start_time = time.time()  # For shits and giggles.
 
+        if self.cache_dir:
+            cache_file_path = scan_cache_path(
+                self.cache_dir, self.video_file_path, self.threshold, self.border_width
+            )
+            if self._load_cached_scan(cache_file_path):
+                return
+
         # source = cv2.VideoCapture(self.video_file_path)
 
         self._initialize_data()
@@ -168,9 +226,6 @@ class VideoFilePreprocessor:
 
         dispenser = FrameDispenser(self.video_file_path)
 
-        # Reset master numbering for droplets, in case this isn't our first rodeo.
-        Droplet.master_count = 1
-
         while True:
 
             # Spin through all the frames.
@@ -185,6 +240,8 @@ class VideoFilePreprocessor:
 
             self._progress_indicator()
 
+            frame_start_time = time.perf_counter()
+
             # Get some droplets.
             droplets, thresholded_frame = threshold_and_find_droplets(
                 frame, self.threshold, self.border_width
@@ -201,7 +258,7 @@ class VideoFilePreprocessor:
 
             for droplet in droplets:
 
-                drp = frm.add_droplet()
+                drp = frm.add_droplet(self.id_allocator)
 
                 # Centroid is set when we add the contour, and frame number we know.
                 drp.contour = droplet
@@ -232,7 +289,7 @@ class VideoFilePreprocessor:
                     floodfill_flags,
                 )[0]
 
-                self.index(drp, frm)  # Adds droplet to convenience indices.
+            self.scan_seconds_by_frame.append(time.perf_counter() - frame_start_time)
 
         # else:
         #     break
@@ -247,6 +304,45 @@ class VideoFilePreprocessor:
                 )
             )
 
+        if self.cache_dir:
+            save_scan(cache_file_path, self.droplet_store, self.scan_seconds_by_frame)
+
+    def _load_cached_scan(self, cache_file_path):
+        """
+        Fill in the scan data from the scan cache, if there's a cache file for this
+        video file, threshold and border.
+
+        :param cache_file_path: str absolute file path
+        :return: True if the scan was loaded
+        """
+        cached_scan = load_scan(cache_file_path, spill_dir=self.spill_dir)
+        if cached_scan is None:
+            return False
+
+        droplet_store, scan_seconds_by_frame = cached_scan
+        self._initialize_data(droplet_store)
+
+        self.droplet_counts_by_frame = np.diff(
+            droplet_store.frame_starts, append=len(droplet_store)
+        ).tolist()
+        self.scan_seconds_by_frame = scan_seconds_by_frame
+
+        # Where the scan's frame dispenser would have left them.
+        self.counting_frame_number = droplet_store.frame_count
+        self.index_frame_number = droplet_store.frame_count - 1
+
+        if self.VERBOSE:
+            print(
+                "\nLoaded initial scan of {} from cache\n{}\n\nCounted {} frames and {} droplets.\n".format(
+                    self.video_file_path,
+                    cache_file_path,
+                    self.counting_frame_number,
+                    sum(self.droplet_counts_by_frame),
+                )
+            )
+
+        return True
+
     def _progress_indicator(self):
 
         # Pretty progress indicator
@@ -258,14 +354,6 @@ class VideoFilePreprocessor:
                 if self.VERBOSE:
                     print()
 
-    def index(self, droplet, frame):
-        """
-        Create index entries for droplet.
-        """
-        self.index_by_frame[frame.id].append(droplet.id)
-        self.index_by_droplet[droplet.id] = droplet
-        self.index_by_area[trunc(droplet.area)].append(droplet.id)
-
 
 class VideoFrameProcessor:
     def __init__(
@@ -278,11 +366,19 @@ class VideoFrameProcessor:
         similarity_threshold=None,
         distance_threshold=None,
         history_frames_to_consider=None,
+        assignment="greedy",
+        motion_model="none",
+        prediction_radius=10,
         border_width=None,
         video_master=None,
         corrections=None,
         hide_droplet_history_in_video=None,
         csv_file=None,
+        max_frame_droplets=None,
+        pathological_frame_policy="skip-tracking",
+        track_record=None,
+        tracking_jobs=1,
+        previous_track_record=None,
         CAPTURE_VIDEO=False,
         VERBOSE=False,
         DEBUG=False,
@@ -327,6 +423,11 @@ class VideoFrameProcessor:
         self.history = history_frames_to_consider
         # Max distance limit between related droplets
         self.distance_threshold = distance_threshold
+        # Tracker assignment engine
+        self.assignment = assignment
+        # Tracker motion prediction, and search radius around predictions
+        self.motion_model = motion_model
+        self.prediction_radius = prediction_radius
 
         self._video_master = video_master
         self.file_length_in_frames = len(video_master.frames)
@@ -349,18 +450,127 @@ class VideoFrameProcessor:
             max_y_data=max(self._video_master.droplet_counts_by_frame),
             max_y2_data=sum(self._video_master.droplet_counts_by_frame),
             y_axis_height=150,  # Hard-coded.
+            max_x_data=self.file_length_in_frames,
         )
 
-        # Initialize droplet tracker
-        self._droplet_tracker = Tracker(
-            frames_before_deregister=self.history,
-            confidence_threshold=self.similarity_threshold,
-            distance_threshold=self.distance_threshold,
-            droplet_corrections=self._corrections,
-            droplet_master=self._video_master,
+        # The frame header's file name and settings, drawn once.
+        self._header_overlay = Overlay()
+
+        # Per-frame caps and timing for pathological frames.
+        self.frame_guard = FrameGuard(
+            max_droplets=max_frame_droplets,
+            policy=pathological_frame_policy,
             VERBOSE=VERBOSE,
         )
 
+        # Initialize droplet tracker, or replay a saved one.
+        self._REPLAYING = track_record is not None
+        self._TRACKED_AHEAD = False
+        self.tracker_diagnostics = None
+        if self._REPLAYING:
+            self.track_record = track_record
+            self._droplet_tracker = TrackReplayer(
+                track_record=track_record,
+                droplet_master=self._video_master,
+                VERBOSE=VERBOSE,
+            )
+        else:
+            # Record the tracker's decisions, so the file can be rendered again
+            # without tracking it again.
+            self.track_record = TrackRecord(
+                params={
+                    "threshold": self.image_threshold,
+                    "border": self.border_width,
+                    "droplet_similarity": self.similarity_threshold,
+                    "distance_threshold": self.distance_threshold,
+                    "frame_history": self.history,
+                    "assignment": self.assignment,
+                    "motion_model": self.motion_model,
+                    "prediction_radius": self.prediction_radius,
+                    "max_frame_droplets": max_frame_droplets,
+                    "pathological_frame_policy": pathological_frame_policy,
+                    "droplet_count": len(self._video_master.droplet_store),
+                },
+                corrections=self._corrections,
+            )
+            if self.assignment == "global":
+                # Solve the whole file at once (see tracker/GlobalAssociator.py),
+                # and replay the record while rendering.
+                GlobalAssociator(
+                    frames_before_deregister=self.history,
+                    distance_threshold=self.distance_threshold,
+                    confidence_threshold=self.similarity_threshold,
+                    droplet_corrections=self._corrections,
+                    droplet_master=self._video_master,
+                    VERBOSE=VERBOSE,
+                ).associate(
+                    self.track_record,
+                    skipped_frames(
+                        self._video_master.droplet_counts_by_frame,
+                        max_frame_droplets,
+                        pathological_frame_policy,
+                    ),
+                )
+                self._TRACKED_AHEAD = True
+            elif (
+                previous_track_record is not None
+                and previous_track_record.params == self.track_record.params
+                and previous_track_record.is_complete(
+                    self._video_master.droplet_store.frame_count
+                )
+            ):
+                # Only the corrections have changed since the last analysis:
+                # track the segments they change again, and copy the rest from
+                # its record (see utils/segment_tracking.py).
+                retrack_corrections(
+                    self.track_record,
+                    previous_track_record,
+                    self._video_master,
+                    tracker_settings=self._tracker_settings(),
+                    max_frame_droplets=max_frame_droplets,
+                    pathological_frame_policy=pathological_frame_policy,
+                    VERBOSE=VERBOSE,
+                )
+                self._TRACKED_AHEAD = True
+            elif tracking_jobs > 1:
+                # Track the whole file now, in segments on a process pool (see
+                # utils/segment_tracking.py), and replay the record while rendering.
+                track_ahead(
+                    self.track_record,
+                    self._video_master,
+                    tracking_jobs,
+                    tracker_settings=self._tracker_settings(),
+                    max_frame_droplets=max_frame_droplets,
+                    pathological_frame_policy=pathological_frame_policy,
+                    VERBOSE=VERBOSE,
+                )
+                self._TRACKED_AHEAD = True
+            else:
+                # In verbose mode, record what the tracker compared and decided in
+                # each frame, for dva inspect, instead of printing it.
+                if VERBOSE:
+                    self.tracker_diagnostics = TrackerDiagnostics(
+                        params=self.track_record.params
+                    )
+                self._droplet_tracker = Tracker(
+                    droplet_master=self._video_master,
+                    diagnostics=self.tracker_diagnostics,
+                    VERBOSE=VERBOSE,
+                    **self._tracker_settings(),
+                )
+            if self._TRACKED_AHEAD:
+                self._droplet_tracker = TrackReplayer(
+                    track_record=self.track_record, droplet_master=self._video_master
+                )
+
+        # Tracker states from before each recent frame, with the running totals
+        # and graph length that go with them, so we can step back and track
+        # frames again. There's one for each frame the dispenser can back up to.
+        self._tracker_states = OrderedDict()
+        # Frames the tracker has been through, in order, since it last stepped
+        # back.
+        self._tracked_frame_count = 0
+
         (video_frame_width, video_frame_height) = self.frame_shape
 
         #
@@ -383,6 +593,18 @@ class VideoFrameProcessor:
         # if cv2.VideoWriter.isOpened(self.video_output):
         #     pass
 
+    def _tracker_settings(self):
+        # Tracker keyword arguments, the same however the file is tracked.
+        return {
+            "frames_before_deregister": self.history,
+            "confidence_threshold": self.similarity_threshold,
+            "distance_threshold": self.distance_threshold,
+            "droplet_corrections": self._corrections,
+            "assignment": self.assignment,
+            "motion_model": self.motion_model,
+            "prediction_radius": self.prediction_radius,
+        }
+
     def has_no_more_frames(self):
         if self.index_frame_number == self.file_length_in_frames:
             return True
@@ -403,9 +625,13 @@ class VideoFrameProcessor:
             self.index_frame_number = self._frame_dispenser.index_frame_number
             self.counting_frame_number = self._frame_dispenser.counting_frame_number
         if self._frame_dispenser.in_history:
-            return self._frame
-        else:
-            return self._process(self._frame, self.index_frame_number)
+            if self.index_frame_number < self._tracked_frame_count:
+                # Tracked already; show the saved frame.
+                return self._frame
+            # We stepped back and tracked an earlier frame again, so the saved
+            # frames after it are out of date. Track forward from the raw frame.
+            self._frame = self._frame_dispenser.raw_frame()
+        return self._process(self._frame, self.index_frame_number)
 
     def previous_frame(self):
         self._rescan_check()
@@ -420,6 +646,15 @@ class VideoFrameProcessor:
         return self._frame
 
     def reprocess_last_frame(self):
+        if self._file_rescan_needed:
+            # A new threshold: scan the file again, and start tracking over
+            # from this frame.
+            self._rescan_check()
+        else:
+            # Put the tracker back the way it was before this frame, so it
+            # tracks the frame afresh, instead of seeing its droplets twice.
+            self._rewind_tracker(self.index_frame_number)
+        self._frame = self._frame_dispenser.raw_frame()
         return self._process(self._frame, self.index_frame_number)
 
     def redisplay_last_processed_frame(self):
@@ -437,25 +672,120 @@ class VideoFrameProcessor:
         cv2.imwrite(self._image_capture_file_output_path, self.processed_frame)
         return self.processed_frame
 
+    def _threshold_locked(self):
+        # A replayed track record only fits the scan it was made from.
+        if self._REPLAYING:
+            printc(
+                "The threshold can't be changed when rendering a track record.", "red"
+            )
+        elif self._TRACKED_AHEAD:
+            printc(
+                "The threshold can't be changed once the whole file has been tracked.",
+                "red",
+            )
+        return self._REPLAYING or self._TRACKED_AHEAD
+
     def image_threshold_up(self):
+        if self._threshold_locked():
+            return
         self.image_threshold += self._image_threshold_increment
         self._file_rescan_needed = True
 
     def image_threshold_down(self):
+        if self._threshold_locked():
+            return
         self.image_threshold -= self._image_threshold_increment
         self._file_rescan_needed = True
 
+    def _rewind_tracker(self, index_frame_number):
+        """
+        Step the tracker back to its state before a recent frame, undoing the
+        droplet connections made since, the running totals and the graph.
+
+        :param index_frame_number: int frame number
+        """
+        if index_frame_number not in self._tracker_states:
+            return
+        (
+            tracker_state,
+            self.video_total_droplet_count,
+            self.video_total_unprocessed_droplet_count,
+            self.video_total_pixel_area,
+            graph_value_count,
+        ) = self._tracker_states[index_frame_number]
+        self._droplet_tracker.restore_state(tracker_state)
+        self._tiny_graph.rewind(graph_value_count)
+
+        # Later states are out of date; they'll be saved again going forward.
+        while next(reversed(self._tracker_states)) > index_frame_number:
+            self._tracker_states.popitem()
+        self._tracked_frame_count = index_frame_number
+
+    def _save_tracker_state(self, index_frame_number):
+        self._tracker_states[index_frame_number] = (
+            self._droplet_tracker.save_state(),
+            self.video_total_droplet_count,
+            self.video_total_unprocessed_droplet_count,
+            self.video_total_pixel_area,
+            self._tiny_graph.value_count,
+        )
+        while len(self._tracker_states) > self._frame_dispenser.history_size + 1:
+            self._tracker_states.popitem(last=False)
+
     def _rescan_check(self):
         if self._file_rescan_needed:
             self._video_master.threshold = self.image_threshold
             self._video_master.scan()
+            self._restart_tracking()
             self._file_rescan_needed = False
             self._reprocessing = True
 
+    def _restart_tracking(self):
+        """
+        Start tracking over, from the current frame, after a rescan. The tracker,
+        its saved states, the track record and the diagnostics all refer to rows
+        of the old scan, and the totals and the graph count its droplets.
+        """
+        if self._corrections:
+            # Checked against the new scan, and filed by its frames.
+            self._corrections = CorrectionIndex(
+                dict(self._corrections.items()), self._video_master.droplet_store
+            )
+        self._droplet_tracker = Tracker(
+            droplet_master=self._video_master,
+            VERBOSE=self._VERBOSE,
+            **self._tracker_settings(),
+        )
+        self._tracker_states.clear()
+        self._tracked_frame_count = self.index_frame_number
+
+        # A record only gets frames tracked from the first one on, so this one
+        # is only filled in, and saved, if tracking starts over on frame one.
+        self.track_record = TrackRecord(
+            params=dict(
+                self.track_record.params,
+                threshold=self.image_threshold,
+                droplet_count=len(self._video_master.droplet_store),
+            ),
+            corrections=self._corrections,
+        )
+        self.tracker_diagnostics = None
+
+        self.video_total_droplet_count = 0
+        self.video_total_unprocessed_droplet_count = 0
+        self.video_total_pixel_area = 0
+        self._tiny_graph.rewind(0)
+        self._tiny_graph.reset_max_y(
+            max(self._video_master.droplet_counts_by_frame),
+            sum(self._video_master.droplet_counts_by_frame),
+        )
+
     def _process(self, frame, index_frame_number):
 
         """"""
 
+        self._save_tracker_state(index_frame_number)
+
         droplet_data = self._video_master.frames[index_frame_number].droplets
         # print(
         #     "frame: {}, {} droplets found".format(index_frame_number, len(droplet_data))
@@ -463,6 +793,14 @@ class VideoFrameProcessor:
 
         self.video_total_unprocessed_droplet_count += len(droplet_data)
 
+        # Check for a pathological frame before doing anything expensive with it.
+        guard_action = self.frame_guard.start(
+            index_frame_number,
+            len(droplet_data),
+            scan_seconds=self._video_master.scan_seconds_by_frame[index_frame_number],
+        )
+        ANOMALOUS_FRAME = guard_action == "mark-anomalous"
+
         # We want the grayscale frame with the border cleaned up, but
         # we don't want the droplets.
         thresholded_frame = threshold_and_find_droplets(
@@ -495,9 +833,29 @@ class VideoFrameProcessor:
 
         # Most of the shenanigans happen here. All the droplets go out, but
         # some don't come back.
-        winnowed_droplets = self._droplet_tracker.update(
-            new_droplet_dict=droplet_data, this_frame=self.index_frame_number
-        )
+        relocation_count = self._video_master.droplet_store.relocation_count
+        if guard_action in ("skip-tracking", "mark-anomalous"):
+            # Too many droplets to track. Let the frame go by, so the history
+            # still ages, and treat every droplet in it as new.
+            self._droplet_tracker.skip_frame(this_frame=self.index_frame_number)
+            winnowed_droplets = droplet_data
+        else:
+            winnowed_droplets = self._droplet_tracker.update(
+                new_droplet_dict=droplet_data, this_frame=self.index_frame_number
+            )
+
+        self._tracked_frame_count = index_frame_number + 1
+
+        # First time through this frame? Save what the tracker decided.
+        if (
+            not self._REPLAYING
+            and index_frame_number == self.track_record.frame_count
+        ):
+            self.track_record.record_frame(
+                index_frame_number,
+                winnowed_droplets,
+                self._video_master.droplet_store.relocations(relocation_count),
+            )
 
         #
         # Beginning of pretty video frame.
@@ -549,6 +907,13 @@ class VideoFrameProcessor:
             # Get the data for this droplet.
             droplet = self._video_master.index_by_droplet[droplet_id]
 
+            if ANOMALOUS_FRAME:
+                # Anomalous frames still show their thresholded droplets, but they
+                # don't get outlines or labels, and don't count toward the totals.
+                if self._csv_file:
+                    self._update_csv_row(droplet_id, droplet)
+                continue
+
             label = labels.add_label(droplet)
 
             if not new_droplet:
@@ -594,22 +959,14 @@ class VideoFrameProcessor:
             self.video_total_pixel_area += area
 
             if self._csv_file:
-                self._csv_file.update_csv_row(
-                    str(self.counting_frame_number),
-                    str(droplet.initial_id),
-                    [
-                        droplet_id,
-                        area,
-                        "{:.2f}".format(droplet.centroid[0]),
-                        "{:.2f}".format(droplet.centroid[1]),
-                    ],
-                )
+                self._update_csv_row(droplet_id, droplet)
 
         # if self.index_frame_number >= 116:  # Debug breakpoint catcher
         #     debug_catcher = True
 
-        # Draw all the labels.
-        labels.draw(self.processed_frame)
+        # Draw all the labels, one per cluster of droplets if the frame guard
+        # says this frame is too crowded to lay out individual labels.
+        labels.draw(self.processed_frame, CLUSTERED=guard_action is not None)
 
         # Add some frame labeling.
         self.processed_frame = add_frame_header_text(
@@ -626,8 +983,14 @@ class VideoFrameProcessor:
             self.history,
             self.similarity_threshold,
             self.distance_threshold,
+            overlay=self._header_overlay,
         )
 
+        if guard_action:
+            self.processed_frame = add_degraded_frame_text(
+                self.processed_frame, guard_action, len(droplet_data)
+            )
+
         # Update and draw the droplet graph.
         if self._reprocessing:
             self._tiny_graph.reset_max_y(
@@ -641,11 +1004,11 @@ class VideoFrameProcessor:
         self._tiny_graph.canvas = self.processed_frame
         self.processed_frame = self._tiny_graph.draw_graph()
 
-        # Composite annotations on to original video frame.
-        self.processed_frame = cv2.add(
-            add_alpha_channel(frame),
-            add_alpha_channel(self.processed_frame, transparent_color=(0, 0, 0)),
-        )
+        # Composite annotations on to original video frame: a saturating add,
+        # so the black background leaves the video as it is. It's done in
+        # place, in the frame's own annotation canvas, which the dispenser
+        # keeps for its history; the raw frame is kept too, unchanged.
+        cv2.add(frame, self.processed_frame, dst=self.processed_frame)
         # Capture the output frame.
         # if self._CAPTURE_VIDEO:
         #     # Not sure if this is needed...
@@ -664,4 +1027,20 @@ class VideoFrameProcessor:
         if self._reprocessing:
             self._reprocessing = False
 
+        self.frame_guard.stop(
+            index_frame_number, 0 if ANOMALOUS_FRAME else len(winnowed_droplets)
+        )
+
         return self.processed_frame
+
+    def _update_csv_row(self, droplet_id, droplet):
+        self._csv_file.update_csv_row(
+            str(self.counting_frame_number),
+            str(droplet.initial_id),
+            [
+                droplet_id,
+                droplet.area,
+                "{:.2f}".format(droplet.centroid[0]),
+                "{:.2f}".format(droplet.centroid[1]),
+            ],
+        )